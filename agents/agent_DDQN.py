@@ -6,6 +6,8 @@ import gym
 import gym_forex
 import numpy as np
 from collections import deque
+from replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+from dcn_models import DCNCache, dcn_signature
 from keras.optimizers import Adam
 from keras import backend as K
 from keras.models import Sequential
@@ -42,14 +44,20 @@ EPSILON = 1.0       # initial exploration rate (does random action until minimum
 EPSILON_MIN = 0.005 # minimum exploration rate
 EPSILON_DECAY = 0.93   # exploration rate decay factor  
 LEARNING_RATE = 0.0001 # learning rate for the selected optimizer (sgd with momentum)
-
-# TODO: usar prioritized replay?
+PRIORITIZED = True  # sample the replays in proportion to their TD error (sum-tree replay buffer)
+PRIORITY_ALPHA = 0.6   # prioritization exponent, 0 = uniform sampling
+PRIORITY_BETA = 0.4    # initial importance-sampling exponent, it grows until 1
 
 class DQNAgent:
-    def __init__(self, state_size, action_size):
+    # env: the ForexEnv4 (unwrapped) whose dataset rebuilds the remembered observations
+    # memory_size: transitions of the replay memory (actors that do not replay use 1)
+    def __init__(self, state_size, action_size, env, memory_size=MEMORYSIZE):
         self.state_size = state_size
         self.action_size = action_size
-        self.memory = deque(maxlen=MEMORYSIZE)
+        if PRIORITIZED:
+            self.memory = PrioritizedReplayBuffer(memory_size, env, alpha=PRIORITY_ALPHA, beta=PRIORITY_BETA)
+        else:
+            self.memory = ReplayBuffer(memory_size, env)
         self.points_log = deque(maxlen=MOVINGAVERAGE)
         self.gamma = GAMMA      # discount rate used in replay
         self.epsilon = EPSILON  # exploration rate
@@ -59,6 +67,8 @@ class DQNAgent:
         self.num_vectors = NUMVECTORS # number of features
         self.vector_size = VECTORSIZE # number of ticks
         
+        # compiled models of ann2dcn, the session is shared with the agent models
+        self.dcn_cache = DCNCache(learning_rate=self.learning_rate)
         self.model = self._build_model()
         self.model_max = self.model
         self.target_model = self._build_model()
@@ -67,81 +77,10 @@ class DQNAgent:
 
     # convert an ann to a dcn model
     def ann2dcn(self, nets_ann, num_vectors, vector_size):
-        # esta funci?n debe retornar un arreglo de modelos 
-        # Deep Conv Neural Net for Deep-Q learning Model
-        models = []
-        # for each net generate a dnn model
-        for net in nets_ann:
-            # creates a new model
-            model = Sequential()
-            # node counter
-            c_node = 0
-            # initialize values from input node
-            node, act_func, agg_func, bias, response, links = net.node_evals[net.input_nodes[0]]
-            # repeat until next_node != output (add layers)
-            while true:
-                # add the layer depending on the conection to the next node:
-                # act_funct of the next node    = core layer
-                # bias of the next neuron (0.1,1) = kernel size
-                kernel_size = round(bias * max_kernel_size)
-                # response of the next node(0.1,1)= pool_size, stride
-                pool_size = round(response * max_pool_size)
-                # link.w to the next node(0,1)  = number of filters
-                filters = links[0].w
-                ##########################################################
-                # Encoding:
-                # agg_funct = min -> adds dropout, else adds conv1D
-                # agg_funct = sum -> add pooling layer
-                # agg_funct = product -> does nothing(add it as option in NEAT config)
-                # act:funct = relu -> adds relu layer
-                # act_funct = sigmoid -> adds hard-sigmoid layer
-                ##########################################################
-                # si agg_funct = min: adiciona capa dropout # TODO: add min aggregation_options in config_20_dqn
-                if agg_funct == 'min':
-                    # if its the first node:
-                    if c_node==0:
-                        model.add(Dropout(0.1, input_shape=(num_vectors, vector_size)))
-                    else:
-                        model.add(Dropout(0.1))
-                # sino es dropout adiciona una capa Conv1D (note in config that sum and product are set so a conv1d layer has double the chances than dropout (min agg_funct))
-                else:
-                    if c_node==0:
-                        model.add(Conv1D(filters, kernel_size, input_shape=(num_vectors, vector_size)))
-                    else:
-                        model.add(Conv1D(filters, kernel_size))
-                # act_funct = sigmoid: relu 
-                if act_funct == 'relu': 
-                        model.add(Activation('relu'))
-                # act_funct = tanh: hard_sigmoid
-                if act_funct == 'sigmoid': 
-                    model.add(Activation('hard_sigmoid'))
-                # agg_funct = sum:pooling, product:no-pooling
-                if agg_funct == 'sum':
-                    model.add(MaxPooling1D(pool_size=pool_size, strides=pool_size))
-                # TODO: DROPOUT SOLO SE DEBE USAR EN TRAINING, NO EN EVAL
-                # stop condition for while: until next node = output
-                if links[0].i==net.output_nodes[0]:
-                    break
-                # read values from next node
-                node, act_func, agg_func, bias, response, links = net.node_evals[links[0].i]    
-                # increment node counter
-                c_node += 1
-            # adds a dense layer with the parameters of the output node with response attribute
-            model.add(Flatten())  # this converts our 3D feature maps to 1D feature vectors
-            model.add(Dense(response*max_dense)) # valor ?ptimo:64 @400k
-            model.add(Activation('relu'))
-            # TODO: Probar con Hard sigmoid(pq controls requieren  -1,1) y relu(0,1)-> mod. controls para prueba
-            model.add(Dense(self.action_size))
-            model.add(Activation('hard_sigmoid'))
-            # multi-GPU support
-            #model = to_multi_gpu(model)
-            # use SGD optimizer
-            opt = SGD(lr=self.learning_rate)
-            model.compile(loss="mean_squared_error", optimizer=opt,
-                          metrics=["accuracy"])
-            # append model to models
-            models.append(model)
-        return models
+        # esta función debe retornar un arreglo de modelos
+        # the nets with the same layers reuse the compiled models of the cache
+        signatures = [dcn_signature(net, num_vectors, vector_size, self.action_size) for net in nets_ann]
+        return self.dcn_cache.models_of(signatures)
 
 
     def _huber_loss(self, target, prediction):
@@ -201,34 +140,46 @@ class DQNAgent:
         self.model.set_weights(self.model_max.get_weights())
 
 
-    def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+    # tick: tick_count of the info returned with next_state
+    # repetitions: times the transition counts for replay, with prioritized replay it
+    # scales its priority instead of storing copies
+    def remember(self, state, action, reward, next_state, done, tick, repetitions=1):
+        if PRIORITIZED:
+            self.memory.add(state, action, reward, next_state, done, tick, weight=repetitions)
+        else:
+            for repetition in range(int(repetitions)):
+                self.memory.add(state, action, reward, next_state, done, tick)
 
     def act(self, state):
         if np.random.rand() <= self.epsilon:
             return random.randrange(self.action_size)
         act_values = self.model.predict(state)
-        return np.argmax(act_values[0][0])  # returns action
+        return np.argmax(act_values[0])  # returns action
 
+    # double DQN replay of a minibatch: the online model chooses the next action and
+    # the target model values it, with one predict per model and one train_on_batch
     def replay(self, batch_size):
-        minibatch = random.sample(self.memory, batch_size)
-        for state, action, reward, next_state, done in minibatch:
-            target = self.model.predict(state)
-            if done:
-                target[0][action] = reward
-            else:
-                # a = self.model.predict(next_state)[0]
-                t = self.target_model.predict(next_state)[0]
-                #print("action=",action)
-                target[0][action] = reward + self.gamma * np.amax(t)
-                # target[0][action] = reward + self.gamma * t[np.argmax(a)]
-            #self.model.fit(state, target, epochs=1, verbose=0, callbacks=[self.reduce_lr])
-            
-            # TODO: DELAYED REWARD
-            # if action opens an order save the observation in tmpvar DONT DO FIT
-            # if action closes an order, half reward to open and close obs, DO FIT
-            
-            self.model.fit(state, target, epochs=1, verbose=0)
+        weights = None
+        if PRIORITIZED:
+            states, actions, rewards, next_states, dones, indexes, weights = self.memory.sample(batch_size)
+        else:
+            states, actions, rewards, next_states, dones = self.memory.sample(batch_size)
+        # online Q-values of the states and the next states in the same call
+        q = self.model.predict(np.concatenate([states, next_states]), batch_size=2 * batch_size)
+        target, q_next = q[:batch_size], q[batch_size:]
+        t = self.target_model.predict(next_states, batch_size=batch_size)
+        rows = np.arange(batch_size)
+        future = t[rows, np.argmax(q_next, axis=1)]
+        expected = rewards + np.where(dones, 0.0, self.gamma * future)
+        if PRIORITIZED:
+            self.memory.update_priorities(indexes, expected - target[rows, actions])
+        target[rows, actions] = expected
+
+        # TODO: DELAYED REWARD
+        # if action opens an order save the observation in tmpvar DONT DO FIT
+        # if action closes an order, half reward to open and close obs, DO FIT
+
+        self.model.train_on_batch(states, target, sample_weight=weights)
         if self.epsilon > self.epsilon_min:
             self.epsilon *= self.epsilon_decay
 
@@ -275,7 +226,7 @@ class DQNAgent:
         env = gym.make('ForexTrainingSet-v1')
         state_size = env.observation_space.shape[0]
         action_size = env.action_space.n
-        agent = DQNAgent(state_size, action_size)
+        agent = DQNAgent(state_size, action_size, env.unwrapped)
         print("state_size = ", state_size,", action_space = ", action_size, 
             ", replay_factor = ", REPLAYFACTOR, ", batch_size=", BATCHSIZE)
         done = False
@@ -320,15 +271,14 @@ class DQNAgent:
                             num_repetitions = 1+round((variation/max_variation)* REPMAXPROFIT)
                         else: 
                             num_repetitions = int(1)
-                        for repetition in range(int(num_repetitions)):
-                            # remember action/state for replay
-                            agent.remember(state, action, reward, next_state, done)
+                        # remember action/state for replay
+                        agent.remember(state, action, reward, next_state, done, info["tick_count"], num_repetitions)
                     # also save if balance varies, eg. if TP or SL
                     elif (balance_ant - info["balance"])!=0.0:
-                        agent.remember(state, action, reward, next_state, done)
+                        agent.remember(state, action, reward, next_state, done, info["tick_count"])
                     else:
                         if e % REMEMBERTHRESHOLD == 0:
-                            agent.remember(state, action, reward, next_state, done)
+                            agent.remember(state, action, reward, next_state, done, info["tick_count"])
                     points += reward
                 state = next_state
                 time=time+1
@@ -7,7 +7,11 @@ from gym.envs.registration import register
 from population_syn import PopulationSyn 
 # ******************************************************************
 from genome_evaluator import GenomeEvaluator
+from background_validator import BackgroundValidator
+from incremental_checkpointer import IncrementalCheckpointer
+from agent_genome import AgentGenome
 import gym
+import multiprocessing
 import sys
 import neat
 import os
@@ -15,47 +19,27 @@ import pickle
 import random
 from neat.six_util import iteritems
 from neat.six_util import itervalues
-# Multi-core machine support
-NUM_CORES = 1
 # First argument is the training dataset
 ts_f = sys.argv[1]
-# Second is validation dataset 
+# Second is validation dataset, several validation sets can be separated by commas
 vs_f = sys.argv[2]
 
 # Thirdis the config filename
 my_config = sys.argv[3]
 # fourth  argument is the  url for syngularity sync
 my_url = sys.argv[4]
+# Multi-core machine support: the fifth argument (optional) is the number of worker processes
+# of the evaluation (def: 1, evaluates in this process, 0: one per core)
+NUM_CORES = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+if NUM_CORES == 0:
+    NUM_CORES = multiprocessing.cpu_count()
+# Sixth argument (optional) is the number of genomes sent per task to a worker (def: an
+# equal share of the population per worker)
+CHUNKSIZE = int(sys.argv[6]) if len(sys.argv) > 6 else None
 # for cross-validation like training set
 index_t = 0
 
-# AgentGenome class
-class AgentGenome(neat.DefaultGenome):
-    def __init__(self, key):
-        super().__init__(key)
-        self.discount = None
 
-    def configure_new(self, config):
-        super().configure_new(config)
-        self.discount = 0.01 + 0.98 * random.random()
-
-    def configure_crossover(self, genome1, genome2, config):
-        super().configure_crossover(genome1, genome2, config)
-        self.discount = random.choice((genome1.discount, genome2.discount))
-
-    def mutate(self, config):
-        super().mutate(config)
-        self.discount += random.gauss(0.0, 0.05)
-        self.discount = max(0.01, min(0.99, self.discount))
-
-    def distance(self, other, config):
-        dist = super().distance(other, config)
-        disc_diff = abs(self.discount - other.discount)
-        return dist + disc_diff
-    
-    def __str__(self):
-        return "Reward discount: {0}\n{1}".format(self.discount, super().__str__())
-    
 def run():
     # load the config file
     local_dir = os.path.dirname(__file__)
@@ -74,10 +58,13 @@ def run():
     pop.add_reporter(stats)
     pop.add_reporter(neat.StdOutReporter(True))
     # save a checkpoint every 100 generations or 900 seconds.
-    rep = neat.Checkpointer(100, 900)
+    rep = IncrementalCheckpointer(100, 900)
     pop.add_reporter(rep)
     # class for evaluating the population
-    ec = GenomeEvaluator(ts_f,vs_f)
+    ec = GenomeEvaluator(ts_f, vs_f.split(',')[0], num_workers=NUM_CORES, chunksize=CHUNKSIZE,
+                         lockstep=True)
+    # validates the best genome of each iteration in a background process
+    validator = BackgroundValidator(config, vs_f.split(','))
     # initializes genomes fitness and gen_best just for the first time
     for g in itervalues(pop.population):
         g.fitness = -10000000.0
@@ -97,7 +84,8 @@ def run():
         try:
             # if it is not the  first iteration calculate training and validation scores
             if iteration_counter >0:
-                avg_score=ec.training_validation_score(gen_best, config)
+                avg_score = gen_best.fitness
+                validator.submit(gen_best, pop.generation)
             # if it is not the first iteration
             if iteration_counter >= 0:
                 #**************************************************************
@@ -126,7 +114,10 @@ def run():
         except KeyboardInterrupt:
             print("User break.")
             break
-    env.close()
+    validator.close()
+    rep.close()
+    pop.close()
+    ec.close()
 
 if __name__ == '__main__':
     run()
\ No newline at end of file
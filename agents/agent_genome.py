@@ -0,0 +1,33 @@
+# library with the genome of the NEAT agents, the agents, the island model and the
+# inference server import this class so the pickled genomes load in all of them
+from __future__ import print_function
+import random
+import neat
+
+
+# AgentGenome class
+class AgentGenome(neat.DefaultGenome):
+    def __init__(self, key):
+        super().__init__(key)
+        self.discount = None
+
+    def configure_new(self, config):
+        super().configure_new(config)
+        self.discount = 0.01 + 0.98 * random.random()
+
+    def configure_crossover(self, genome1, genome2, config):
+        super().configure_crossover(genome1, genome2, config)
+        self.discount = random.choice((genome1.discount, genome2.discount))
+
+    def mutate(self, config):
+        super().mutate(config)
+        self.discount += random.gauss(0.0, 0.05)
+        self.discount = max(0.01, min(0.99, self.discount))
+
+    def distance(self, other, config):
+        dist = super().distance(other, config)
+        disc_diff = abs(self.discount - other.discount)
+        return dist + disc_diff
+    
+    def __str__(self):
+        return "Reward discount: {0}\n{1}".format(self.discount, super().__str__())
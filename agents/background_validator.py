@@ -0,0 +1,76 @@
+# library for scoring the best genomes on validation sets in a background process
+from __future__ import print_function
+import json
+import multiprocessing
+import os
+import time
+import gym_forex.envs
+import neat
+from genome_evaluator import ENV_CLASS, ENV_KWARGS, GenomeEvaluator
+from population_network import create_network
+
+# background process: scores every genome of the queue on all the validation sets
+# and appends a json line per genome to log_path, until it receives None
+def validation_worker(queue, config, datasets, env_class, log_path):
+    # the scores are the ones of GenomeEvaluator.score, the envs of the evaluator are
+    # the ones of the first two validation sets
+    evaluator = GenomeEvaluator(datasets[0], datasets[min(1, len(datasets) - 1)], env_class=env_class,
+                                worker=True)
+    env = getattr(gym_forex.envs, env_class)
+    envs = [evaluator.env_t, evaluator.env_v][:len(datasets)]
+    envs += [env(dataset=dataset, **ENV_KWARGS) for dataset in datasets[2:]]
+    while 1:
+        item = queue.get()
+        if item is None:
+            break
+        generation, genome = item
+        t0 = time.time()
+        # the network is built once for all the validation sets
+        net = create_network(genome, config)
+        scores = dict((os.path.basename(d), evaluator.score(net, e)) for d, e in zip(datasets, envs))
+        result = {'generation': generation, 'genome': genome.key, 'fitness': genome.fitness,
+                  'validation': scores, 'mean': sum(scores.values()) / len(scores),
+                  'seconds': time.time() - t0}
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        print("Validation gen {0} genome {1}: mean={2:.3f} {3}".format(generation, genome.key,
+                                                                      result['mean'], scores))
+
+
+class BackgroundValidator(object):
+    """
+    Scores the best genome of each generation on several validation sets in
+    another process, so the validation does not stop the evolution.
+
+    config:   neat.Config of the genomes.
+    datasets: List of validation set csv paths.
+    log_path: File where a json line with the validation scores is appended
+              for each genome.
+    env_class: Name of the env in gym_forex.envs, it uses ENV_KWARGS.
+    """
+
+    def __init__(self, config, datasets, log_path='validation.log', env_class=ENV_CLASS):
+        self.log_path = log_path
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=validation_worker,
+                                               args=(self.queue, config, datasets, env_class, log_path))
+        self.process.daemon = True
+        self.process.start()
+
+    def submit(self, genome, generation):
+        # queues a genome, returns without waiting for its validation
+        self.queue.put((generation, genome))
+
+    def close(self):
+        # waits for the queued genomes to be validated
+        if self.process is not None:
+            self.queue.put(None)
+            self.process.join()
+            self.process = None
+
+    def results(self):
+        # returns the validation results written so far
+        if not os.path.exists(self.log_path):
+            return []
+        with open(self.log_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,172 @@
+# library for the deep convolutional networks (DCN) encoded by NEAT networks, the
+# layers of a network are decoded to a signature and the compiled keras models are
+# cached by signature, so genomes with the same layers do not build new graphs
+from __future__ import print_function
+from collections import OrderedDict
+import numpy as np
+from keras import backend as K
+from keras.models import Sequential
+from keras.layers import Conv1D, MaxPooling1D
+from keras.layers import Activation, Dropout, Flatten, Dense
+from keras.optimizers import SGD
+
+MAX_KERNEL_SIZE = 8     # kernel size of a conv layer with bias 1
+MAX_POOL_SIZE = 4       # pool size and stride of a pooling layer with response 1
+MAX_FILTERS = 64        # filters of a conv layer with a link weight of 1
+MAX_DENSE = 128         # units of the dense layer with output response 1
+
+# returns the name of an activation or aggregation function (sigmoid_activation: sigmoid)
+def _function_name(function):
+    return getattr(function, '__name__', str(function)).split('_')[0]
+
+# returns a value of the genome in 0..1 scaled to 1..maximum
+def _scale(value, maximum):
+    return min(maximum, max(1, int(round(abs(value) * maximum))))
+
+# returns the hashable layer signature of the DCN encoded by a FeedForwardNetwork
+#
+# Encoding of each hidden node, in evaluation order:
+# agg_funct = min -> adds dropout, else adds conv1D
+# agg_funct = sum -> add pooling layer
+# agg_funct = product -> does nothing(add it as option in NEAT config)
+# act:funct = relu -> adds relu layer
+# act_funct = sigmoid -> adds hard-sigmoid layer
+# bias = kernel size, response = pool size and stride, first link weight = filters
+# the response of the first output node is the size of the dense layer
+def dcn_signature(net, num_vectors, vector_size, action_size):
+    outputs = set(net.output_nodes)
+    layers = []
+    # steps left after each layer, kernels and pools never exceed them
+    length = num_vectors
+    dense = MAX_DENSE
+    for node, act_func, agg_func, bias, response, links in net.node_evals:
+        if node in outputs:
+            if node == net.output_nodes[0]:
+                dense = _scale(response, MAX_DENSE)
+            continue
+        aggregation = _function_name(agg_func)
+        activation = _function_name(act_func)
+        activation = {'relu': 'relu', 'sigmoid': 'hard_sigmoid'}.get(activation)
+        if aggregation == 'min':
+            layer = ('dropout', 0.1)
+        else:
+            kernel_size = min(_scale(bias, MAX_KERNEL_SIZE), length)
+            filters = _scale(links[0][1] if links else 1.0, MAX_FILTERS)
+            layer = ('conv', filters, kernel_size)
+            length -= kernel_size - 1
+        pool_size = 0
+        if aggregation == 'sum':
+            pool_size = min(_scale(response, MAX_POOL_SIZE), length)
+            length //= pool_size
+        layers.append(layer + (activation, pool_size))
+    return (num_vectors, vector_size, action_size, dense, tuple(layers))
+
+# returns a new compiled keras model of a signature
+def build_dcn(signature, learning_rate):
+    num_vectors, vector_size, action_size, dense, layers = signature
+    model = Sequential()
+    for c_node, layer in enumerate(layers):
+        kwargs = {'input_shape': (num_vectors, vector_size)} if c_node == 0 else {}
+        if layer[0] == 'dropout':
+            # TODO: DROPOUT SOLO SE DEBE USAR EN TRAINING, NO EN EVAL
+            model.add(Dropout(layer[1], **kwargs))
+        else:
+            model.add(Conv1D(layer[1], layer[2], **kwargs))
+        if layer[-2] is not None:
+            model.add(Activation(layer[-2]))
+        if layer[-1] > 1:
+            model.add(MaxPooling1D(pool_size=layer[-1], strides=layer[-1]))
+    if not layers:
+        model.add(Flatten(input_shape=(num_vectors, vector_size)))
+    else:
+        model.add(Flatten())  # this converts our 3D feature maps to 1D feature vectors
+    model.add(Dense(dense))
+    model.add(Activation('relu'))
+    model.add(Dense(action_size))
+    model.add(Activation('hard_sigmoid'))
+    opt = SGD(lr=learning_rate)
+    model.compile(loss="mean_squared_error", optimizer=opt, metrics=["accuracy"])
+    return model
+
+# returns new initial weights of a model of build_dcn, drawn as keras initializes the
+# Conv1D and Dense layers (glorot_uniform kernels and zero biases), in numpy so the
+# reinitialization does not add operations to the keras graph
+def initial_weights(model):
+    weights = []
+    for w in model.get_weights():
+        if w.ndim == 1:
+            weights.append(np.zeros_like(w))
+            continue
+        # the receptive field of a conv kernel multiplies its fans
+        receptive_field = int(np.prod(w.shape[:-2]))
+        fan_in = w.shape[-2] * receptive_field
+        fan_out = w.shape[-1] * receptive_field
+        limit = np.sqrt(6.0 / (fan_in + fan_out))
+        weights.append(np.random.uniform(-limit, limit, w.shape).astype(w.dtype))
+    return weights
+
+
+class DCNCache(object):
+    """
+    LRU cache of compiled DCN models by signature.
+
+    A cached model is handed out again with new initial weights (see
+    initial_weights), as if it was built again, so the models of a signature
+    do not share their initialization. The nth model requested for a signature in
+    the same call of models_of() is a different instance, so the models of a
+    generation never share weights, and the models of the previous call are
+    reused by the next one.
+
+    The graphs of evicted models stay in the keras session until clear() is
+    called, it clears the whole session, so it also invalidates the models
+    built outside the cache.
+
+    max_models:  models kept in the cache.
+    max_evicted: evictions after which models_of() clears the session before
+                 building the models (def: None, only explicit clear()).
+    """
+
+    def __init__(self, max_models=32, learning_rate=0.0001, max_evicted=None):
+        self.max_models = max_models
+        self.learning_rate = learning_rate
+        self.max_evicted = max_evicted
+        # (signature, instance): model, least recently used first
+        self.models = OrderedDict()
+        self.evicted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, signature, instance=0):
+        key = (signature, instance)
+        if key in self.models:
+            self.models.move_to_end(key)
+            model = self.models[key]
+            model.set_weights(initial_weights(model))
+            self.hits += 1
+            return model
+        self.misses += 1
+        model = build_dcn(signature, self.learning_rate)
+        self.models[key] = model
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+            self.evicted += 1
+        return model
+
+    # returns a model for each signature, equal signatures get different instances
+    def models_of(self, signatures):
+        if self.max_evicted is not None and self.evicted > self.max_evicted:
+            # the models of the previous call are not used anymore
+            self.clear()
+        counts = {}
+        models = []
+        for signature in signatures:
+            instance = counts.get(signature, 0)
+            counts[signature] = instance + 1
+            models.append(self.get(signature, instance))
+        return models
+
+    # releases the models and the keras session
+    def clear(self):
+        self.models.clear()
+        self.evicted = 0
+        K.clear_session()
@@ -0,0 +1,217 @@
+# Actor-learner DDQN: actor processes step their own ForexEnv4 with a copy of the
+# model and send their transitions to a learner process, the learner replays
+# continuously and publishes its weights, so acting and learning do not block each
+# other and the data collection scales with the cores.
+#
+# Usage: python ddqn_actor_learner.py <training_set> [num_actors]
+from __future__ import print_function
+import multiprocessing
+import os
+import sys
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+
+# transitions sent by an actor per message
+SEND_INTERVAL = 50
+# ticks between the checks of new weights in the actors
+POLL_INTERVAL = 100
+# replays between the weights published by the learner
+SYNC_INTERVAL = 20
+# replays between the updates of the target model
+TARGET_INTERVAL = 200
+
+
+# returns the training env, with the parameters of DQNAgent.evaluate
+def make_env(dataset):
+    from gym_forex.envs import ForexEnv4
+    from agent_DDQN import STOPLOSS, TAKEPROFIT, VECTORSIZE, CAPITAL
+    return ForexEnv4(dataset=dataset, volume=0.2, sl=STOPLOSS, tp=TAKEPROFIT, obsticks=VECTORSIZE,
+                     capital=CAPITAL, leverage=100)
+
+# writes the weights of a model so that readers never see a partial file
+def write_weights(path, weights):
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, *weights)
+    os.replace(tmp, path)
+
+def read_weights(path):
+    with np.load(path) as data:
+        return [data['arr_{0}'.format(i)] for i in range(len(data.files))]
+
+# returns the times a transition is remembered (0: not remembered), the rule of
+# DQNAgent.evaluate: the opened or closed orders count more if the balance varies more
+def repetitions(action, variation, max_variation, episode):
+    from agent_DDQN import REPMAXPROFIT, REMEMBERTHRESHOLD
+    if action > 0:
+        if max_variation > 0.0:
+            return int(1 + round((variation / max_variation) * REPMAXPROFIT))
+        return 1
+    if variation != 0.0:
+        return 1
+    return 1 if episode % REMEMBERTHRESHOLD == 0 else 0
+
+
+# actor process: runs episodes with a fixed exploration rate and the last weights
+# published by the learner, it sends ('transitions', index, list) with the
+# (account window, action, reward, done, tick, repetitions) of the transitions,
+# ('episode', index, episode, points, balance) and ('done', index) at the end
+def run_actor(index, dataset, epsilon, episodes, transitions, weights_path, version):
+    from agent_DDQN import DQNAgent, CAPITAL
+    env = make_env(dataset)
+    state_size = env.obs_ticks
+    agent = DQNAgent(state_size, env.action_space.n, env, memory_size=1)
+    agent.epsilon = epsilon
+    loaded = 0
+    max_variation = 0.0
+    batch = []
+    for e in range(episodes):
+        state = np.expand_dims(np.reshape(env.reset(), [agent.num_vectors, state_size]), axis=0)
+        time = 0
+        points = 0.0
+        done = False
+        balance_ant = CAPITAL
+        while not done:
+            if time % POLL_INTERVAL == 0 and version.value > loaded:
+                # a version published meanwhile only makes the weights newer
+                loaded = version.value
+                agent.model.set_weights(read_weights(weights_path))
+            action = agent.act(state) if time > state_size else 0
+            next_state, reward, done, info = env.step(action)
+            next_state = np.expand_dims(np.reshape(next_state, [agent.num_vectors, state_size]), axis=0)
+            if time > state_size:
+                variation = abs(info["balance"] - balance_ant)
+                if action > 0:
+                    max_variation = max(max_variation, variation)
+                times = repetitions(action, variation, max_variation, e)
+                if times > 0:
+                    batch.append((agent.memory.window(state, next_state), action, reward, done,
+                                  info["tick_count"], times))
+                points += reward
+            if len(batch) >= SEND_INTERVAL or (done and batch):
+                transitions.put(('transitions', index, batch))
+                batch = []
+            state = next_state
+            time += 1
+            balance_ant = info["balance"]
+        transitions.put(('episode', index, e, points, info["balance"]))
+    transitions.put(('done', index))
+
+# returns the messages of the queue, waits for the first one if block
+def drain(transitions, block):
+    messages = []
+    try:
+        messages.append(transitions.get(block, 1.0))
+        while 1:
+            messages.append(transitions.get_nowait())
+    except queue.Empty:
+        pass
+    return messages
+
+# learner process: stores the transitions of the actors in its replay memory and
+# replays a minibatch per iteration, it returns the best episode points in results
+def run_learner(dataset, num_actors, batch_size, transitions, weights_path, version, results):
+    from agent_DDQN import DQNAgent, PRIORITIZED
+    env = make_env(dataset)
+    agent = DQNAgent(env.obs_ticks, env.action_space.n, env)
+    write_weights(weights_path, agent.model.get_weights())
+    version.value += 1
+    running = num_actors
+    replays = 0
+    best_performance = None
+    while running > 0:
+        # the learner only waits for the actors while it has too few transitions
+        for message in drain(transitions, len(agent.memory) <= batch_size):
+            if message[0] == 'transitions':
+                for window, action, reward, done, tick, times in message[2]:
+                    if PRIORITIZED:
+                        agent.memory.add_window(window, action, reward, done, tick, times)
+                    else:
+                        for repetition in range(times):
+                            agent.memory.add_window(window, action, reward, done, tick)
+            elif message[0] == 'episode':
+                index, e, points, balance = message[1:]
+                print("Actor {0} Ep{1} Bal={2}, points:{3}, replays:{4}".format(index, e, balance, points, replays))
+                if best_performance is None or points > best_performance:
+                    best_performance = points
+                    agent.save("forexv3-ddqn.h5")
+            else:
+                running -= 1
+        if len(agent.memory) > batch_size:
+            agent.replay(batch_size)
+            replays += 1
+            if replays % SYNC_INTERVAL == 0:
+                write_weights(weights_path, agent.model.get_weights())
+                version.value += 1
+            if replays % TARGET_INTERVAL == 0:
+                agent.update_target_model()
+    results.put((best_performance, replays))
+
+
+class ActorLearner(object):
+    """
+    Trains the DDQN agent with num_actors actor processes and a learner process.
+
+    Actor i explores with epsilon ** (1 + alpha * i / (num_actors - 1)), so the
+    actors go from exploring much to exploring little.
+
+    dataset:      CSV of the training set.
+    num_actors:   Actor processes (def: cores - 1).
+    episodes:     Episodes of each actor.
+    batch_size:   Transitions of each replay.
+    weights_path: File of the weights published by the learner.
+    """
+
+    def __init__(self, dataset, num_actors=None, episodes=100, batch_size=32, epsilon=0.4, alpha=7.0,
+                 weights_path='ddqn-weights.npz'):
+        self.dataset = dataset
+        self.num_actors = num_actors or max(1, multiprocessing.cpu_count() - 1)
+        self.episodes = episodes
+        self.batch_size = batch_size
+        self.epsilon = epsilon
+        self.alpha = alpha
+        self.weights_path = weights_path
+
+    def epsilons(self):
+        if self.num_actors == 1:
+            return [self.epsilon]
+        return [self.epsilon ** (1 + self.alpha * i / (self.num_actors - 1.0)) for i in range(self.num_actors)]
+
+    def run(self):
+        # returns the best episode points and the number of replays of the learner
+        # each process builds its own keras session
+        ctx = multiprocessing.get_context('spawn')
+        transitions = ctx.Queue(maxsize=100 * self.num_actors)
+        version = ctx.Value('i', 0)
+        results = ctx.Queue()
+        learner = ctx.Process(target=run_learner, args=(self.dataset, self.num_actors, self.batch_size,
+                                                        transitions, self.weights_path, version, results))
+        learner.start()
+        actors = []
+        for index, epsilon in enumerate(self.epsilons()):
+            p = ctx.Process(target=run_actor, args=(index, self.dataset, epsilon, self.episodes, transitions,
+                                                    self.weights_path, version))
+            p.start()
+            actors.append(p)
+        result = None
+        while result is None:
+            try:
+                result = results.get(True, 1.0)
+            except queue.Empty:
+                # a failed actor never sends its done message
+                if not learner.is_alive() or any(p.exitcode not in (None, 0) for p in actors):
+                    for p in actors + [learner]:
+                        p.terminate()
+                    raise RuntimeError("An actor or the learner process failed")
+        for p in actors:
+            p.join()
+        learner.join()
+        return result
+
+
+if __name__ == '__main__':
+    num_actors = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    best, replays = ActorLearner(sys.argv[1], num_actors).run()
+    print("Best points: {0}, replays: {1}".format(best, replays))
@@ -0,0 +1,82 @@
+# library for sharing the stored episodes with the pool workers through a memory-mapped file
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import numpy as np
+
+# memory maps opened by this process, by path
+_maps = {}
+
+
+class SharedEpisodeStore(object):
+    """
+    Append-only file of episode rows shared with the worker processes.
+
+    The rows of each new episode are appended to the file, handle() returns a
+    small tuple that identifies the live episodes and open_episodes(handle)
+    maps them in any process without copying or pickling them. When the rows
+    of discarded episodes outnumber the live ones, the live rows are moved to
+    a new file.
+
+    num_columns: values per row.
+    directory:   parent of the temporary directory of the files (def: system).
+    """
+
+    def __init__(self, num_columns, directory=None):
+        self.num_columns = num_columns
+        self.directory = tempfile.mkdtemp(prefix='episodes_', dir=directory)
+        self.version = 0
+        self.path = os.path.join(self.directory, 'episodes-0')
+        open(self.path, 'wb').close()
+        # rows in the file, first live row and lengths of the live episodes
+        self.rows = 0
+        self.start = 0
+        self.lengths = []
+
+    def append(self, data):
+        # appends the rows of an episode
+        data = np.ascontiguousarray(data, dtype=np.float64).reshape(-1, self.num_columns)
+        with open(self.path, 'ab') as f:
+            f.write(data.tobytes())
+        self.rows += len(data)
+        self.lengths.append(len(data))
+
+    def keep_last(self, num_episodes):
+        # discards all but the last num_episodes episodes
+        if len(self.lengths) > num_episodes:
+            self.start += sum(self.lengths[:len(self.lengths) - num_episodes])
+            self.lengths = self.lengths[len(self.lengths) - num_episodes:]
+        if self.start > self.rows - self.start:
+            self._compact()
+
+    def _compact(self):
+        live, lengths = open_episodes(self.handle())
+        self.version += 1
+        path = os.path.join(self.directory, 'episodes-{0}'.format(self.version))
+        live.tofile(path)
+        _maps.pop(self.path, None)
+        os.remove(self.path)
+        self.path = path
+        self.rows -= self.start
+        self.start = 0
+
+    def handle(self):
+        # (path, first row, last row + 1, columns, episode lengths) of the live episodes
+        return (self.path, self.start, self.rows, self.num_columns, tuple(self.lengths))
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+# returns a read-only (rows x columns) view of the episodes of a handle and their lengths
+def open_episodes(handle):
+    path, start, end, num_columns, lengths = handle
+    mm = _maps.get(path)
+    if mm is None or len(mm) < end:
+        # the files of older versions are not used anymore
+        _maps.clear()
+        mm = np.memmap(path, dtype=np.float64, mode='r', shape=(end, num_columns)) if end > 0 else \
+            np.zeros((0, num_columns))
+        _maps[path] = mm
+    return mm[start:end], lengths
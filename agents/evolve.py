@@ -18,8 +18,13 @@ import random
 import time
 
 import visualize
+from functools import partial
+from population_network import PopulationNetwork, create_network, ensemble_network, ensemble_vote, supported
+from episode_store import SharedEpisodeStore, open_episodes
 
 NUM_CORES = 8
+# the discount kernels and discounted rewards are cached for discounts rounded to this step
+DISCOUNT_QUANTUM = 1e-4
 
 env = gym.make('LunarLander-v2')
 
@@ -56,83 +61,19 @@ class LanderGenome(neat.DefaultGenome):
         return "Reward discount: {0}\n{1}".format(self.discount,
                                                   super().__str__())
 
+# compiled models of ann2dcn, created on the first call
+dcn_cache = None
+
 # convert an ann to a dcn model
 def ann2dcn(self, nets_ann, num_vectors, vector_size):
-    # esta funci?n debe retornar un arreglo de modelos 
-    # Deep Conv Neural Net for Deep-Q learning Model
-    models = []
-    # for each net generate a dnn model
-    for net in nets_ann:
-        # creates a new model
-        model = Sequential()
-        # node counter
-        c_node = 0
-        # initialize values from input node
-        node, act_func, agg_func, bias, response, links = net.node_evals[net.input_nodes[0]]
-        # repeat until next_node != output (add layers)
-        while true:
-            # add the layer depending on the conection to the next node:
-            # act_funct of the next node    = core layer
-            # bias of the next neuron (0.1,1) = kernel size
-            kernel_size = round(bias * max_kernel_size)
-            # response of the next node(0.1,1)= pool_size, stride
-            pool_size = round(response * max_pool_size)
-            # link.w to the next node(0,1)  = number of filters
-            filters = links[0].w
-            ##########################################################
-            # Encoding:
-            # agg_funct = min -> adds dropout, else adds conv1D
-            # agg_funct = sum -> add pooling layer
-            # agg_funct = product -> does nothing(add it as option in NEAT config)
-            # act:funct = relu -> adds relu layer
-            # act_funct = sigmoid -> adds hard-sigmoid layer
-            ##########################################################
-            # si agg_funct = min: adiciona capa dropout # TODO: add min aggregation_options in config_20_dqn
-            if agg_funct == 'min':
-                # if its the first node:
-                if c_node==0:
-                    model.add(Dropout(0.1, input_shape=(num_vectors, vector_size)))
-                else:
-                    model.add(Dropout(0.1))
-            # sino es dropout adiciona una capa Conv1D (note in config that sum and product are set so a conv1d layer has double the chances than dropout (min agg_funct))
-            else:
-                if c_node==0:
-                    model.add(Conv1D(filters, kernel_size, input_shape=(num_vectors, vector_size)))
-                else:
-                    model.add(Conv1D(filters, kernel_size))
-            # act_funct = sigmoid: relu 
-            if act_funct == 'relu': 
-                    model.add(Activation('relu'))
-            # act_funct = tanh: hard_sigmoid
-            if act_funct == 'sigmoid': 
-                model.add(Activation('hard_sigmoid'))
-            # agg_funct = sum:pooling, product:no-pooling
-            if agg_funct == 'sum':
-                model.add(MaxPooling1D(pool_size=pool_size, strides=pool_size))
-            # TODO: DROPOUT SOLO SE DEBE USAR EN TRAINING, NO EN EVAL
-            # stop condition for while: until next node = output
-            if links[0].i==net.output_nodes[0]:
-                break
-            # read values from next node
-            node, act_func, agg_func, bias, response, links = net.node_evals[links[0].i]    
-            # increment node counter
-            c_node += 1
-        # adds a dense layer with the parameters of the output node with response attribute
-        model.add(Flatten())  # this converts our 3D feature maps to 1D feature vectors
-        model.add(Dense(response*max_dense)) # valor ?ptimo:64 @400k
-        model.add(Activation('relu'))
-        # TODO: Probar con Hard sigmoid(pq controls requieren  -1,1) y relu(0,1)-> mod. controls para prueba
-        model.add(Dense(self.action_size))
-        model.add(Activation('hard_sigmoid'))
-        # multi-GPU support
-        #model = to_multi_gpu(model)
-        # use SGD optimizer
-        opt = SGD(lr=self.learning_rate)
-        model.compile(loss="mean_squared_error", optimizer=opt,
-                      metrics=["accuracy"])
-        # append model to models
-        models.append(model)
-    return models
+    global dcn_cache
+    # keras is only needed by the dcn models
+    from dcn_models import DCNCache, dcn_signature
+    if dcn_cache is None:
+        dcn_cache = DCNCache(learning_rate=self.learning_rate)
+    # the nets with the same layers reuse the compiled models of the cache
+    signatures = [dcn_signature(net, num_vectors, vector_size, self.action_size) for net in nets_ann]
+    return dcn_cache.models_of(signatures)
 
 
 def compute_fitness(genome, net, episodes, min_reward, max_reward):
@@ -155,10 +96,123 @@ def compute_fitness(genome, net, episodes, min_reward, max_reward):
     return reward_error
 
 
+# runs num_episodes episodes controlled by the vote of the genomes, batch episodes run
+# together, each one in its own env, with one activation of all the networks per tick
+# (per network if a genome is not supported by population_network). yields (score,
+# steps) of each episode in order, so the caller can stop early
+def ensemble_episodes(genomes, config, num_episodes, batch=10):
+    net = ensemble_network(genomes, config)
+    envs = [gym.make('LunarLander-v2') for i in range(min(batch, num_episodes))]
+    try:
+        for first in range(0, num_episodes, batch):
+            n = min(batch, num_episodes - first)
+            observations = np.array([envs[e].reset() for e in range(n)])
+            scores = [0.0] * n
+            steps = [0] * n
+            active = list(range(n))
+            while active:
+                actions = ensemble_vote(net, observations[active])
+                running = []
+                for e, action in zip(active, actions):
+                    observation, reward, done, info = envs[e].step(action)
+                    observations[e] = observation
+                    scores[e] += reward
+                    steps[e] += 1
+                    if not done:
+                        running.append(e)
+                active = running
+            for result in zip(scores, steps):
+                yield result
+    finally:
+        for e in envs:
+            e.close()
+
+
+# returns the discount kernel of a discount already quantized
+def discount_kernel(discount):
+    m = int(round(np.log(0.01) / np.log(discount)))
+    return m, discount ** (m - np.arange(m + 1))
+
+
+class EpisodeMatrix(object):
+    """
+    The stored test episodes stacked in arrays, so a network is activated over
+    all their rows at once.
+
+    data: rows x 10 (observation, action, reward) of the episodes, lengths: rows
+    of each episode.
+    observations: rows x 8 observations, actions: action of each row.
+    returns(discount): normalized discounted rewards of all the rows for a
+    quantized discount, calculated once per discount.
+    """
+
+    def __init__(self, data, lengths, min_reward, max_reward):
+        self.num_episodes = len(lengths)
+        self.rewards = np.split(data[:, -1], np.cumsum(lengths)[:-1]) if lengths else []
+        self.observations = data[:, :8]
+        self.actions = data[:, 8].astype(np.intp)
+        self.min_reward = min_reward
+        self.max_reward = max_reward
+        self.cache = {}
+
+    def returns(self, discount):
+        key = int(round(discount / DISCOUNT_QUANTUM))
+        if key not in self.cache:
+            m, kernel = discount_kernel(key * DISCOUNT_QUANTUM)
+            dr = np.concatenate([np.convolve(rewards, kernel)[m:] for rewards in self.rewards])
+            dr = 2 * (dr - self.min_reward) / (self.max_reward - self.min_reward) - 1.0
+            self.cache[key] = np.clip(dr, -1.0, 1.0)
+        return self.cache[key]
+
+
+# matrix of the last episode store handle used in this process, its cached returns
+# are reused while the stored episodes do not change
+_matrix = [None, None]
+
+# returns the EpisodeMatrix of the episodes of a store handle, mapped without copies
+def stored_matrix(handle, min_reward, max_reward):
+    key = (handle, min_reward, max_reward)
+    if _matrix[0] != key:
+        data, lengths = open_episodes(handle)
+        _matrix[0] = key
+        _matrix[1] = EpisodeMatrix(data, lengths, min_reward, max_reward)
+    return _matrix[1]
+
+# returns the (score, data) episodes of a store handle, as compute_fitness uses them
+def stored_episodes(handle):
+    data, lengths = open_episodes(handle)
+    episodes = []
+    for rows in np.split(data, np.cumsum(lengths)[:-1]) if lengths else []:
+        episodes.append((np.sum(rows[:, -1]), rows))
+    return episodes
+
+
+# batched compute_fitness: one activation of the network over all the rows of the
+# episodes and the outputs of the chosen actions gathered with fancy indexing
+def compute_fitness_batched(genome, config, matrix):
+    net = PopulationNetwork([genome], config)
+    outputs = net.activate(matrix.observations[None, :, :])[0]
+    chosen = outputs[np.arange(len(matrix.actions)), matrix.actions]
+    return (chosen - matrix.returns(genome.discount)) ** 2
+
+# fitness of a chunk of genomes in a pool worker, the episodes are read from the store
+def batched_fitness(genomes, config, handle, min_reward, max_reward):
+    matrix = stored_matrix(handle, min_reward, max_reward)
+    return [-np.sum(compute_fitness_batched(g, config, matrix)) / matrix.num_episodes for g in genomes]
+
+# compute_fitness in a pool worker, only the genome and the store handle are sent
+def stored_fitness(genome, config, handle, min_reward, max_reward):
+    net = create_network(genome, config)
+    return compute_fitness(genome, net, stored_episodes(handle), min_reward, max_reward)
+
+
 class PooledErrorCompute(object):
     def __init__(self):
         self.pool = None if NUM_CORES < 2 else multiprocessing.Pool(NUM_CORES)
         self.test_episodes = []
+        # the test episodes are also appended to a memory-mapped file shared with the
+        # workers, so they are not pickled for every task
+        self.store = SharedEpisodeStore(10)
         self.generation = 0
 
         self.min_reward = -200
@@ -194,6 +248,7 @@ class PooledErrorCompute(object):
             self.episode_length.append(step)
 
             self.test_episodes.append((score, data))
+            self.store.append(data)
 
         print("Score range [{:.3f}, {:.3f}]".format(min(scores), max(scores)))
 
@@ -203,7 +258,7 @@ class PooledErrorCompute(object):
         t0 = time.time()
         nets = []
         for gid, g in genomes:
-            nets.append((g, neat.nn.FeedForwardNetwork.create(g, config)))
+            nets.append((g, create_network(g, config)))
 
         print("network creation time {0}".format(time.time() - t0))
         t0 = time.time()
@@ -211,6 +266,7 @@ class PooledErrorCompute(object):
         # Periodically generate a new set of episodes for comparison.
         if 1 == self.generation % 10:
             self.test_episodes = self.test_episodes[-300:]
+            self.store.keep_last(300)
             self.simulate(nets)
             print("simulation run time {0}".format(time.time() - t0))
             t0 = time.time()
@@ -218,15 +274,31 @@ class PooledErrorCompute(object):
         # Assign a composite fitness to each genome; genomes can make progress either
         # by improving their total reward or by making more accurate reward estimates.
         print("Evaluating {0} test episodes".format(len(self.test_episodes)))
-        if self.pool is None:
+        handle = self.store.handle()
+        if all(supported(g, config) for gid, g in genomes):
+            # the workers map the stored episodes, only the genomes are sent
+            population = [g for gid, g in genomes]
+            if self.pool is None:
+                fitnesses = batched_fitness(population, config, handle, self.min_reward, self.max_reward)
+            else:
+                size = -(-len(population) // NUM_CORES)
+                chunks = [population[i:i + size] for i in range(0, len(population), size)]
+                fitnesses = []
+                for chunk in self.pool.map(partial(batched_fitness, config=config, handle=handle,
+                                                   min_reward=self.min_reward, max_reward=self.max_reward),
+                                           chunks):
+                    fitnesses.extend(chunk)
+            for genome, fitness in zip(population, fitnesses):
+                genome.fitness = fitness
+        elif self.pool is None:
             for genome, net in nets:
                 reward_error = compute_fitness(genome, net, self.test_episodes, self.min_reward, self.max_reward)
                 genome.fitness = -np.sum(reward_error) / len(self.test_episodes)
         else:
             jobs = []
             for genome, net in nets:
-                jobs.append(self.pool.apply_async(compute_fitness,
-                    (genome, net, self.test_episodes, self.min_reward, self.max_reward)))
+                jobs.append(self.pool.apply_async(stored_fitness,
+                    (genome, config, handle, self.min_reward, self.max_reward)))
 
             for job, (genome_id, genome) in zip(jobs, genomes):
                 reward_error = job.get(timeout=None)
@@ -277,32 +349,12 @@ def run():
 
             # Use the best genomes seen so far as an ensemble-ish control system.
             best_genomes = stats.best_unique_genomes(3)
-            best_networks = []
-            for g in best_genomes:
-                best_networks.append(neat.nn.FeedForwardNetwork.create(g, config))
 
             solved = True
             best_scores = []
-            for k in range(100):
-                observation = env.reset()
-                score = 0
-                step = 0
-                while 1:
-                    step += 1
-                    # Use the total reward estimates from all five networks to
-                    # determine the best action given the current state.
-                    votes = np.zeros((4,))
-                    for n in best_networks:
-                        output = n.activate(observation)
-                        votes[np.argmax(output)] += 1
-
-                    best_action = np.argmax(votes)
-                    observation, reward, done, info = env.step(best_action)
-                    score += reward
-                    env.render()
-                    if done:
-                        break
-
+            # the networks vote the action with one batched activation per tick, and
+            # 10 episodes run together
+            for k, (score, step) in enumerate(ensemble_episodes(best_genomes, config, 100)):
                 ec.episode_score.append(score)
                 ec.episode_length.append(step)
 
@@ -334,6 +386,7 @@ def run():
             break
 
     env.close()
+    ec.store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,90 @@
+# library for caching the fitness of genomes between generations and runs
+from __future__ import print_function
+import hashlib
+import json
+import sqlite3
+import time
+from neat.six_util import iteritems
+
+# returns a hash of everything that changes the output of the network of a genome:
+# the enabled connections, the node parameters and the discount (AgentGenome)
+def genome_hash(genome, config):
+    nodes = sorted((key, repr(ng.bias), repr(ng.response), ng.activation, ng.aggregation)
+                   for key, ng in iteritems(genome.nodes))
+    connections = sorted((key, repr(cg.weight)) for key, cg in iteritems(genome.connections) if cg.enabled)
+    canonical = repr((config.genome_config.input_keys, config.genome_config.output_keys,
+                      nodes, connections, repr(getattr(genome, 'discount', None))))
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+# returns a hash of the dataset contents and the env class and parameters, the
+# fitness of a genome is only valid for the same context
+def context_hash(dataset, env_class, env_kwargs):
+    h = hashlib.sha1()
+    with open(dataset, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    h.update(env_class.encode('utf-8'))
+    h.update(json.dumps(env_kwargs, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+class FitnessCache(object):
+    """
+    On-disk cache of genome fitness with least recently used eviction.
+
+    The entries are stored in a sqlite database, so the cache survives the
+    restore of a checkpoint. GenomeEvaluator only reads and writes it in the
+    main process, the pool workers never see it. sqlite locks the file, so the
+    evaluators of several processes (islands) can open the same cache.
+
+    path:        File of the sqlite database.
+    max_entries: Maximum number of entries, the least recently used ones are
+                 removed when it is exceeded.
+    """
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # waits for the locks of other processes instead of failing
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS fitness (key TEXT PRIMARY KEY, "
+                        "fitness REAL, last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS fitness_last_used ON fitness (last_used)")
+        self.db.commit()
+
+    # returns a dict key:fitness of the keys found in the cache
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            block = keys[i:i + 500]
+            rows = self.db.execute("SELECT key, fitness FROM fitness WHERE key IN ({0})".format(
+                ','.join('?' * len(block))), block).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            self.db.executemany("UPDATE fitness SET last_used=? WHERE key=?", [(now, k) for k in found])
+            self.db.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    # stores a dict key:fitness and evicts the least recently used entries
+    def put_many(self, fitnesses):
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO fitness (key, fitness, last_used) VALUES (?, ?, ?)",
+                            [(k, float(f), now) for k, f in iteritems(fitnesses)])
+        count = self.db.execute("SELECT COUNT(*) FROM fitness").fetchone()[0]
+        if count > self.max_entries:
+            self.db.execute("DELETE FROM fitness WHERE key IN (SELECT key FROM fitness "
+                            "ORDER BY last_used LIMIT ?)", (count - self.max_entries,))
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM fitness").fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,156 @@
+# library for a compact binary format of NEAT genomes, used instead of pickle for
+# migrations and checkpoints, decoding it never executes code from the payload
+from __future__ import print_function
+import itertools
+import json
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b'GFXG'
+VERSION = 1
+# magic, version, float size (4 or 8), length of the json metadata
+HEADER = struct.Struct('<4sBBI')
+
+# column dtypes of the gene tables, f is replaced by the float dtype
+GENOME_COLUMNS = [('key', '<i4'), ('fitness', '<f8'), ('discount', 'f'), ('num_nodes', '<i4'),
+                  ('num_connections', '<i4')]
+NODE_COLUMNS = [('key', '<i4'), ('bias', 'f'), ('response', 'f'), ('activation', 'u1'), ('aggregation', 'u1')]
+CONNECTION_COLUMNS = [('input', '<i4'), ('output', '<i4'), ('weight', 'f'), ('enabled', 'u1')]
+
+
+def _dtype(columns, float_dtype):
+    return [(name, float_dtype if t == 'f' else t) for name, t in columns]
+
+def _nan(value):
+    return np.nan if value is None else value
+
+# returns the bytes of a list of genomes
+# dtype: float dtype of the gene parameters, float32 for migrations, float64 is lossless
+def encode_genomes(genomes, dtype=np.float32):
+    float_dtype = np.dtype(dtype).newbyteorder('<')
+    activations = sorted(set(ng.activation for g in genomes for ng in g.nodes.values()))
+    aggregations = sorted(set(ng.aggregation for g in genomes for ng in g.nodes.values()))
+    activation_index = dict((name, i) for i, name in enumerate(activations))
+    aggregation_index = dict((name, i) for i, name in enumerate(aggregations))
+    table = np.zeros(len(genomes), dtype=_dtype(GENOME_COLUMNS, float_dtype))
+    nodes = []
+    connections = []
+    for i, g in enumerate(genomes):
+        table[i] = (g.key, _nan(g.fitness), _nan(getattr(g, 'discount', None)), len(g.nodes), len(g.connections))
+        for key, ng in sorted(g.nodes.items()):
+            nodes.append((key, ng.bias, ng.response, activation_index[ng.activation],
+                          aggregation_index[ng.aggregation]))
+        for key, cg in sorted(g.connections.items()):
+            connections.append((key[0], key[1], cg.weight, cg.enabled))
+    nodes = np.array(nodes, dtype=_dtype(NODE_COLUMNS, float_dtype))
+    connections = np.array(connections, dtype=_dtype(CONNECTION_COLUMNS, float_dtype))
+    meta = json.dumps({'activations': activations, 'aggregations': aggregations}).encode('utf-8')
+    # column by column, the values of a column compress better together
+    body = b''.join([table[name].tobytes() for name, t in GENOME_COLUMNS] +
+                    [nodes[name].tobytes() for name, t in NODE_COLUMNS] +
+                    [connections[name].tobytes() for name, t in CONNECTION_COLUMNS])
+    header = HEADER.pack(MAGIC, VERSION, float_dtype.itemsize, len(meta))
+    return header + zlib.compress(meta + struct.pack('<I', len(genomes)) + body, 9)
+
+# reads the columns of a table from body at offset, returns (columns, new offset)
+def _read_columns(body, offset, columns, float_dtype, rows):
+    values = {}
+    for name, t in columns:
+        dtype = np.dtype(float_dtype if t == 'f' else t)
+        size = dtype.itemsize * rows
+        if offset + size > len(body):
+            raise ValueError("Truncated genome data")
+        # python lists, faster than numpy scalars when building the genes
+        values[name] = np.frombuffer(body, dtype=dtype, count=rows, offset=offset).tolist()
+        offset += size
+    return values, offset
+
+# returns the list of genomes of data, created with the genome type of config, raises
+# ValueError if data is not valid genome data
+def decode_genomes(data, config):
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated genome data")
+    magic, version, float_size, meta_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not genome data")
+    if version != VERSION:
+        raise ValueError("Unsupported genome data version {0}".format(version))
+    if float_size not in (4, 8):
+        raise ValueError("Unsupported float size {0}".format(float_size))
+    float_dtype = '<f{0}'.format(float_size)
+    try:
+        body = zlib.decompress(data[HEADER.size:])
+    except zlib.error as e:
+        raise ValueError("Corrupt genome data: {0}".format(e))
+    if meta_size + 4 > len(body):
+        raise ValueError("Truncated genome data")
+    # json and utf-8 errors are ValueErrors
+    meta = json.loads(body[:meta_size].decode('utf-8'))
+    if not isinstance(meta, dict) or not isinstance(meta.get('activations'), list) or \
+            not isinstance(meta.get('aggregations'), list):
+        raise ValueError("Corrupt genome data: invalid metadata")
+    count = struct.unpack_from('<I', body, meta_size)[0]
+    offset = meta_size + 4
+    table, offset = _read_columns(body, offset, GENOME_COLUMNS, float_dtype, count)
+    if min(table['num_nodes'] + table['num_connections'] + [0]) < 0:
+        raise ValueError("Corrupt genome data: negative gene count")
+    nodes, offset = _read_columns(body, offset, NODE_COLUMNS, float_dtype, sum(table['num_nodes']))
+    connections, offset = _read_columns(body, offset, CONNECTION_COLUMNS, float_dtype,
+                                        sum(table['num_connections']))
+    if offset != len(body):
+        raise ValueError("Corrupt genome data: {0} trailing bytes".format(len(body) - offset))
+    activations = meta['activations']
+    aggregations = meta['aggregations']
+    if max(nodes['activation'] + [-1]) >= len(activations) or \
+            max(nodes['aggregation'] + [-1]) >= len(aggregations):
+        raise ValueError("Corrupt genome data: unknown activation or aggregation")
+    genome_config = config.genome_config
+    # the names come from the peer, the networks of this process only know the functions of config
+    for name in activations:
+        if not isinstance(name, str) or not genome_config.activation_defs.is_valid(name):
+            raise ValueError("Unknown activation function {0!r}".format(name))
+    for name in aggregations:
+        if not isinstance(name, str) or not genome_config.aggregation_function_defs.is_valid(name):
+            raise ValueError("Unknown aggregation function {0!r}".format(name))
+    genomes = []
+    n = 0
+    c = 0
+    for i in range(count):
+        g = config.genome_type(table['key'][i])
+        fitness = table['fitness'][i]
+        # nan is the only value different from itself
+        g.fitness = None if fitness != fitness else fitness
+        if hasattr(g, 'discount'):
+            discount = table['discount'][i]
+            g.discount = None if discount != discount else discount
+        for j in range(n, n + table['num_nodes'][i]):
+            ng = genome_config.node_gene_type(nodes['key'][j])
+            ng.bias = nodes['bias'][j]
+            ng.response = nodes['response'][j]
+            ng.activation = activations[nodes['activation'][j]]
+            ng.aggregation = aggregations[nodes['aggregation'][j]]
+            g.nodes[ng.key] = ng
+        n += table['num_nodes'][i]
+        for j in range(c, c + table['num_connections'][i]):
+            key = (connections['input'][j], connections['output'][j])
+            cg = genome_config.connection_gene_type(key)
+            cg.weight = connections['weight'][j]
+            cg.enabled = bool(connections['enabled'][j])
+            g.connections[key] = cg
+        c += table['num_connections'][i]
+        genomes.append(g)
+    return genomes
+
+# moves the node indexer of config past the node keys of genomes decoded from another
+# process, which has its own indexer, so the nodes that the mutations of this process
+# add to them never take a key they already have
+def reserve_node_keys(genomes, config):
+    genome_config = config.genome_config
+    keys = [key for g in genomes for key in g.nodes]
+    if not keys:
+        return
+    first = max(keys) + 1
+    if genome_config.node_indexer is not None:
+        first = max(first, next(genome_config.node_indexer))
+    genome_config.node_indexer = itertools.count(first)
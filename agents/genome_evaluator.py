@@ -1,9 +1,12 @@
 # library for ann genome evaluation
 from __future__ import print_function
 from copy import deepcopy
+from functools import partial
 import gym
 import gym.wrappers
 import gym_forex
+import gym_forex.envs
+from gym_forex.early_stopping import EarlyStopping
 import json
 #import matplotlib.pyplot as plt
 import multiprocessing
@@ -17,32 +20,95 @@ import random
 import sys
 import time
 #import visualize
+from population_network import PopulationNetwork, create_network, ensemble_network, ensemble_vote, supported
+from fitness_cache import FitnessCache, genome_hash, context_hash
 from gym.envs.registration import register
 #from population_syn import PopulationSyn # extended neat population for synchronizing witn singularity p2p network
-# Multi-core machine support
+# Multi-core machine support, default number of worker processes (the pool is opt-in
+# with num_workers, e.g. multiprocessing.cpu_count())
 NUM_CORES = 1
+# environment and parameters used for the training and validation sets
+ENV_CLASS = 'ForexEnv4'
+ENV_KWARGS = {'volume':0.2, 'sl':500, 'tp':500,'obsticks':2, 'capital':10000, 'leverage':100}
+
+# evaluator of a pool worker process, created once by init_worker with the datasets loaded
+worker_evaluator = None
+
+# pool initializer: builds the training and validation envs of the worker
+def init_worker(ts_f, vs_f, env_class, prune_k, max_tick_reward):
+    global worker_evaluator
+    worker_evaluator = GenomeEvaluator(ts_f, vs_f, env_class=env_class, worker=True, prune_k=prune_k,
+                                       max_tick_reward=max_tick_reward)
+
+# evaluates a genome in the training env of the worker, only the genome, config and
+# early stopping threshold are sent to the worker, returns (score, stopped)
+def evaluate_genome(genome, config, threshold):
+    net = create_network(genome, config)
+    return worker_evaluator.run_episode(net, worker_evaluator.env_t, threshold)
+
+# evaluates a chunk of genomes in the training env of the worker with a batched mode
+def evaluate_chunk(genomes, config, mode, threshold):
+    return worker_evaluator.simulate_chunk(genomes, config, mode, threshold)
 
 # class for evaluating the genomes
 class GenomeEvaluator(object):
     genomes_h=[]
-    def __init__(self, ts_f, vs_f):
-        self.pool = None if NUM_CORES < 2 else multiprocessing.Pool(NUM_CORES)
+    # num_workers: number of worker processes, the pool is created once and each
+    #              worker keeps its own envs (less than 2 evaluates in this process)
+    # chunksize: genomes sent per task to a worker (None=pool default)
+    # worker: True for the evaluator of a pool worker
+    # lockstep: steps all the genomes together with one batched activation per tick
+    # time_axis: calculates the actions of all the ticks at once, for envs with
+    #            observation_matrix() and discrete actions (ForexEnv5)
+    # env_class: name of the env in gym_forex.envs, it uses ENV_KWARGS
+    # cache: path of a FitnessCache database, unchanged genomes are not simulated again
+    # cache_size: maximum number of entries of the cache
+    # prune_k: stops the episodes of genomes that can not beat the prune_k best of the
+    #          generation, using max_tick_reward as bound of the reward of a step (see
+    #          gym_forex.early_stopping), not used by lockstep
+    # prune_round: genomes evaluated with the same early stopping threshold, the k best
+    #              of the previous rounds, the fitnesses depend only on the order of the
+    #              genomes and not on the workers or chunks
+    def __init__(self, ts_f, vs_f, num_workers=NUM_CORES, chunksize=None, worker=False, lockstep=False,
+                 time_axis=False, env_class=ENV_CLASS, cache=None, cache_size=100000, prune_k=None,
+                 max_tick_reward=None, prune_round=32):
         self.test_episodes = []
         self.generation = 0
         self.min_reward = -15
         self.max_reward = 15
         self.episode_score = []
         self.episode_length = []
+        self.num_workers = num_workers
+        self.chunksize = chunksize
+        self.lockstep = lockstep
+        self.time_axis = time_axis
+        # observation matrix of the training set for time_axis, built once
+        self.observations = None
+        self.early_stopping = None
+        self.prune_round = prune_round
+        # stopped[i]: the fitness of the i-th genome of the last evaluation is a bound
+        self.stopped = []
+        if prune_k is not None:
+            if max_tick_reward is None:
+                raise ValueError("prune_k requires max_tick_reward")
+            self.early_stopping = EarlyStopping(prune_k, max_tick_reward)
+        if worker:
+            # worker process: the envs are built directly, the gym ids are registered by the main process
+            env = getattr(gym_forex.envs, env_class)
+            self.env_t = env(dataset=ts_f, **ENV_KWARGS)
+            self.env_v = env(dataset=vs_f, **ENV_KWARGS)
+            self.pool = None
+            return
         # register the gym-forex openai gym environment
         register(
             id='ForexTrainingSet-v1',
-            entry_point='gym_forex.envs:ForexEnv4',
-            kwargs={'dataset': ts_f, 'volume':0.2, 'sl':500, 'tp':500,'obsticks':2, 'capital':10000, 'leverage':100}
+            entry_point='gym_forex.envs:' + env_class,
+            kwargs=dict(ENV_KWARGS, dataset=ts_f)
         )
         register(
             id='ForexValidationSet-v1',
-            entry_point='gym_forex.envs:ForexEnv4',
-            kwargs={'dataset': vs_f,'volume':0.2, 'sl':500, 'tp':500,'obsticks':2, 'capital':10000, 'leverage':100}
+            entry_point='gym_forex.envs:' + env_class,
+            kwargs=dict(ENV_KWARGS, dataset=vs_f)
         )
         # make openai gym environments
         self.env_t = gym.make('ForexTrainingSet-v1')
@@ -52,7 +118,32 @@ class GenomeEvaluator(object):
         print("action space: {0!r}".format(self.env_t.action_space))
         print("observation space: {0!r}".format(self.env_t.observation_space))
         #self.env_t = gym.wrappers.Monitor(env_t, 'results', force=True)
+        self.cache = None
+        if cache is not None:
+            self.cache = FitnessCache(cache, cache_size)
+            # the cached fitness is only valid for the same training set and env
+            self.cache_context = context_hash(ts_f, env_class, ENV_KWARGS)
+        if time_axis and not hasattr(self.env_t.unwrapped, 'observation_matrix'):
+            raise ValueError("time_axis requires an env with observation_matrix(), not " + env_class)
+        # persistent pool of workers with the datasets already loaded
+        self.pool = None if num_workers < 2 else multiprocessing.Pool(num_workers, init_worker,
+                                                                  (ts_f, vs_f, env_class, prune_k, max_tick_reward))
     
+    # terminates the worker processes
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    # starts a generation of the early stopping, fitnesses of other generations are discarded
+    def start_generation(self, generation):
+        if self.early_stopping is not None:
+            self.early_stopping.start(generation)
+
     # converts a bidimentional matrix to an one-dimention array
     def nn_format(self, obs):
         output = []
@@ -61,45 +152,193 @@ class GenomeEvaluator(object):
                 output.append(val)
         return output    
     
-    # simulates a genom in all the training dataset (all the training subsets)
-    def simulate(self, nets):
+    # runs an episode of net in env and returns its score
+    def score(self, net, env):
+        return self.run_episode(net, env)[0]
+
+    # runs an episode of net in env and returns (score, stopped), with a threshold the
+    # early stopping can stop the episode and the score is its bound
+    def run_episode(self, net, env, threshold=None):
+        observation = env.reset()
+        score = 0.0
+        while 1:
+            output = net.activate(self.nn_format(observation))
+            action = np.argmax(output)# buy, sell or nop
+            observation, reward, done, info = env.step(action)
+            score += reward
+            #env_t.render()
+            if done:
+                break
+            if threshold is not None:
+                bound = self.early_stopping.stop(score, env.unwrapped, threshold)
+                if bound is not None:
+                    return bound, True
+        return score, False
+
+    # simulates a genom in all the training dataset (all the training subsets), returns
+    # the (score, stopped) of each net
+    def simulate(self, nets, threshold=None):
         # convert nets to D   
-        scores = []
-        sub_scores=[]
+        results = []
         self.test_episodes = []
         # Evalua cada net en todos los env_t excepto el env actual 
         for genome, net in nets:
-            sub_scores=[]
-            observation = self.env_t.reset()
-            score=0.0
-            #if i==index_t:
-            while 1:
-                output = net.activate(self.nn_format(observation))
-                action = np.argmax(output)# buy, sell or nop
-                observation, reward, done, info = self.env_t.step(action)
+            results.append(self.run_episode(net, self.env_t, threshold))
+        return results
+    
+    # simulates all the genomes together, each one in its own copy of env_t, the
+    # networks are compiled in a PopulationNetwork and activated in one batch per tick
+    def simulate_lockstep(self, genomes, config):
+        net = PopulationNetwork(genomes, config)
+        base = self.env_t.unwrapped
+        # the copies share the loaded dataset, the account and observations are per genome
+        envs = [deepcopy(base, {id(base.my_data): base.my_data}) for g in genomes]
+        observations = np.array([np.ravel(env.reset()) for env in envs])
+        scores = [0.0] * len(genomes)
+        active = list(range(len(genomes)))
+        while active:
+            actions = np.argmax(net.activate(observations), axis=1)# buy, sell or nop
+            running = []
+            for p in active:
+                observation, reward, done, info = envs[p].step(actions[p])
+                scores[p] += reward
+                observations[p] = np.ravel(observation)
+                if not done:
+                    running.append(p)
+            active = running
+        return scores
+
+    # simulates the genomes with the actions of all the ticks calculated at once, the
+    # observations of the env do not depend on the account so only the account
+    # simulation is sequential, returns the (score, stopped) of each genome
+    def simulate_time_axis(self, genomes, config, threshold=None):
+        env = self.env_t.unwrapped
+        if self.observations is None:
+            self.observations = env.observation_matrix()
+        results = []
+        for genome in genomes:
+            net = PopulationNetwork([genome], config)
+            actions = np.argmax(net.activate(self.observations[None, :, :])[0], axis=1)# buy, sell or nop
+            env.reset()
+            score = 0.0
+            bound = None
+            for action in actions:
+                observation, reward, done, info = env.step(action)
                 score += reward
-                #env_t.render()
                 if done:
                     break
-            sub_scores.append(score)
-            # calculate fitness per genome
-            scores.append(sum(sub_scores) / len(sub_scores))
-        print("Score range [{:.3f}, {:.3f}]".format(min(scores), max(scores)))
-        return scores
-    
+                if threshold is not None:
+                    bound = self.early_stopping.stop(score, env, threshold)
+                    if bound is not None:
+                        break
+            results.append((score, False) if bound is None else (bound, True))
+        return results
+
+    # returns the score in the training set of an ensemble of genomes that votes the
+    # action of each tick, with all the networks activated in one batch if they are supported
+    def ensemble_score(self, genomes, config):
+        net = ensemble_network(genomes, config)
+        env = self.env_t.unwrapped
+        if hasattr(env, 'observation_matrix'):
+            # the observations do not depend on the account: the votes of all the ticks at once
+            actions = ensemble_vote(net, env.observation_matrix())
+            env.reset()
+        else:
+            actions = None
+            observation = env.reset()
+        score = 0.0
+        tick = 0
+        while 1:
+            if actions is None:
+                action = ensemble_vote(net, np.ravel(observation)[None, :])[0]
+            else:
+                action = actions[tick]
+            observation, reward, done, info = env.step(action)
+            score += reward
+            tick += 1
+            if done:
+                break
+        return score
+
+    # simulates genomes with a batched mode: 'lockstep' or 'time_axis', returns the
+    # (score, stopped) of each genome, lockstep does not stop episodes
+    def simulate_chunk(self, genomes, config, mode, threshold=None):
+        if mode == 'time_axis':
+            return self.simulate_time_axis(genomes, config, threshold)
+        return [(score, False) for score in self.simulate_lockstep(genomes, config)]
+
     def evaluate_genomes(self, genomes, config):
         self.generation += 1
+        if self.cache is None:
+            self.score_genomes(genomes, config)
+            return
+        keys = [genome_hash(g, config) + self.cache_context for gid, g in genomes]
+        cached = self.cache.get_many(keys)
+        # only the genomes not found in the cache are simulated
+        pending = [(gid, g) for (gid, g), key in zip(genomes, keys) if key not in cached]
+        if pending:
+            self.score_genomes(pending, config)
+        print("Fitness cache: {0} hits, {1} simulated".format(len(genomes) - len(pending), len(pending)))
+        # the bounds of the early stopping are not fitnesses, they are never cached
+        stopped = set(gid for (gid, g), s in zip(pending, self.stopped) if s)
+        fitnesses = {}
+        self.genomes_h = []
+        for (gid, genome), key in zip(genomes, keys):
+            if key in cached:
+                genome.fitness = cached[key]
+            elif gid not in stopped:
+                fitnesses[key] = genome.fitness
+            self.genomes_h.append(genome)
+        self.cache.put_many(fitnesses)
+
+    # simulates the genomes in this process or in the pool, returns the (score, stopped)
+    # of each genome in the order of genomes
+    def simulate_genomes(self, genomes, config, threshold=None):
+        mode = 'time_axis' if self.time_axis else ('lockstep' if self.lockstep else None)
+        if mode is not None and all(supported(g, config) for gid, g in genomes):
+            population = [g for gid, g in genomes]
+            if self.pool is None:
+                return self.simulate_chunk(population, config, mode, threshold)
+            # each worker simulates a chunk of the population
+            size = self.chunksize or -(-len(population) // self.num_workers)
+            chunks = [population[i:i + size] for i in range(0, len(population), size)]
+            results = []
+            for chunk_results in self.pool.map(partial(evaluate_chunk, config=config, mode=mode,
+                                                       threshold=threshold), chunks, 1):
+                results.extend(chunk_results)
+            return results
+        if self.pool is None:
+            nets = []
+            for gid, g in genomes:
+                nets.append((g, create_network(g, config)))
+            return self.simulate(nets, threshold)
+        # only the genomes travel to the workers, the results keep the order of genomes
+        return self.pool.map(partial(evaluate_genome, config=config, threshold=threshold),
+                             [g for gid, g in genomes], self.chunksize)
+
+    # simulates the genomes and sets their fitness
+    def score_genomes(self, genomes, config):
         t0 = time.time()
-        nets = []
-        for gid, g in genomes:
-            nets.append((g, neat.nn.FeedForwardNetwork.create(g, config)))
-        t0 = time.time()
-        scores = self.simulate(nets)
-        t0 = time.time()
+        self.start_generation(self.generation)
+        if self.early_stopping is None or (self.lockstep and not self.time_axis):
+            results = self.simulate_genomes(genomes, config)
+        else:
+            # the threshold is the one of the main process for all the genomes of a round
+            results = []
+            for i in range(0, len(genomes), self.prune_round):
+                round_results = self.simulate_genomes(genomes[i:i + self.prune_round], config,
+                                                      self.early_stopping.threshold())
+                for score, stopped in round_results:
+                    self.early_stopping.record(score, stopped)
+                results.extend(round_results)
+        scores = [score for score, stopped in results]
+        # the fitness of a stopped genome is only a bound
+        self.stopped = [stopped for score, stopped in results]
+        print("Score range [{:.3f}, {:.3f}]".format(min(scores), max(scores)))
         print("Evaluating {0} test episodes".format(len(self.test_episodes)))
         i = 0
         self.genomes_h=[]
-        for genome, net in nets:
+        for gid, genome in genomes:
             genome.fitness = scores[i]
             self.genomes_h.append(genome)
             i = i + 1
@@ -110,7 +349,7 @@ class GenomeEvaluator(object):
         observation = self.env_t.reset()
         score = 0.0
         step = 0
-        gen_best_nn = neat.nn.FeedForwardNetwork.create(gen_best, config)
+        gen_best_nn = create_network(gen_best, config)
         # calculate the training set score
         while 1:
             step += 1
@@ -119,7 +358,6 @@ class GenomeEvaluator(object):
             action = np.argmax(output)# buy,sell or 
             observation, reward, done, info = self.env_t.step(action)
             score += reward
-            self.env_t.render()
             if done:
                 break
         self.episode_score.append(score)
@@ -133,7 +371,6 @@ class GenomeEvaluator(object):
         observation = self.env_v.reset()
         score = 0.0
         step = 0
-        gen_best_nn = neat.nn.FeedForwardNetwork.create(gen_best, config)
         while 1:
             step += 1
             output = gen_best_nn.activate(self.nn_format(observation))
@@ -0,0 +1,200 @@
+# library for incremental NEAT checkpoints written in a background thread
+from __future__ import print_function
+import gzip
+import io
+import os
+import pickle
+import random
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import neat
+from neat.reporting import BaseReporter
+from neat.six_util import iteritems
+import numpy as np
+from genome_codec import encode_genomes, decode_genomes
+
+
+# pickles the species set with the genomes of the population replaced by their keys,
+# its reporters (this checkpointer among them) are not stored
+class _SpeciesPickler(pickle.Pickler):
+    def __init__(self, f, population, reporters):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self.genome_ids = dict((id(g), key) for key, g in iteritems(population))
+        self.reporters = reporters
+
+    def persistent_id(self, obj):
+        if obj is self.reporters:
+            return 'reporters'
+        return self.genome_ids.get(id(obj))
+
+
+# unpickles the species set resolving the genome keys with the restored population
+class _SpeciesUnpickler(pickle.Unpickler):
+    def __init__(self, f, population):
+        pickle.Unpickler.__init__(self, f)
+        self.population = population
+
+    def persistent_load(self, key):
+        if key == 'reporters':
+            # replaced by the reporters of the restored population
+            return None
+        return self.population[key]
+
+
+class IncrementalCheckpointer(BaseReporter):
+    """
+    Checkpointer that stores only the genomes created since the previous
+    checkpoint (delta) and a full snapshot every full_interval checkpoints.
+
+    The snapshot of the population is pickled in the training loop, the
+    compression and the write are done by a background thread, so the
+    evolution only waits for the encoding of the new genomes. Each genome is
+    encoded separately (genome_codec, float64) and restore_checkpoint only
+    decodes the genomes of the restored population.
+
+    generation_interval, time_interval_seconds, filename_prefix: as in
+        neat.Checkpointer, the files are <filename_prefix><generation>.
+    full_interval: number of checkpoints between full snapshots.
+    keep_full:     number of full snapshots (with their deltas) kept on disk,
+                   None keeps all.
+    """
+
+    def __init__(self, generation_interval=100, time_interval_seconds=300, filename_prefix='neat-checkpoint-',
+                 full_interval=10, keep_full=2, compresslevel=5):
+        self.generation_interval = generation_interval
+        self.time_interval_seconds = time_interval_seconds
+        self.filename_prefix = filename_prefix
+        self.full_interval = full_interval
+        self.keep_full = keep_full
+        self.compresslevel = compresslevel
+        self.current_generation = None
+        self.last_generation_checkpoint = -1
+        self.last_time_checkpoint = time.time()
+        # key:fitness of the genomes already stored in the chain
+        self.stored = None
+        self.base = None
+        self.num_checkpoints = 0
+        # files of each chain, a chain is a full snapshot and its deltas
+        self.chains = []
+        self.queue = queue.Queue()
+        self.writer = threading.Thread(target=self._write_loop)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def start_generation(self, generation):
+        self.current_generation = generation
+
+    def end_generation(self, config, population, species_set):
+        checkpoint_due = False
+        if self.time_interval_seconds is not None:
+            if time.time() - self.last_time_checkpoint >= self.time_interval_seconds:
+                checkpoint_due = True
+        if (checkpoint_due is False) and (self.generation_interval is not None):
+            if self.current_generation - self.last_generation_checkpoint >= self.generation_interval:
+                checkpoint_due = True
+        if checkpoint_due:
+            self.save_checkpoint(config, population, species_set, self.current_generation)
+            self.last_generation_checkpoint = self.current_generation
+            self.last_time_checkpoint = time.time()
+
+    def found_solution(self, config, generation, best):
+        self.flush()
+
+    def save_checkpoint(self, config, population, species_set, generation):
+        full = self.stored is None or self.num_checkpoints % self.full_interval == 0
+        if full:
+            self.stored = {}
+        # genomes are not modified once created, a stored key only needs its fitness updated
+        genomes = {}
+        fitness = {}
+        for key, g in iteritems(population):
+            if key not in self.stored:
+                genomes[key] = encode_genomes([g], np.float64)
+            elif self.stored[key] != g.fitness:
+                fitness[key] = g.fitness
+            self.stored[key] = g.fitness
+        f = io.BytesIO()
+        _SpeciesPickler(f, population, species_set.reporters).dump(species_set)
+        data = {'type': 'full' if full else 'delta', 'generation': generation,
+                'base': None if full else self.base, 'keys': list(population),
+                'genomes': genomes, 'fitness': fitness, 'species': f.getvalue(),
+                'random': random.getstate(), 'config': config}
+        filename = '{0}{1}'.format(self.filename_prefix, generation)
+        print("Saving {0} checkpoint to {1} ({2} genomes)".format(data['type'], filename, len(genomes)))
+        # files of the chains older than the keep_full newest, removed after the write
+        old = []
+        if full:
+            self.chains.append([])
+            if self.keep_full is not None:
+                for chain in self.chains[:-self.keep_full]:
+                    old.extend(chain)
+                del self.chains[:-self.keep_full]
+        self.chains[-1].append(filename)
+        self.base = filename
+        self.num_checkpoints += 1
+        # the compression and the write are done by the background thread
+        self.queue.put((filename, data, old))
+
+    def _write_loop(self):
+        while 1:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            filename, data, old = item
+            with gzip.open(filename + '.tmp', 'w', compresslevel=self.compresslevel) as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            # a partially written checkpoint is never left with the final name
+            os.rename(filename + '.tmp', filename)
+            for old_filename in old:
+                if os.path.exists(old_filename):
+                    os.remove(old_filename)
+            self.queue.task_done()
+
+    def flush(self):
+        # waits until the queued checkpoints are written
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    @staticmethod
+    def restore_checkpoint(filename):
+        """Resumes the simulation from a checkpoint, following its deltas to the full snapshot."""
+        with gzip.open(filename) as f:
+            last = pickle.load(f)
+        encoded = {}
+        pending = set(last['keys'])
+        fitness = {}
+        data = last
+        while 1:
+            # the newest fitness of a genome is found first
+            for key, value in iteritems(data['fitness']):
+                fitness.setdefault(key, value)
+            # only the genomes of the restored population are decoded
+            for key in pending.intersection(data['genomes']):
+                encoded[key] = data['genomes'][key]
+            pending.difference_update(data['genomes'])
+            if data['type'] == 'full':
+                break
+            with gzip.open(data['base']) as f:
+                data = pickle.load(f)
+        if pending:
+            raise ValueError("Genomes {0} not found in the checkpoints of {1}".format(sorted(pending), filename))
+        # the config of the last checkpoint has the current node indexer
+        population = dict((key, decode_genomes(value, last['config'])[0]) for key, value in iteritems(encoded))
+        for key, value in iteritems(fitness):
+            if key in population:
+                population[key].fitness = value
+        species_set = _SpeciesUnpickler(io.BytesIO(last['species']), population).load()
+        random.setstate(last['random'])
+        pop = neat.Population(last['config'], (population, species_set, last['generation']))
+        species_set.reporters = pop.reporters
+        return pop
@@ -0,0 +1,326 @@
+# Inference server of the winners saved by agent_NEAT (winner-N.pickle), it keeps an
+# observation window per symbol built by ForexEnv4.observe, the code of the training
+# observations, and returns the action of each new bar. The bars that arrive while a
+# batch is evaluated are evaluated together, one activation for all the symbols.
+#
+# Protocol: one JSON object per line over TCP, answered with one JSON line
+#   {"symbol": "EURUSD", "bar": [...], "order_status": 0, "equity": 10000.0}
+#       -> {"symbol": "EURUSD", "action": 1}
+#   a list of bar objects -> a list of answers
+#   {"load": ["winners.gfx"]} -> {"models": 2}
+# load replaces the models with the genomes of genome_codec files of the models
+# directory (--models DIR, without it the clients can not load models), a client never
+# makes the server unpickle a file, unpickling runs the code of the file
+# bar: the num_columns - 1 values of a dataset row, order_status and equity are the
+# account values of the env (def: no order and the previous equity), "capital" in
+# the first bar of a symbol sets its initial capital (def: the one of ENV_KWARGS).
+#
+# Usage: python inference_server.py <config> <dataset> <winner> [winner ...] [--port N] [--models DIR]
+# the dataset is the training set, its minimum and maximum normalize the bars.
+from __future__ import print_function
+import copy
+import io
+import json
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+try:
+    import queue
+    from socketserver import StreamRequestHandler, ThreadingTCPServer
+except ImportError:
+    import Queue as queue
+    from SocketServer import StreamRequestHandler, ThreadingTCPServer
+import neat
+import numpy as np
+import gym_forex.envs
+from agent_genome import AgentGenome
+from genome_codec import MAGIC, decode_genomes
+from genome_evaluator import ENV_CLASS, ENV_KWARGS
+from population_network import CompiledNetwork, PopulationNetwork, create_network, ensemble_vote, supported
+
+DEFAULT_PORT = 3339
+
+
+# unpickles the genomes with the genome type of config, also the winners saved when
+# AgentGenome was defined in the __main__ of the agents
+class _GenomeUnpickler(pickle.Unpickler):
+    def __init__(self, f, genome_type):
+        pickle.Unpickler.__init__(self, f)
+        self.genome_type = genome_type
+
+    def find_class(self, module, name):
+        if name == 'AgentGenome':
+            return self.genome_type
+        return pickle.Unpickler.find_class(self, module, name)
+
+# returns the genomes of winner pickles (a genome or a list of genomes) or genome_codec
+# files, without allow_pickle only genome_codec files are accepted
+def load_genomes(paths, config, allow_pickle=True):
+    genomes = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:len(MAGIC)] == MAGIC:
+            genomes.extend(decode_genomes(data, config))
+            continue
+        if not allow_pickle:
+            raise ValueError("Not a genome_codec file: {0}".format(os.path.basename(path)))
+        loaded = _GenomeUnpickler(io.BytesIO(data), config.genome_type).load()
+        genomes.extend(loaded if isinstance(loaded, (list, tuple)) else [loaded])
+    if not genomes:
+        raise ValueError("No genomes to serve")
+    return genomes
+
+
+class Policy(object):
+    """
+    Actions of a winner or of an ensemble of winners (majority vote, ties go to
+    the lowest action) for a batch of flattened observations.
+
+    genomes: the winners.
+    config:  NEAT config of the genomes.
+    """
+
+    def __init__(self, genomes, config):
+        self.genomes = genomes
+        self.num_outputs = len(config.genome_config.output_keys)
+        self.net = None
+        self.nets = None
+        if len(genomes) > 1 and all(supported(g, config) for g in genomes):
+            self.net = PopulationNetwork(genomes, config)
+        else:
+            self.nets = [create_network(g, config) for g in genomes]
+
+    def actions(self, observations):
+        if self.net is not None:
+            return ensemble_vote(self.net, observations)
+        votes = np.zeros((len(observations), self.num_outputs), dtype=np.intp)
+        rows = np.arange(len(observations))
+        for net in self.nets:
+            if isinstance(net, CompiledNetwork):
+                votes[rows, np.argmax(net.activate(observations), axis=1)] += 1
+            else:
+                for i, observation in enumerate(observations):
+                    votes[i, np.argmax(net.activate(observation))] += 1
+        return np.argmax(votes, axis=1)
+
+
+class SymbolWindow(object):
+    """
+    Observation window of a symbol, a copy of the env with its own windows, so
+    the observations of the bars are the ones of the env with the same ticks.
+
+    env:     ForexEnv4 with the normalization of the training set.
+    capital: initial capital of the account (def: the one of env).
+    """
+
+    def __init__(self, env, capital=None):
+        self.env = copy.copy(env)
+        if capital is not None:
+            self.env.initial_capital = capital
+        self.env.reset()
+        self.equity_ant = self.env.initial_capital
+
+    # appends a bar and returns the observation in the input format of the networks
+    def push(self, bar, order_status=0, equity=None):
+        bar = np.asarray(bar, dtype=np.float64)
+        if bar.shape != (self.env.num_columns - 1,):
+            raise ValueError("A bar has {0} values".format(self.env.num_columns - 1))
+        if equity is None:
+            equity = self.equity_ant
+        ob = self.env.observe(bar, order_status, equity, self.equity_ant)
+        self.equity_ant = equity
+        return ob.ravel()
+
+
+class InferenceServer(object):
+    """
+    Decides the actions of the bars of many symbols with micro-batches.
+
+    decide() queues a bar and waits for its action. A single thread takes the
+    queued bars, appends them to their windows in arrival order and evaluates
+    all their observations at once, so the bars of a symbol never run
+    concurrently. load() replaces the models between two batches.
+
+    config:    NEAT config of the genomes.
+    env:       ForexEnv4 with the normalization of the training set.
+    genomes:   the winners.
+    max_batch: maximum bars of a batch.
+    max_delay: seconds a batch waits for more bars (def: 0, only the queued ones).
+    models_dir: directory of the genome_codec files of load_files() (def: None,
+               the clients can not load models).
+    """
+
+    def __init__(self, config, env, genomes, max_batch=256, max_delay=0.0, models_dir=None):
+        self.config = config
+        self.env = env
+        self.models_dir = models_dir
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.policy = Policy(genomes, config)
+        self.windows = {}
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.decisions = 0
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    # replaces the models, the batches in progress finish with the previous ones
+    def load(self, genomes):
+        self.policy = Policy(genomes, self.config)
+        return len(genomes)
+
+    # replaces the models with the genomes of genome_codec files of models_dir, the file
+    # names come from the clients, so they can not leave models_dir and are never unpickled
+    def load_files(self, names):
+        if self.models_dir is None:
+            raise ValueError("Loading models is disabled, start the server with --models")
+        models_dir = os.path.realpath(self.models_dir)
+        paths = []
+        for name in names:
+            path = os.path.realpath(os.path.join(models_dir, name))
+            if os.path.dirname(path) != models_dir:
+                raise ValueError("Not a file of the models directory: {0}".format(name))
+            paths.append(path)
+        return self.load(load_genomes(paths, self.config, allow_pickle=False))
+
+    # returns the action of a bar of a symbol, raises ValueError for invalid bars
+    def decide(self, symbol, bar, order_status=0, equity=None, capital=None):
+        return self.decide_many([(symbol, bar, order_status, equity, capital)])[0]
+
+    # returns the actions of (symbol, bar, order_status, equity, capital) requests,
+    # or the exception of each invalid one
+    def decide_many(self, bars, raise_errors=True):
+        pending = []
+        for request in bars:
+            done = threading.Event()
+            item = [request, done, None]
+            self.requests.put(item)
+            pending.append(item)
+        results = []
+        for item in pending:
+            item[1].wait()
+            if raise_errors and isinstance(item[2], Exception):
+                raise item[2]
+            results.append(item[2])
+        return results
+
+    # takes the queued requests, waits max_delay for more if it is set
+    def _take(self):
+        batch = [self.requests.get()]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.time()
+                if remaining > 0:
+                    batch.append(self.requests.get(True, remaining))
+                else:
+                    batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while 1:
+            batch = self._take()
+            valid = []
+            observations = []
+            for item in batch:
+                symbol, bar, order_status, equity, capital = item[0]
+                try:
+                    window = self.windows.get(symbol)
+                    if window is None:
+                        window = SymbolWindow(self.env, capital)
+                    observations.append(window.push(bar, order_status, equity))
+                    self.windows[symbol] = window
+                    valid.append(item)
+                except (ValueError, TypeError) as e:
+                    item[2] = ValueError(str(e))
+            if valid:
+                policy = self.policy
+                try:
+                    actions = policy.actions(np.array(observations))
+                    for item, action in zip(valid, actions):
+                        item[2] = int(action)
+                except Exception as e:
+                    for item in valid:
+                        item[2] = e
+            self.batches += 1
+            self.decisions += len(valid)
+            for item in batch:
+                item[1].set()
+
+
+class InferenceHandler(StreamRequestHandler):
+    """
+    Answers the JSON lines of a connection, see the protocol at the top.
+    """
+
+    def setup(self):
+        StreamRequestHandler.setup(self)
+        # the answers are small and must not wait for more data
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        inference = self.server.inference
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line.decode('utf-8'))
+                if isinstance(message, dict) and 'load' in message:
+                    answer = {'models': inference.load_files(message['load'])}
+                else:
+                    messages = message if isinstance(message, list) else [message]
+                    requests = [(m['symbol'], m['bar'], m.get('order_status', 0), m.get('equity'),
+                                 m.get('capital')) for m in messages]
+                    answer = []
+                    for m, action in zip(messages, inference.decide_many(requests, raise_errors=False)):
+                        if isinstance(action, Exception):
+                            answer.append({'symbol': m['symbol'], 'error': str(action)})
+                        else:
+                            answer.append({'symbol': m['symbol'], 'action': action})
+                    if not isinstance(message, list):
+                        answer = answer[0]
+            except (ValueError, KeyError, TypeError, IOError) as e:
+                answer = {'error': str(e)}
+            self.wfile.write((json.dumps(answer) + '\n').encode('utf-8'))
+
+
+class ThreadedInferenceServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, inference):
+        ThreadingTCPServer.__init__(self, address, InferenceHandler)
+        self.inference = inference
+
+
+# returns the env of the observations, with the normalization of the training set
+def make_env(dataset):
+    return getattr(gym_forex.envs, ENV_CLASS)(dataset=dataset, **ENV_KWARGS)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    port = DEFAULT_PORT
+    models_dir = None
+    if '--port' in args:
+        i = args.index('--port')
+        port = int(args[i + 1])
+        del args[i:i + 2]
+    if '--models' in args:
+        i = args.index('--models')
+        models_dir = args[i + 1]
+        del args[i:i + 2]
+    config = neat.Config(AgentGenome, neat.DefaultReproduction,
+                         neat.DefaultSpeciesSet, neat.DefaultStagnation, args[0])
+    inference = InferenceServer(config, make_env(args[1]), load_genomes(args[2:], config),
+                                models_dir=models_dir)
+    server = ThreadedInferenceServer(('127.0.0.1', port), inference)
+    print("Serving {0} models on port {1}".format(len(inference.policy.genomes), port))
+    server.serve_forever()
@@ -0,0 +1,199 @@
+# NEAT island model: several populations evolve in local processes and exchange
+# elite migrants through queues, the queues can be served over TCP by a hub so
+# that islands on other hosts take part in the migration.
+#
+# Usage: python island_model.py <training_set> <validation_set> <config> [num_islands]
+#        python island_model.py hub <host> <port> <authkey> <num_islands>
+from __future__ import print_function
+from functools import partial
+import multiprocessing
+from multiprocessing.managers import BaseManager
+import random
+import sys
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import neat
+from neat.reporting import BaseReporter
+from neat.six_util import itervalues
+from genome_codec import encode_genomes, decode_genomes, reserve_node_keys
+from agent_genome import AgentGenome
+
+# returns the islands that receive the migrants of island index
+# topology: 'ring', 'full' or a dict index:list of destination islands
+def neighbors(topology, num_islands, index):
+    if isinstance(topology, dict):
+        return topology.get(index, [])
+    if topology == 'ring':
+        return [(index + 1) % num_islands] if num_islands > 1 else []
+    if topology == 'full':
+        return [i for i in range(num_islands) if i != index]
+    raise ValueError("Unknown topology: {0}".format(topology))
+
+
+class MigrationHub(BaseManager):
+    """ Serves the migrant queues of the islands over TCP. """
+    pass
+
+# runs a hub with one migrant queue per island until it is killed
+def serve_hub(address, authkey, num_islands):
+    inboxes = [queue.Queue() for i in range(num_islands)]
+    MigrationHub.register('inbox', callable=lambda i: inboxes[i])
+    manager = MigrationHub(address=address, authkey=authkey)
+    manager.get_server().serve_forever()
+
+# returns the migrant queues of a hub
+def connect_hub(address, authkey, num_islands):
+    MigrationHub.register('inbox')
+    manager = MigrationHub(address=address, authkey=authkey)
+    manager.connect()
+    return [manager.inbox(i) for i in range(num_islands)]
+
+
+class MigrationReporter(BaseReporter):
+    """
+    Exchanges migrants of an island every interval generations.
+
+    After the evaluation the num_migrants best genomes are sent to the inboxes
+    of the destination islands, after the reproduction the received migrants
+    replace offspring of the new population (never its elites) and the
+    population is speciated again.
+    """
+
+    def __init__(self, pop, index, inboxes, destinations, interval, num_migrants):
+        self.pop = pop
+        self.index = index
+        self.inboxes = inboxes
+        self.destinations = destinations
+        self.interval = interval
+        self.num_migrants = num_migrants
+        self.generation = 0
+        self.received = 0
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        if self.generation % self.interval != 0 or not self.destinations:
+            return
+        elites = sorted(itervalues(population), key=lambda g: g.fitness, reverse=True)[:self.num_migrants]
+        for i in self.destinations:
+            self.inboxes[i].put((self.index, encode_genomes(elites)))
+
+    def end_generation(self, config, population, species_set):
+        migrants = []
+        while 1:
+            try:
+                source, data = self.inboxes[self.index].get_nowait()
+            except queue.Empty:
+                break
+            migrants.extend(decode_genomes(data, config))
+        if not migrants:
+            return
+        # the node keys of the migrants come from the indexer of another island
+        reserve_node_keys(migrants, config)
+        # offspring not evaluated yet, the elites keep their fitness
+        offspring = [key for key, g in population.items() if g.fitness is None]
+        random.shuffle(offspring)
+        for key, migrant in zip(offspring, migrants):
+            del population[key]
+            # a new key from this island, so keys never collide
+            migrant.key = next(self.pop.reproduction.genome_indexer)
+            migrant.fitness = None
+            population[migrant.key] = migrant
+            self.received += 1
+        species_set.speciate(config, population, self.generation)
+
+
+# island process: evolves a population and puts its best genome in results
+def run_island(index, config, fitness_factory, generations, inboxes, hub, num_islands, topology, interval,
+               num_migrants, seed, results):
+    # every island must have its own random sequence
+    random.seed(None if seed is None else seed + index)
+    if hub is not None:
+        inboxes = connect_hub(hub[0], hub[1], num_islands)
+    pop = neat.Population(config)
+    migration = MigrationReporter(pop, index, inboxes, neighbors(topology, num_islands, index),
+                                  interval, num_migrants)
+    pop.add_reporter(migration)
+    pop.add_reporter(neat.StdOutReporter(False))
+    best = pop.run(fitness_factory(), generations)
+    print("Island {0}: best fitness {1}, {2} migrants received".format(index, best.fitness, migration.received))
+    results.put((index, best))
+
+
+class IslandModel(object):
+    """
+    Evolves num_islands NEAT populations in separate processes.
+
+    config:          neat.Config of the genomes.
+    fitness_factory: Picklable callable that returns the fitness function
+                     (genomes, config), it is called once in every island so
+                     each island builds its own environments.
+    num_islands:     Total number of islands (in all the hosts).
+    topology:        'ring', 'full' or a dict index:list of destinations.
+    interval:        Generations between migrations.
+    num_migrants:    Best genomes sent to each destination island.
+    hub:             (address, authkey) of a hub started with serve_hub, None
+                     migrates through local queues.
+    islands:         Indexes of the islands run in this host (def: all).
+    seed:            Base random seed of the islands (None: random).
+    """
+
+    def __init__(self, config, fitness_factory, num_islands=4, topology='ring', interval=5, num_migrants=2,
+                 hub=None, islands=None, seed=None):
+        self.config = config
+        self.fitness_factory = fitness_factory
+        self.num_islands = num_islands
+        self.topology = topology
+        self.interval = interval
+        self.num_migrants = num_migrants
+        self.hub = hub
+        self.islands = list(range(num_islands)) if islands is None else islands
+        self.seed = seed
+
+    def run(self, generations):
+        # returns the best genome of the islands of this host and the best of each one
+        inboxes = None if self.hub is not None else [multiprocessing.Queue() for i in range(self.num_islands)]
+        results = multiprocessing.Queue()
+        processes = []
+        for index in self.islands:
+            p = multiprocessing.Process(target=run_island, args=(
+                index, self.config, self.fitness_factory, generations, inboxes, self.hub, self.num_islands,
+                self.topology, self.interval, self.num_migrants, self.seed, results))
+            p.start()
+            processes.append(p)
+        bests = {}
+        while len(bests) < len(processes):
+            try:
+                index, best = results.get(True, 1.0)
+                bests[index] = best
+            except queue.Empty:
+                # a failed island never sends its best genome
+                if any(p.exitcode not in (None, 0) for p in processes):
+                    for p in processes:
+                        p.terminate()
+                    raise RuntimeError("An island process failed")
+        for p in processes:
+            p.join()
+        best = max(itervalues(bests), key=lambda g: g.fitness)
+        return best, bests
+
+
+# fitness function of an island, the evaluator is built inside the island process
+def make_evaluator(ts_f, vs_f):
+    from genome_evaluator import GenomeEvaluator
+    return GenomeEvaluator(ts_f, vs_f, num_workers=1, lockstep=True).evaluate_genomes
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'hub':
+        serve_hub((sys.argv[2], int(sys.argv[3])), sys.argv[4].encode('utf-8'), int(sys.argv[5]))
+    else:
+        config = neat.Config(AgentGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet,
+                             neat.DefaultStagnation, sys.argv[3])
+        num_islands = int(sys.argv[4]) if len(sys.argv) > 4 else multiprocessing.cpu_count()
+        model = IslandModel(config, partial(make_evaluator, sys.argv[1], sys.argv[2]), num_islands)
+        best, bests = model.run(100)
+        print("Best fitness: {0}".format(best.fitness))
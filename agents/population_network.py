@@ -0,0 +1,295 @@
+# library for batched activation of NEAT feed-forward networks, of a population or a single genome
+from __future__ import print_function
+import copy
+import weakref
+import numpy as np
+from neat.graphs import feed_forward_layers, required_for_output
+from neat.nn import FeedForwardNetwork
+from neat.six_util import iteritems, itervalues
+
+# numpy versions of the neat activation functions (neat/activations.py)
+ACTIVATIONS = {
+    'clamped': lambda z: np.clip(z, -1.0, 1.0),
+    'sigmoid': lambda z: 1.0 / (1.0 + np.exp(-np.clip(5.0 * z, -60.0, 60.0))),
+    'tanh': lambda z: np.tanh(np.clip(2.5 * z, -60.0, 60.0)),
+    'sin': lambda z: np.sin(np.clip(5.0 * z, -60.0, 60.0)),
+    'gauss': lambda z: np.exp(-5.0 * np.clip(z, -3.4, 3.4) ** 2),
+    'relu': lambda z: np.maximum(z, 0.0),
+    'identity': lambda z: z,
+    'abs': lambda z: np.abs(z),
+    'hat': lambda z: np.maximum(0.0, 1.0 - np.abs(z)),
+    'square': lambda z: z ** 2,
+    'cube': lambda z: z ** 3,
+}
+
+# pruned genomes by genome, they are dropped with their genome
+_pruned = weakref.WeakKeyDictionary()
+# the pruned genomes, a weak set because an entry of _pruned that maps a pruned genome
+# to itself would keep it alive forever
+_pruned_genomes = weakref.WeakSet()
+
+# returns a copy of the genome with only the nodes and enabled connections that
+# neat.nn.FeedForwardNetwork evaluates (on a path from the inputs to an output),
+# the networks of the copy and the genome are the same. It is memoized by genome,
+# so a genome must not change after it is pruned (neat creates a new genome for
+# each offspring).
+def prune_genome(genome, config):
+    # a pruned genome is already pruned
+    if genome in _pruned_genomes:
+        return genome
+    pruned = _pruned.get(genome)
+    if pruned is None:
+        input_keys = config.genome_config.input_keys
+        output_keys = config.genome_config.output_keys
+        connections = [cg.key for cg in itervalues(genome.connections) if cg.enabled]
+        required = required_for_output(input_keys, output_keys, connections)
+        # feed_forward_layers checks every connection for every node, fewer is faster
+        connections = [key for key in connections if key[1] in required]
+        evaluated = set(node for layer in feed_forward_layers(input_keys, output_keys, connections)
+                        for node in layer)
+        pruned = copy.copy(genome)
+        pruned.nodes = dict((key, ng) for key, ng in iteritems(genome.nodes)
+                            if key in evaluated or key in output_keys)
+        pruned.connections = dict((key, genome.connections[key]) for key in connections if key[1] in evaluated)
+        _pruned[genome] = pruned
+        _pruned_genomes.add(pruned)
+    return pruned
+
+# verifies that the genome only uses sum aggregation and known activations, with
+# config only the nodes of the pruned genome are verified
+def supported(genome, config=None):
+    if config is not None:
+        genome = prune_genome(genome, config)
+    for ng in itervalues(genome.nodes):
+        if ng.aggregation != 'sum' or ng.activation not in ACTIVATIONS:
+            return False
+    return True
+
+# returns the layers of a genome as lists of (node, bias, response, activation, links)
+# with the same node evaluation order as neat.nn.FeedForwardNetwork.create
+def genome_layers(genome, config):
+    genome = prune_genome(genome, config)
+    connections = [cg.key for cg in itervalues(genome.connections) if cg.enabled]
+    layers = feed_forward_layers(config.genome_config.input_keys, config.genome_config.output_keys, connections)
+    # links of each node, in the order of the connections
+    inputs = {}
+    for conn_key in connections:
+        inputs.setdefault(conn_key[1], []).append((conn_key[0], genome.connections[conn_key].weight))
+    result = []
+    for layer in layers:
+        nodes = []
+        for node in layer:
+            ng = genome.nodes[node]
+            nodes.append((node, ng.bias, ng.response, ng.activation, inputs.get(node, [])))
+        result.append(nodes)
+    return result
+
+
+class PopulationNetwork(object):
+    """
+    A population of feed-forward networks compiled in padded numpy tensors.
+
+    Every genome p has a row of node values V[p] with the inputs first, then
+    its evaluated nodes, a slot that is always zero (outputs that are not
+    connected) and a dump slot (writes of padding nodes). Layer l has the
+    weights W[l] (population x slots x max nodes in the layer), so a batched
+    matmul per layer activates every network at once.
+
+    genomes: list of genomes, all of them must be supported(genome, config).
+    config:  neat.Config of the genomes.
+    dtype:   numpy dtype of the tensors (def: float64, same as neat).
+    """
+
+    def __init__(self, genomes, config, dtype=np.float64):
+        self.dtype = dtype
+        self.size = len(genomes)
+        input_keys = config.genome_config.input_keys
+        output_keys = config.genome_config.output_keys
+        self.num_inputs = len(input_keys)
+        self.num_outputs = len(output_keys)
+        all_layers = [genome_layers(g, config) for g in genomes]
+        # slots: inputs, evaluated nodes, zero, dump
+        max_nodes = max([sum(len(layer) for layer in layers) for layers in all_layers] + [0])
+        self.num_slots = self.num_inputs + max_nodes + 2
+        zero = self.num_slots - 2
+        dump = self.num_slots - 1
+        depth = max([len(layers) for layers in all_layers] + [0])
+        widths = [max([len(layers[l]) for layers in all_layers if l < len(layers)]) for l in range(depth)]
+        self.weights = [np.zeros((self.size, self.num_slots, k), dtype=dtype) for k in widths]
+        self.biases = [np.zeros((self.size, k), dtype=dtype) for k in widths]
+        self.responses = [np.zeros((self.size, k), dtype=dtype) for k in widths]
+        self.targets = [np.full((self.size, k), dump, dtype=np.intp) for k in widths]
+        # per layer: list of (activation name, mask of the nodes that use it)
+        activations = [np.full((self.size, k), 'clamped', dtype=object) for k in widths]
+        self.outputs = np.full((self.size, self.num_outputs), zero, dtype=np.intp)
+        for p, layers in enumerate(all_layers):
+            slots = dict((key, i) for i, key in enumerate(input_keys))
+            for l, layer in enumerate(layers):
+                for k, (node, bias, response, activation, links) in enumerate(layer):
+                    slots[node] = len(slots)
+                    self.targets[l][p, k] = slots[node]
+                    self.biases[l][p, k] = bias
+                    self.responses[l][p, k] = response
+                    activations[l][p, k] = activation
+                    for inode, weight in links:
+                        self.weights[l][p, slots[inode], k] += weight
+            for j, key in enumerate(output_keys):
+                if key in slots:
+                    self.outputs[p, j] = slots[key]
+        self.activations = []
+        for l in range(depth):
+            names = set(activations[l].ravel())
+            self.activations.append([(name, activations[l] == name) for name in sorted(names)])
+
+    # inputs: (population x num_inputs) or (population x batch x num_inputs)
+    # returns the outputs with the same leading dimensions
+    def activate(self, inputs):
+        inputs = np.asarray(inputs, dtype=self.dtype)
+        single = inputs.ndim == 2
+        if single:
+            inputs = inputs[:, None, :]
+        batch = inputs.shape[1]
+        values = np.zeros((self.size, batch, self.num_slots), dtype=self.dtype)
+        values[:, :, :self.num_inputs] = inputs
+        for l in range(len(self.weights)):
+            # one batched matmul per layer: (P x B x S) @ (P x S x K)
+            z = self.biases[l][:, None, :] + self.responses[l][:, None, :] * np.matmul(values, self.weights[l])
+            if len(self.activations[l]) == 1:
+                a = ACTIVATIONS[self.activations[l][0][0]](z)
+            else:
+                a = np.zeros_like(z)
+                for name, mask in self.activations[l]:
+                    a = np.where(mask[:, None, :], ACTIVATIONS[name](z), a)
+            np.put_along_axis(values, np.broadcast_to(self.targets[l][:, None, :], z.shape), a, axis=2)
+        outputs = np.take_along_axis(values, np.broadcast_to(self.outputs[:, None, :], (self.size, batch, self.num_outputs)), axis=2)
+        return outputs[:, 0, :] if single else outputs
+
+
+
+class CompiledNetwork(object):
+    """
+    A feed-forward network compiled to numpy operations, a faster replacement of
+    neat.nn.FeedForwardNetwork for a single genome.
+
+    The nodes of each layer of feed_forward_layers take consecutive slots of
+    the node values, so a layer reads the slice of the slots before it and
+    writes the next one. A layer is a dense matmul with the responses folded in
+    the weights, or if less than sparse_density of the weights of the slots it
+    reads are links, a gather of the linked values and a sum per node with
+    np.add.reduceat. Layers whose
+    nodes share an activation apply it to the whole layer in place (clamped is
+    np.minimum and np.maximum in place).
+
+    genome:  a genome supported(genome, config) by this module.
+    config:  neat.Config of the genome.
+    dtype:   numpy dtype (def: float64, same as neat, float32 is faster).
+    sparse_density: density under which a layer uses the sparse path.
+    """
+
+    def __init__(self, genome, config, dtype=np.float64, sparse_density=0.1):
+        self.dtype = dtype
+        input_keys = config.genome_config.input_keys
+        output_keys = config.genome_config.output_keys
+        self.num_inputs = len(input_keys)
+        slots = dict((key, i) for i, key in enumerate(input_keys))
+        self.layers = []
+        for layer in genome_layers(genome, config):
+            offset = len(slots)
+            k = len(layer)
+            biases = np.array([bias for node, bias, response, activation, links in layer], dtype=dtype)
+            sources = set(slots[inode] for node, bias, response, activation, links in layer for inode, weight in links)
+            num_links = sum(len(links) for node, bias, response, activation, links in layer)
+            if num_links < sparse_density * len(sources) * k:
+                # links sorted by node, the sum of a node is a reduceat segment
+                edges = [(slots[inode], response * weight, j)
+                         for j, (node, bias, response, activation, links) in enumerate(layer)
+                         for inode, weight in links]
+                edge_slots = np.array([e[0] for e in edges], dtype=np.intp)
+                edge_weights = np.array([e[1] for e in edges], dtype=dtype)
+                targets = np.array([e[2] for e in edges], dtype=np.intp)
+                starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]]) if len(edges) else targets
+                linear = ('sparse', edge_slots, edge_weights, starts, targets[starts])
+            else:
+                # rows of all the slots before the layer, so it reads a slice without copies
+                weights = np.zeros((offset, k), dtype=dtype)
+                for j, (node, bias, response, activation, links) in enumerate(layer):
+                    for inode, weight in links:
+                        weights[slots[inode], j] += response * weight
+                linear = ('dense', weights)
+            names = [activation for node, bias, response, activation, links in layer]
+            groups = [(name, np.array([j for j, n in enumerate(names) if n == name], dtype=np.intp))
+                      for name in sorted(set(names))]
+            self.layers.append((linear, biases, groups, offset, k))
+            for node, bias, response, activation, links in layer:
+                slots[node] = len(slots)
+        # the last slot is always zero, for the outputs that are not connected
+        self.num_slots = len(slots) + 1
+        self.outputs = np.array([slots.get(key, self.num_slots - 1) for key in output_keys], dtype=np.intp)
+        self.values = np.zeros(self.num_slots, dtype=dtype)
+
+    # inputs: (num_inputs) or (batch x num_inputs), returns the outputs with the
+    # same leading dimension
+    def activate(self, inputs):
+        inputs = np.asarray(inputs, dtype=self.dtype)
+        if inputs.ndim == 1:
+            # the values of single activations reuse one buffer
+            values = self.values
+        else:
+            values = np.zeros(inputs.shape[:1] + (self.num_slots,), dtype=self.dtype)
+        values[..., :self.num_inputs] = inputs
+        for linear, biases, groups, offset, k in self.layers:
+            if linear[0] == 'dense':
+                z = np.dot(values[..., :offset], linear[1])
+                z += biases
+            else:
+                edge_slots, edge_weights, starts, linked = linear[1:]
+                z = np.empty(values.shape[:-1] + (k,), dtype=self.dtype)
+                z[...] = biases
+                if len(edge_slots):
+                    z[..., linked] += np.add.reduceat(values[..., edge_slots] * edge_weights, starts, axis=-1)
+            if len(groups) == 1:
+                name = groups[0][0]
+                if name == 'clamped':
+                    # two ufuncs in place, np.clip has a larger call overhead
+                    np.minimum(z, 1.0, out=z)
+                    np.maximum(z, -1.0, out=z)
+                else:
+                    z = ACTIVATIONS[name](z)
+            else:
+                for name, nodes in groups:
+                    z[..., nodes] = ACTIVATIONS[name](z[..., nodes])
+            values[..., offset:offset + k] = z
+        return values[..., self.outputs]
+
+
+# returns a CompiledNetwork of the pruned genome if it is supported, else a neat
+# FeedForwardNetwork of the pruned genome
+def create_network(genome, config, dtype=np.float64):
+    genome = prune_genome(genome, config)
+    if supported(genome):
+        return CompiledNetwork(genome, config, dtype)
+    return FeedForwardNetwork.create(genome, config)
+
+# returns the networks of an ensemble for ensemble_vote: a PopulationNetwork if all the
+# genomes are supported, else the list of the networks of create_network
+def ensemble_network(genomes, config):
+    if all(supported(g, config) for g in genomes):
+        return PopulationNetwork(genomes, config)
+    return [create_network(g, config) for g in genomes]
+
+# returns the action voted by the networks of an ensemble for each observation, every
+# network votes for its argmax, ties go to the lowest action
+# net: PopulationNetwork of the ensemble or list of networks (see ensemble_network),
+# observations: (batch x num_inputs)
+def ensemble_vote(net, observations):
+    if isinstance(net, list):
+        # the networks that are not supported are activated one observation at a time
+        outputs = np.array([[n.activate(observation) for observation in observations] for n in net])
+    else:
+        observations = np.asarray(observations, dtype=net.dtype)
+        outputs = net.activate(np.broadcast_to(observations, (net.size,) + observations.shape))
+    # votes[b, a]: networks that chose action a for observation b
+    choices = np.argmax(outputs, axis=2)
+    votes = np.zeros(outputs.shape[1:], dtype=np.intp)
+    np.add.at(votes, (np.arange(outputs.shape[1])[None, :], choices), 1)
+    return np.argmax(votes, axis=1)
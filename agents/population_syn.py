@@ -1,15 +1,48 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from neat import Population
-from copy import deepcopy 
-import pickle
+from copy import deepcopy
+import os
+import random
+from genome_codec import encode_genomes, decode_genomes, reserve_node_keys
 from neat.six_util import iteritems
 from neat.six_util import itervalues
 # PopulationSyn class for synchronizing optimization states with the singularity p2p optimzation network
 
+# environment variables with the singularity credentials (username, pass_hash, process_hash)
+CREDENTIAL_VARIABLES = ('SINGULARITY_USERNAME', 'SINGULARITY_PASS_HASH', 'SINGULARITY_PROCESS_HASH')
+
+# returns the singularity credentials, they are never stored in the source
+def singularity_credentials():
+    missing = [name for name in CREDENTIAL_VARIABLES if not os.environ.get(name)]
+    if missing:
+        raise RuntimeError("Missing singularity credentials, set the environment variables: " +
+                           ", ".join(missing))
+    return tuple(os.environ[name] for name in CREDENTIAL_VARIABLES)
+
 # PopulationSyn extends Population
 class PopulationSyn(Population):
+    # timeout: seconds of each request to singularity
+    # retries: retries of a failed request, with exponential backoff
+    def __init__(self, config, initial_state=None, timeout=10, retries=3):
+        super().__init__(config, initial_state)
+        self.username, self.pass_hash, self.process_hash = singularity_credentials()
+        self.timeout = timeout
+        # pooled session, the connections to singularity are reused between requests
+        self.session = requests.Session()
+        # only the idempotent requests are retried after a response or a read error, a
+        # retried POST /parameters would create duplicated parameters
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+        self.session.mount('http://', HTTPAdapter(max_retries=retry))
+        self.session.mount('https://', HTTPAdapter(max_retries=retry))
+        # the synchronization runs in a background thread, one at a time
+        self.executor = ThreadPoolExecutor(1)
+        self.pending_syn = None
+
     #def getBestGenomes(genomes_h, number)
-    
+
     # replaces in remote the genomes that has less_fit_key
     def replaceGenomes(self, genomes, less_fit_key, remote):
         genomes_h = []
@@ -19,7 +52,7 @@ class PopulationSyn(Population):
                 g = remote
             genomes_h.append(g)
         return genomes_h
-            
+
     # calculateFitness(best_genomes)
     def calculateFitness(self, best_genomes):
         countr=0
@@ -34,12 +67,12 @@ class PopulationSyn(Population):
             if (g.fitness > max_fitness):
                 max_fitness = g.fitness
                 best = g
-        if countr > 0:    
+        if countr > 0:
             best_fitness = ((len(best_genomes)-1)*g.fitness+(accum/countr))/len(best_genomes)
         else:
             best_fitness = -100000
         return best_fitness
-    
+
     # searchLessFit()
     def searchLessFit(self, genomes_h):
         less_fit = None
@@ -54,89 +87,103 @@ class PopulationSyn(Population):
                 less_fit = g
         return less_fit
 
-    # synSingularity method for synchronizing NEAT optimization states with singularity 
+    # synSingularity method for synchronizing NEAT optimization states with singularity
     # args: num_replacements = number of specimens to be migrated to/from singularity
     #       my_url = url of the singularity API
     #       stats = neat.StatisticsReporter
-    # returns: best_genoms selected between the remote and local
+    #       genomes_h = not used, the replaced genomes are chosen in the current population
+    # it does not wait for singularity: the migrants downloaded by the previous call are
+    # applied and a new synchronization is started in background if none is running
     def syn_singularity(self, num_replacements, my_url, stats, avg_score, current_generation, config, genomes_h):
-        # downloads process from singualrity to find last optimum
         print('num_rep=', num_replacements,'my_url=',  my_url,'stats=',  stats,
             'avg_score=',  avg_score, 'current_generation=',  current_generation)
-        res = requests.get(my_url + "/processes/1?username=harveybc&pass_hash=$2a$04$ntNHmofQoMoajG89mTEM2uSR66jKXBgRQJnCgqfNN38aq9UkN4Y6q&process_hash=ph")
-        cont = res.json()
-        last_optimum_id = cont['result'][0]['last_optimum_id']
+        if self.pending_syn is not None:
+            if not self.pending_syn.done():
+                print('\nsingularity synchronization still running')
+                return 0
+            remote = self.pending_syn.result()
+            self.pending_syn = None
+            if remote is not None:
+                self.apply_migrants(remote[0], remote[1])
         # calcualte local_perf as the weitgthed average of the best performers
-        best_genomes = stats.best_unique_genomes(num_replacements)
+        best_genomes = [deepcopy(g) for g in stats.best_unique_genomes(num_replacements)]
         local_perf = self.calculateFitness(best_genomes)
-        # remote performance from results of request
-        remote_perf = cont['result'][0]['current_block_performance']
-        # print results of request
-        print('\nremote_performance =', cont['result'][0]['current_block_performance'], '\nlocal_performance =', local_perf, '\nlast_optimum_id =', cont['result'][0]['last_optimum_id'])
-        # if remote_performance is not equal to local_performance, download remote_reps
-        parameter_downloaded = 0
-        if (local_perf != remote_perf):
-            # hace request GetParameter(id)
-            res_p = requests.get(my_url + "/parameters/" + str(last_optimum_id) + "?username=harveybc&pass_hash=$2a$04$ntNHmofQoMoajG89mTEM2uSR66jKXBgRQJnCgqfNN38aq9UkN4Y6q&process_hash=ph")
-            cont_param = res_p.json()
-            print('\ncont_param =', cont_param)
-            # descarga el checkpoint del link de la respuesta si cont.parameter_link
-            if cont_param['result'][0]['parameter_link'] is not None:
-                genom_data = requests.get(cont_param['result'][0]['parameter_link']).content
-                with open('remote_reps', 'wb') as handler:
-                    handler.write(genom_data)
-                    handler.close()
-                # carga genom descargado en nueva poblacion pop2
-                with open('remote_reps', 'rb') as f:
-                    remote_reps = pickle.load(f)
-                print('\nPARAMETERS DOWNLOADED: remote_reps=', remote_reps)
-                parameter_downloaded = 1
-                    
-        # if local_perf < remote_perf
-        if (local_perf < remote_perf) and (parameter_downloaded):
-            # for each remote_reps as remote
-            print('\nremote_fitness = ', remote_perf, 'local_fitness = ', local_perf)
-            #print('\ngenomes_h = ',genomes_h)
-            genomes = genomes_h
-            for remote in remote_reps:
-                # search the less_fit in pop
-                less_fit = self.searchLessFit(genomes)
-                # replaces less_fit with remote
-                #print("less_fit = ", less_fit)
-                #less_fit_key = less_fit.key
-                less_fit_key = remote.key
-                print('\nREPLACED = ', less_fit_key, 'fitness=', less_fit.fitness, 
-                    'new_fitness', remote.fitness)
-                #replaces lessfit in population by remote with the same key as less fit
-                remote.key=less_fit_key
-                self.population[less_fit_key] = remote
-                genomes=self.replaceGenomes(genomes, less_fit_key, remote)
-                
-        # if local_perf > remote_perf
-        if (local_perf >remote_perf):
-            # upload best_genomes
-            print('***********************************************************')
-            print("\nNEW OPTIMUM") 
-            for g in best_genomes:
-                print("\nbest_genomes[i] = ",g.key,"  fitness = ",g.fitness) 
-            filename = '{0}{1}'.format("reps-", current_generation)
-            with open(filename, 'wb') as f:
-                pickle.dump(best_genomes, f)        
-            # Hace request de CreateParam a syn
-            form_data = {"process_hash": "ph", "app_hash": "ah",
-                "parameter_link": my_url + "/genoms/" + filename,
-                "parameter_text": 0, "parameter_blob": "", "validation_hash": "",
-                "hash": "h", "performance": local_perf, "redir": "1", "username": "harveybc",
-                "pass_hash": "$2a$04$ntNHmofQoMoajG89mTEM2uSR66jKXBgRQJnCgqfNN38aq9UkN4Y6q"}
-            res = requests.post(
-                                my_url + "/parameters?username=harveybc&pass_hash=$2a$04$ntNHmofQoMoajG89mTEM2uSR66jKXBgRQJnCgqfNN38aq9UkN4Y6q&process_hash=ph",
-                                data=form_data)
-            res_json = res.json()
+        self.pending_syn = self.executor.submit(self._syn, my_url, best_genomes, local_perf, current_generation)
         return 0
-    
+
+    # background synchronization, returns (remote_perf, remote_reps) if the remote
+    # genomes are better than the local ones, None otherwise or if singularity fails
+    def _syn(self, my_url, best_genomes, local_perf, current_generation):
+        auth = {'username': self.username, 'pass_hash': self.pass_hash, 'process_hash': self.process_hash}
+        try:
+            # downloads process from singualrity to find last optimum
+            res = self.session.get(my_url + "/processes/1", params=auth, timeout=self.timeout)
+            res.raise_for_status()
+            cont = res.json()
+            last_optimum_id = cont['result'][0]['last_optimum_id']
+            # remote performance from results of request
+            remote_perf = cont['result'][0]['current_block_performance']
+            print('\nremote_performance =', remote_perf, '\nlocal_performance =', local_perf,
+                  '\nlast_optimum_id =', last_optimum_id)
+            # if local_perf < remote_perf, download remote_reps
+            if local_perf < remote_perf:
+                res_p = self.session.get(my_url + "/parameters/" + str(last_optimum_id), params=auth,
+                                         timeout=self.timeout)
+                res_p.raise_for_status()
+                cont_param = res_p.json()
+                print('\ncont_param =', cont_param)
+                # the genomes are decoded from memory, not written to disk nor unpickled
+                if cont_param['result'][0]['parameter_link'] is not None:
+                    genom_data = self.session.get(cont_param['result'][0]['parameter_link'], timeout=self.timeout)
+                    genom_data.raise_for_status()
+                    remote_reps = decode_genomes(genom_data.content, self.config)
+                    print('\nPARAMETERS DOWNLOADED: remote_reps=', remote_reps)
+                    return remote_perf, remote_reps
+            # if local_perf > remote_perf
+            if local_perf > remote_perf:
+                # upload best_genomes
+                print('***********************************************************')
+                print("\nNEW OPTIMUM")
+                for g in best_genomes:
+                    print("\nbest_genomes[i] = ",g.key,"  fitness = ",g.fitness)
+                filename = '{0}{1}'.format("reps-", current_generation)
+                with open(filename, 'wb') as f:
+                    f.write(encode_genomes(best_genomes))
+                # Hace request de CreateParam a syn
+                form_data = {"process_hash": self.process_hash, "app_hash": "ah",
+                    "parameter_link": my_url + "/genoms/" + filename,
+                    "parameter_text": 0, "parameter_blob": "", "validation_hash": "",
+                    "hash": "h", "performance": local_perf, "redir": "1", "username": self.username,
+                    "pass_hash": self.pass_hash}
+                res = self.session.post(my_url + "/parameters", params=auth, data=form_data, timeout=self.timeout)
+                res.raise_for_status()
+        except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+            # singularity outages do not stop the evolution, it is tried again next time
+            print('\nsingularity synchronization failed:', e)
+        return None
+
+    # replaces offspring of the population that are not evaluated yet (never its elites)
+    # with the remote genomes, the population must be speciated again after it
+    def apply_migrants(self, remote_perf, remote_reps):
+        # the node keys of the remote genomes come from the indexer of another process
+        reserve_node_keys(remote_reps, self.config)
+        offspring = [key for key, g in iteritems(self.population) if g.fitness is None]
+        random.shuffle(offspring)
+        for key, remote in zip(offspring, remote_reps):
+            print('\nREPLACED = ', key, 'remote_fitness=', remote.fitness)
+            del self.population[key]
+            # a new key from this population, so keys never collide
+            remote.key = next(self.reproduction.genome_indexer)
+            remote.fitness = None
+            self.population[remote.key] = remote
+
+    # waits for the running synchronization and releases the session
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
     def evaluate_pending(self,max_pending):
         # TODO:
         # VERIFY IF THERE ARE PENDING EVALUATIONS IN SINGULARITY
         # EVALUATE NUM_EVALUATIONS PENDING EVALUATIONS
         return 0
-    
\ No newline at end of file
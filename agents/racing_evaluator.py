@@ -0,0 +1,85 @@
+# library for racing evaluation of genomes across several training folds
+from __future__ import print_function
+import math
+import gym_forex.envs
+import neat
+import numpy as np
+from genome_evaluator import GenomeEvaluator, ENV_CLASS, ENV_KWARGS
+from population_network import create_network
+
+
+# evaluates the genomes with successive halving over the folds: all the genomes run
+# on one fold, then the best fraction of them runs on as many new folds as already
+# used, until the racers are min_racers or all the folds were used
+class RacingEvaluator(GenomeEvaluator):
+    # ts_f, vs_f: training and validation sets used by training_validation_score
+    # folds: training folds of the race, csv paths (ts1..ts12) or FoldRange handles
+    # fraction: fraction of the racers promoted in every round
+    # min_racers: the last racers are evaluated on all the remaining folds
+    def __init__(self, ts_f, vs_f, folds, fraction=0.5, min_racers=2, env_class=ENV_CLASS):
+        super(RacingEvaluator, self).__init__(ts_f, vs_f, num_workers=1, env_class=env_class)
+        self.fraction = fraction
+        self.min_racers = min_racers
+        env = getattr(gym_forex.envs, env_class)
+        self.fold_envs = []
+        for fold in folds:
+            if isinstance(fold, str):
+                self.fold_envs.append(env(dataset=fold, **ENV_KWARGS))
+            else:
+                self.fold_envs.append(env(fold=fold, **ENV_KWARGS))
+        # per genome key: (number of folds, mean score, standard error of the mean), the
+        # fitness of the eliminated genomes can be lower than their mean score
+        self.confidence = {}
+
+    def evaluate_genomes(self, genomes, config):
+        self.generation += 1
+        num_folds = len(self.fold_envs)
+        # the first fold rotates every generation, so no fold decides alone
+        order = [(self.generation + i) % num_folds for i in range(num_folds)]
+        nets = dict((gid, create_network(g, config)) for gid, g in genomes)
+        scores = dict((gid, []) for gid, g in genomes)
+        racers = [gid for gid, g in genomes]
+        # genomes eliminated in each round
+        eliminated = []
+        used = 0
+        episodes = 0
+        while used < num_folds:
+            if used == 0:
+                new = order[:1]
+            elif len(racers) <= self.min_racers:
+                new = order[used:]
+            else:
+                new = order[used:2 * used]
+            for f in new:
+                for gid in racers:
+                    scores[gid].append(self.score(nets[gid], self.fold_envs[f]))
+            episodes += len(new) * len(racers)
+            used += len(new)
+            # promotes the best racers by mean score
+            racers.sort(key=lambda gid: np.mean(scores[gid]), reverse=True)
+            promoted = max(self.min_racers, int(math.ceil(len(racers) * self.fraction)))
+            eliminated.append(racers[promoted:])
+            racers = racers[:promoted]
+        # the means of different folds are not comparable (an easy first fold gives the
+        # eliminated genomes high means), so the fitnesses of the genomes eliminated in a
+        # round are shifted below the fitnesses of all the genomes promoted in it
+        fitness = dict((gid, np.mean(s)) for gid, s in scores.items())
+        floor = min(fitness[gid] for gid in racers)
+        for out in reversed(eliminated):
+            if not out:
+                continue
+            shift = max(0.0, max(fitness[gid] for gid in out) - floor)
+            for gid in out:
+                fitness[gid] = min(fitness[gid] - shift, np.nextafter(floor, -np.inf))
+            floor = min(fitness[gid] for gid in out)
+        self.confidence = {}
+        self.genomes_h = []
+        for gid, genome in genomes:
+            s = scores[gid]
+            stderr = np.std(s, ddof=1) / math.sqrt(len(s)) if len(s) > 1 else float('inf')
+            self.confidence[gid] = (len(s), np.mean(s), stderr)
+            genome.fitness = fitness[gid]
+            self.genomes_h.append(genome)
+        n, mean, stderr = self.confidence[racers[0]]
+        print("Racing: {0} of {1} episodes, best {2:.3f} +- {3:.3f} on {4} folds".format(
+            episodes, len(genomes) * num_folds, mean, stderr, n))
@@ -0,0 +1,177 @@
+# library for a compact replay memory of ForexEnv4 transitions
+from __future__ import print_function
+import random
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """
+    Preallocated ring of transitions for agent_DDQN.
+
+    The observations of ForexEnv4 are num_columns identical market rows and
+    state_columns identical account rows. The market rows are a window over the
+    dataset, so only the tick is stored and they are rebuilt by
+    env.market_windows, the account rows of a state and its next state share
+    all but state_columns values, so obs_ticks + state_columns values store both.
+    The observations of a sample are rebuilt in a few vectorized operations.
+
+    capacity: maximum number of transitions, the oldest ones are replaced.
+    env:      the ForexEnv4 (unwrapped) of the transitions.
+    """
+
+    def __init__(self, capacity, env):
+        self.capacity = capacity
+        self.env = env
+        self.num_market = env.num_columns
+        self.num_state = env.state_columns
+        self.obs_ticks = env.obs_ticks
+        self.ticks = np.zeros(capacity, dtype=np.int32)
+        self.actions = np.zeros(capacity, dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float64)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.account = np.zeros((capacity, self.obs_ticks + self.num_state), dtype=np.float64)
+        # next slot and number of transitions
+        self.index = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    # returns the account values of a transition (the account window of state
+    # followed by the last num_state values of the one of next_state)
+    def window(self, state, next_state):
+        state = np.reshape(state, (-1, self.obs_ticks))
+        next_state = np.reshape(next_state, (-1, self.obs_ticks))
+        # the last row of an observation has the account values
+        if not np.array_equal(state[-1, self.num_state:], next_state[-1, :-self.num_state]):
+            raise ValueError("next_state is not the observation that follows state")
+        return np.concatenate([state[-1], next_state[-1, -self.num_state:]])
+
+    # stores a transition, tick: tick_count of info after the step of next_state
+    def add(self, state, action, reward, next_state, done, tick):
+        self.add_window(self.window(state, next_state), action, reward, done, tick)
+
+    # stores a transition from its account values, so the actors of other processes
+    # send only them and not the observations
+    def add_window(self, window, action, reward, done, tick):
+        i = self.index
+        self.ticks[i] = tick
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+        self.account[i] = window
+        self.index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    # observations (n x rows x obs_ticks) after ticks steps with the account windows
+    def _observations(self, ticks, account):
+        n = len(ticks)
+        market = self.env.market_windows(ticks)[:, None, :]
+        return np.concatenate([np.broadcast_to(market, (n, self.num_market, self.obs_ticks)),
+                               np.broadcast_to(account[:, None, :], (n, self.num_state, self.obs_ticks))], axis=1)
+
+    # returns the (states, actions, rewards, next_states, dones) arrays of
+    # batch_size different transitions chosen at random
+    def sample(self, batch_size):
+        indexes = np.array(random.sample(range(self.size), batch_size), dtype=np.intp)
+        return self._batch(indexes)
+
+    def _batch(self, indexes):
+        ticks = self.ticks[indexes]
+        account = self.account[indexes]
+        states = self._observations(ticks - 1, account[:, :self.obs_ticks])
+        next_states = self._observations(ticks, account[:, self.num_state:])
+        return states, self.actions[indexes].astype(np.intp), self.rewards[indexes], next_states, \
+            self.dones[indexes]
+
+
+class SumTree(object):
+    """
+    Binary tree of sums over capacity leaves stored in an array, node i has the
+    children 2i and 2i+1 and the root 1 has the total. Updating and finding
+    leaves take O(log n) and work on arrays of leaves at once, one numpy
+    operation per level of the tree.
+    """
+
+    def __init__(self, capacity):
+        self.depth = max(1, int(np.ceil(np.log2(capacity))))
+        self.leaves = 2 ** self.depth
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indexes):
+        return self.tree[self.leaves + np.asarray(indexes)]
+
+    def update(self, indexes, values):
+        nodes = self.leaves + np.asarray(indexes, dtype=np.intp)
+        self.tree[nodes] = values
+        for level in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    # returns the leaves where the prefix sums of values (in [0, total)) fall
+    def find(self, values):
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.intp)
+        for level in range(self.depth):
+            left = self.tree[2 * nodes]
+            # rounding never leads to an empty subtree
+            right = (values >= left) & (self.tree[2 * nodes + 1] > 0)
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer sampled in proportion to priority ** alpha, the priority of a
+    transition is its last absolute TD error (see update_priorities).
+
+    New transitions get the maximum priority times weight, a weight k gives a
+    transition the chances of storing it k times without the memory. The
+    samples come with their importance-sampling weights ((size * P) ** -beta
+    normalized by the batch maximum), beta grows by beta_increment per sample
+    until 1.
+
+    alpha:   0 samples uniformly, 1 fully in proportion to the priorities.
+    beta:    initial importance-sampling exponent.
+    epsilon: added to the TD errors so no transition gets priority 0.
+    """
+
+    def __init__(self, capacity, env, alpha=0.6, beta=0.4, beta_increment=0.001, epsilon=1e-6):
+        super(PrioritizedReplayBuffer, self).__init__(capacity, env)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.priorities = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def add(self, state, action, reward, next_state, done, tick, weight=1.0):
+        self.add_window(self.window(state, next_state), action, reward, done, tick, weight)
+
+    def add_window(self, window, action, reward, done, tick, weight=1.0):
+        i = self.index
+        super(PrioritizedReplayBuffer, self).add_window(window, action, reward, done, tick)
+        self.priorities.update([i], [weight * self.max_priority ** self.alpha])
+
+    # returns (states, actions, rewards, next_states, dones, indexes, weights), one
+    # transition of each of batch_size equal segments of the total priority
+    def sample(self, batch_size):
+        total = self.priorities.total()
+        segment = total / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        indexes = np.minimum(self.priorities.find(np.minimum(values, total)), self.size - 1)
+        probabilities = self.priorities.get(indexes) / total
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        return self._batch(indexes) + (indexes, weights)
+
+    # sets the priorities of sampled transitions from their TD errors
+    def update_priorities(self, indexes, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.priorities.update(indexes, priorities ** self.alpha)
@@ -0,0 +1,133 @@
+# Local stand-in for the singularity API used by PopulationSyn, for tests and offline
+# clusters. It keeps the processes and parameters in memory and serves the genome
+# files (reps-<generation>) written by the clients from a directory.
+#
+# Usage: python singularity_server.py [port] [directory]
+from __future__ import print_function
+import json
+import os
+import sys
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+# performance of a process without parameters
+INITIAL_PERFORMANCE = -10000000.0
+
+
+class SingularityHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints:
+
+    GET  /processes/<id>:  last_optimum_id and current_block_performance.
+    GET  /parameters/<id>: parameter_link and performance of a parameter.
+    POST /parameters:      creates a parameter (form data with performance and
+                           parameter_link), it becomes the optimum of process 1
+                           if its performance is better.
+    GET  /genoms/<name>:   contents of the file <name> of the directory.
+    """
+
+    def _send(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, result, code=200):
+        self._send(code, json.dumps({'result': result}).encode('utf-8'))
+
+    def do_GET(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        store = self.server.store
+        with store.lock:
+            if len(parts) == 2 and parts[0] == 'processes':
+                self._json([{'id': int(parts[1]), 'last_optimum_id': store.last_optimum_id,
+                             'current_block_performance': store.performance}])
+            elif len(parts) == 2 and parts[0] == 'parameters' and parts[1] in store.parameters:
+                self._json([store.parameters[parts[1]]])
+            elif len(parts) == 2 and parts[0] == 'genoms':
+                # only files of the directory, never a path
+                path = os.path.join(store.directory, os.path.basename(parts[1]))
+                if not os.path.isfile(path):
+                    self._json([], 404)
+                    return
+                with open(path, 'rb') as f:
+                    self._send(200, f.read(), 'application/octet-stream')
+            else:
+                self._json([], 404)
+
+    def do_POST(self):
+        parts = urlparse(self.path).path.strip('/').split('/')
+        length = int(self.headers.get('Content-Length', 0))
+        form = dict((k, v[0]) for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items())
+        store = self.server.store
+        if parts != ['parameters'] or 'performance' not in form:
+            self._json([], 400)
+            return
+        with store.lock:
+            store.next_id += 1
+            parameter = {'id': store.next_id, 'parameter_link': form.get('parameter_link'),
+                         'performance': float(form['performance'])}
+            store.parameters[str(store.next_id)] = parameter
+            if parameter['performance'] > store.performance:
+                store.performance = parameter['performance']
+                store.last_optimum_id = store.next_id
+            self._json([parameter])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SingularityStore(object):
+    # in-memory state of process 1
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.parameters = {}
+        self.next_id = 0
+        self.last_optimum_id = 0
+        self.performance = INITIAL_PERFORMANCE
+
+
+class SingularityServer(object):
+    """
+    Stand-in singularity server running in a background thread.
+
+    port:      TCP port (0 chooses a free one, see url).
+    directory: Directory of the genome files served by /genoms.
+    """
+
+    def __init__(self, port=3338, directory='.', host='127.0.0.1'):
+        self.httpd = ThreadingServer((host, port), SingularityHandler)
+        self.httpd.store = SingularityStore(directory)
+        self.url = 'http://{0}:{1}'.format(host, self.httpd.server_address[1])
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 3338
+    directory = sys.argv[2] if len(sys.argv) > 2 else '.'
+    server = SingularityServer(port, directory, host='0.0.0.0')
+    print("Singularity stand-in serving {0} on port {1}".format(directory, port))
+    server.httpd.serve_forever()
@@ -0,0 +1,265 @@
+# Step-throughput benchmark for the gym-forex environments.
+#
+# Runs fixed-seed random and scripted policies over the bundled datasets at
+# several obs_ticks sizes and dataset lengths and prints a JSON table with the
+# construction time, reset latency, steps/sec and peak memory per env version.
+#
+# Usage: python -m gym_forex.benchmark [--envs ForexEnv5 ForexEnv6] [--output bench.json]
+from __future__ import print_function
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from numpy import genfromtxt
+from gym_forex.envs import ForexEnv, ForexEnv2, ForexEnv3, ForexEnv4, ForexEnv5, ForexEnv6
+from gym_forex.envs.forex_env_multi import ForexEnvMulti
+
+# repository root, the bundled datasets are in <root>/datasets
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASETS = [os.path.join(ROOT_DIR, 'datasets', 'ts_15min_3m.CSV')]
+OBS_TICKS = [2, 48, 1440]
+LENGTHS = [2000, 6000]
+POLICIES = ['random', 'scripted']
+# parameters shared by all the envs
+CAPITAL = 10000
+LEVERAGE = 100
+SL = 500
+TP = 500
+VOLUME = 0.2
+
+
+def _forex_env(dataset, obs_ticks):
+    # ForexEnv has a fixed obs_ticks of 2
+    return ForexEnv(dataset=dataset)
+
+
+def _forex_env2(dataset, obs_ticks):
+    return ForexEnv2(dataset=dataset, volume=VOLUME, sl=SL, tp=TP, obs_ticks=obs_ticks)
+
+
+def _kwargs_env(env_class):
+    def factory(dataset, obs_ticks):
+        return env_class(dataset=dataset, volume=VOLUME, sl=SL, tp=TP, obsticks=obs_ticks,
+                         capital=CAPITAL, leverage=LEVERAGE)
+    return factory
+
+
+def _forex_env6(dataset, obs_ticks):
+    return ForexEnv6(dataset=dataset, num_features=16, capital=CAPITAL, min_sl=SL, min_tp=TP,
+                     max_sl=SL, max_tp=TP, max_volume=VOLUME, leverage=LEVERAGE, obsticks=obs_ticks)
+
+
+def _forex_env_multi(dataset, obs_ticks):
+    return ForexEnvMulti(csv_action=dataset, csv_observation=dataset, num_symbols=1, num_features=16,
+                         num_components=1, capital=CAPITAL, min_sl=SL, min_tp=TP, max_sl=SL, max_tp=TP,
+                         max_orders=1, max_volume=VOLUME, leverage=LEVERAGE, window_size=obs_ticks)
+
+
+# env version: (factory(dataset, obs_ticks), action format)
+# action formats: 'discrete' = 0:nop,1:buy,2:sell, 'tuple' = [discrete, vol, sl, tp],
+# 'box' = [tp, sl, volume, direction] in [-1,1]
+ENVS = {
+    'ForexEnv': (_forex_env, 'discrete'),
+    'ForexEnv2': (_forex_env2, 'tuple'),
+    'ForexEnv3': (_kwargs_env(ForexEnv3), 'discrete'),
+    'ForexEnv4': (_kwargs_env(ForexEnv4), 'discrete'),
+    'ForexEnv5': (_kwargs_env(ForexEnv5), 'discrete'),
+    'ForexEnv6': (_forex_env6, 'box'),
+    'ForexEnvMulti': (_forex_env_multi, 'box'),
+}
+
+
+class RandomPolicy(object):
+    """ Uniform random actions from a fixed-seed generator. """
+
+    def __init__(self, action_format, seed):
+        self.action_format = action_format
+        self.rng = np.random.RandomState(seed)
+
+    def __call__(self, tick):
+        if self.action_format == 'discrete':
+            return int(self.rng.randint(3))
+        if self.action_format == 'tuple':
+            return [int(self.rng.randint(3))] + list(self.rng.uniform(-1.0, 1.0, 3))
+        return self.rng.uniform(-1.0, 1.0, 4)
+
+
+class ScriptedPolicy(object):
+    """ Deterministic policy: opens a buy, later closes it with a sell, then waits. """
+
+    def __init__(self, action_format, period=50):
+        self.action_format = action_format
+        self.period = period
+
+    def __call__(self, tick):
+        phase = tick % self.period
+        # 1=buy, 2=sell, 0=nop
+        if phase == 0:
+            direction = 1
+        elif phase == self.period // 2:
+            direction = 2
+        else:
+            direction = 0
+        if self.action_format == 'discrete':
+            return direction
+        if self.action_format == 'tuple':
+            return [direction, 0.0, 0.0, 0.0]
+        return np.array([0.5, 0.5, 1.0, {0: 0.0, 1: 1.0, 2: -1.0}[direction]])
+
+
+def make_policy(name, action_format, seed):
+    if name == 'random':
+        return RandomPolicy(action_format, seed)
+    if name == 'scripted':
+        return ScriptedPolicy(action_format)
+    raise ValueError("Unknown policy: {0}".format(name))
+
+
+@contextlib.contextmanager
+def _silenced():
+    # the envs print every order and episode, keep the JSON output clean
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            yield
+
+
+def run_episode(env, policy, max_steps=None):
+    # runs one episode with policy and returns the number of steps
+    env.reset()
+    steps = 0
+    done = False
+    while not done:
+        observation, reward, done, info = env.step(policy(steps))
+        steps += 1
+        if max_steps is not None and steps >= max_steps:
+            break
+    return steps
+
+
+def bench_env(name, dataset, obs_ticks, policy_name, seed=0, resets=5, max_steps=None, memory=True):
+    # returns a dict with the measurements of an env version on a dataset
+    factory, action_format = ENVS[name]
+    row = {'env': name, 'dataset': os.path.basename(dataset), 'obs_ticks': obs_ticks,
+           'policy': policy_name, 'seed': seed}
+    try:
+        with _silenced():
+            t0 = time.perf_counter()
+            env = factory(dataset, obs_ticks)
+            row['construction_s'] = time.perf_counter() - t0
+            row['dataset_ticks'] = env.num_ticks
+            # some versions have a fixed observation window
+            row['obs_ticks'] = getattr(env, 'obs_ticks', obs_ticks)
+            t0 = time.perf_counter()
+            for i in range(0, resets):
+                env.reset()
+            row['reset_latency_s'] = (time.perf_counter() - t0) / resets
+            policy = make_policy(policy_name, action_format, seed)
+            t0 = time.perf_counter()
+            steps = run_episode(env, policy, max_steps)
+            elapsed = time.perf_counter() - t0
+            row['steps'] = steps
+            row['steps_per_sec'] = steps / elapsed if elapsed > 0 else None
+            if memory:
+                row['peak_memory_bytes'] = _peak_memory(factory, dataset, obs_ticks,
+                                                        make_policy(policy_name, action_format, seed),
+                                                        max_steps)
+    except Exception as e:
+        row['error'] = "{0}: {1}".format(type(e).__name__, e)
+    return row
+
+
+def _peak_memory(factory, dataset, obs_ticks, policy, max_steps):
+    # separate pass because tracemalloc slows down the timed run
+    tracemalloc.start()
+    try:
+        env = factory(dataset, obs_ticks)
+        run_episode(env, policy, max_steps)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def _dataset_slices(dataset, lengths, tmp_dir):
+    # writes the first <length> ticks of dataset as csv files, so all the env
+    # versions load (and time) a dataset of the same length
+    data = genfromtxt(dataset, delimiter=',', skip_header=0)
+    slices = []
+    for length in lengths:
+        if length >= len(data):
+            slices.append(dataset)
+            continue
+        name = "{0}_{1}.CSV".format(os.path.splitext(os.path.basename(dataset))[0], length)
+        path = os.path.join(tmp_dir, name)
+        np.savetxt(path, data[:length], delimiter=',', fmt='%.8f')
+        slices.append(path)
+    return slices
+
+
+def run(envs=None, datasets=None, obs_ticks=None, lengths=None, policies=None, seed=0,
+        resets=5, max_steps=None, memory=True):
+    # runs the benchmark matrix and returns the table as a dict
+    envs = envs or sorted(ENVS)
+    datasets = datasets or DATASETS
+    obs_ticks = obs_ticks or OBS_TICKS
+    lengths = lengths or LENGTHS
+    policies = policies or POLICIES
+    results = []
+    tmp_dir = tempfile.mkdtemp(prefix='gym_forex_bench_')
+    try:
+        for dataset in datasets:
+            for path in _dataset_slices(dataset, lengths, tmp_dir):
+                for ticks in obs_ticks:
+                    for name in envs:
+                        for policy_name in policies:
+                            row = bench_env(name, path, ticks, policy_name, seed, resets, max_steps, memory)
+                            # skip repetitions of envs with a fixed observation window
+                            if row['obs_ticks'] != ticks and 'error' not in row:
+                                continue
+                            row['source'] = os.path.basename(dataset)
+                            results.append(row)
+                            print("{0} {1} obs_ticks={2} ticks={3}: {4}".format(
+                                name, policy_name, ticks, row.get('dataset_ticks'),
+                                row.get('error') or "{0:.0f} steps/s".format(row['steps_per_sec'] or 0)),
+                                file=sys.stderr)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    meta = {'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'seed': seed, 'resets': resets,
+            'max_steps': max_steps, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='gym-forex env step-throughput benchmark')
+    parser.add_argument('--envs', nargs='+', choices=sorted(ENVS), help='env versions (default: all)')
+    parser.add_argument('--datasets', nargs='+', help='csv datasets (default: bundled ts_15min_3m)')
+    parser.add_argument('--obs-ticks', nargs='+', type=int, help='observation window sizes (default: 2 48 1440)')
+    parser.add_argument('--lengths', nargs='+', type=int, help='dataset lengths in ticks (default: 2000 6000)')
+    parser.add_argument('--policies', nargs='+', choices=POLICIES, help='policies (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resets', type=int, default=5, help='resets averaged for the reset latency')
+    parser.add_argument('--max-steps', type=int, default=None, help='maximum steps per episode')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory pass')
+    parser.add_argument('--output', help='write the JSON table to this file instead of stdout')
+    args = parser.parse_args(argv)
+    table = run(args.envs, args.datasets, args.obs_ticks, args.lengths, args.policies, args.seed,
+                args.resets, args.max_steps, not args.no_memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(table, f, indent=2)
+    else:
+        json.dump(table, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
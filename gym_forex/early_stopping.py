@@ -0,0 +1,70 @@
+import heapq
+
+
+class EarlyStopping(object):
+    """
+    Ends the episodes of genomes that can not reach the k best of a generation.
+
+    After every step the score of the episode plus max_tick_reward for each
+    remaining tick is an upper bound of the final fitness. If the env can not
+    close min_orders orders in the remaining ticks, the last step reward is
+    the fixed penalty of the env, -10*(1-num_closes/min_orders) (ForexEnv4,
+    ForexEnv5, ForexEnv6), and it replaces max_tick_reward in the bound. The
+    episode is stopped when the bound is lower than the threshold, the k-th
+    best fitness recorded in the generation, the bound is then used as fitness,
+    so a stopped genome still ranks below the k best. The threshold is passed
+    to stop(), so the episodes of other processes can use the threshold of
+    the fitnesses recorded by the main process.
+
+    k:               Number of best fitnesses that must be beaten.
+    max_tick_reward: Upper bound of the reward of a step.
+    """
+
+    def __init__(self, k, max_tick_reward):
+        self.k = k
+        self.max_tick_reward = max_tick_reward
+        self.generation = None
+        # min-heap with the k best fitnesses of the generation
+        self.best = []
+        self.stopped = 0
+
+    def start(self, generation):
+        # the recorded fitnesses are only comparable inside a generation
+        if generation != self.generation:
+            self.generation = generation
+            self.best = []
+            self.stopped = 0
+
+    def threshold(self):
+        # k-th best fitness of the generation, None until k are recorded
+        return self.best[0] if len(self.best) >= self.k else None
+
+    def bound(self, score, env):
+        # upper bound of the final fitness of an episode after a step
+        if env.episode_over:
+            return score
+        remaining = env.num_ticks - 1 - env.tick_count
+        min_orders = getattr(env, 'min_orders', 0)
+        # at most one close by sl/tp and one by the action per tick
+        max_closes = env.num_closes + 2 * remaining
+        if max_closes < min_orders:
+            last = -10.0 * (1 - (float(max_closes) / min_orders))
+        else:
+            last = self.max_tick_reward
+        return score + (remaining - 1) * self.max_tick_reward + last
+
+    def stop(self, score, env, threshold):
+        # returns the bound if the episode can be stopped, else None
+        bound = self.bound(score, env)
+        if bound < threshold:
+            return bound
+        return None
+
+    def record(self, fitness, stopped=False):
+        # the bound of a stopped episode is not a fitness, it is only counted
+        if stopped:
+            self.stopped += 1
+        elif len(self.best) < self.k:
+            heapq.heappush(self.best, fitness)
+        elif fitness > self.best[0]:
+            heapq.heapreplace(self.best, fitness)
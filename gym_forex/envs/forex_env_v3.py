@@ -7,6 +7,7 @@ import math
 import numpy as np
 import numpy
 from numpy import genfromtxt
+from gym_forex.fold_manager import require_no_warmup
 
 class ForexEnv3(gym.Env):
     """
@@ -21,6 +22,8 @@ class ForexEnv3(gym.Env):
     max_order_time: maximum order time.
     num_ticks: number of lastest ticks to be used as obs. (def:2)
     csv_f:   A path to a CSV file containing the timeseries.
+    fold:    (optional) A FoldRange from gym_forex.fold_manager used instead of csv_f,
+             without warmup ticks.
     symbol_num: The number of symbos in the timeseries.
     """
     metadata = {'render.modes': ['human']}
@@ -41,8 +44,10 @@ class ForexEnv3(gym.Env):
         self.obs_ticks = kwargs['obsticks'] # best 48@ 700k
         num_symbols = 1
         self.debug = 0  # Show debug msgs
-        csv_f = kwargs['dataset']
-        self.dataset = kwargs['dataset']
+        csv_f = kwargs.get('dataset')
+        self.dataset = csv_f
+        # optional FoldRange handle (gym_forex.fold_manager) used instead of the csv file
+        self.fold = kwargs.get('fold')
         self.initial_capital = self.capital
         self.equity = self.capital
         self.balance = self.capital
@@ -76,7 +81,13 @@ class ForexEnv3(gym.Env):
         # flag para representacion de observaciones 0=valores raw, 1=return
         self.use_return = 0
         # load csv file, The file must contain 16 cols: the 0 = HighBid, 1 = Low, 2 = Close, 3 = NextOpen, 4 = v, 5 = MoY, 6 = DoM, 7 = DoW, 8 = HoD, 9 = MoH, ..<6 indicators>
-        self.my_data = genfromtxt(csv_f, delimiter=',')
+        if self.fold is not None:
+            # the episode starts at the first tick of the view, it can not have warmup ticks
+            require_no_warmup(self.fold, 'ForexEnv3')
+            # zero-copy view over the dataset already loaded by the FoldManager
+            self.my_data = self.fold.data
+        else:
+            self.my_data = genfromtxt(csv_f, delimiter=',')
         # initialize number of ticks from from CSV
         self.num_ticks = len(self.my_data)
         # initialize number of columns from the CSV
@@ -88,30 +99,7 @@ class ForexEnv3(gym.Env):
         # Normalization method=0 deja los datos iguales, 1=normaliza, 2= estandariza, 3= estandariza y trunca a rango -1,1
         self.norm_method = 1
         # Initialize arrays for normalization and standarization (min,max, average, stddev)
-        self.max = self.num_columns * [-999999.0]
-        self.min = self.num_columns * [999999.0]
-        self.promedio = self.num_columns * [0.0]
-        self.stddev = self.num_columns * [0.0]
-        if self.norm_method > 0:
-            for i in range(0, self.num_ticks - 1):
-                # para cada columna
-                for j in range(0, self.num_columns - 1):
-                    # actualiza max y min
-                    if self.my_data[i, j] > self.max[j]:
-                        self.max[j] = self.my_data[i, j]
-                    if self.my_data[i, j] < self.min[j]:
-                        self.min[j] = self.my_data[i, j]
-                        # incrementa acumulador
-                        self.promedio[j] = self.promedio[j] + self.my_data[i, j]
-            self.promedio = [x / self.num_ticks for x in self.promedio]
-        if self.norm_method > 1:
-            for i in range(0, self.num_ticks - 1):
-                # para cada columna
-                for j in range(0, self.num_columns - 1):
-                    # calcula cuadrados de distancia a promedio
-                    self.stddev[j] = self.stddev[j] + (self.my_data[i, j] - self.promedio) ** 2
-        # calcula promedio y stddev
-        self.stddev = [(x / self.num_ticks) ** 0.5 for x in self.stddev]
+        self._normalization_stats()
         # reward function 0=equity variation, 1=Table
         self.reward_function = 0
         # IF REWARD TABLE IS USED, SET THE NUMBER OR STATE COLS TO 18?
@@ -390,6 +378,50 @@ class ForexEnv3(gym.Env):
         info = {"balance":self.balance, "tick_count":self.tick_count, "order_status":self.order_status}
         return ob, reward, self.episode_over, info
 
+    """
+    set_fold: replaces the dataset with another FoldRange of the same FoldManager,
+    rotating folds does not reload nor copy the dataset.
+    """
+
+    def set_fold(self, fold):
+        require_no_warmup(fold, 'ForexEnv3')
+        self.fold = fold
+        self.my_data = fold.data
+        self.num_ticks = len(self.my_data)
+        # normalization is relative to the ticks of the new fold
+        self._normalization_stats()
+        return self.reset()
+
+    """
+    _normalization_stats: calculates min, max, average and stddev of each column
+    """
+
+    def _normalization_stats(self):
+        self.max = self.num_columns * [-999999.0]
+        self.min = self.num_columns * [999999.0]
+        self.promedio = self.num_columns * [0.0]
+        self.stddev = self.num_columns * [0.0]
+        if self.norm_method > 0:
+            for i in range(0, self.num_ticks - 1):
+                # para cada columna
+                for j in range(0, self.num_columns - 1):
+                    # actualiza max y min
+                    if self.my_data[i, j] > self.max[j]:
+                        self.max[j] = self.my_data[i, j]
+                    if self.my_data[i, j] < self.min[j]:
+                        self.min[j] = self.my_data[i, j]
+                        # incrementa acumulador
+                        self.promedio[j] = self.promedio[j] + self.my_data[i, j]
+            self.promedio = [x / self.num_ticks for x in self.promedio]
+        if self.norm_method > 1:
+            for i in range(0, self.num_ticks - 1):
+                # para cada columna
+                for j in range(0, self.num_columns - 1):
+                    # calcula cuadrados de distancia a promedio
+                    self.stddev[j] = self.stddev[j] + (self.my_data[i, j] - self.promedio) ** 2
+        # calcula promedio y stddev
+        self.stddev = [(x / self.num_ticks) ** 0.5 for x in self.stddev]
+
     """
     _reset: coloca todas las variables en valores iniciales
     """
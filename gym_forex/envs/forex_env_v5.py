@@ -24,6 +24,7 @@ class ForexEnv5(gym.Env):
     max_order_time: maximum order time.
     num_ticks: number of lastest ticks to be used as obs. (def:2)
     csv_f:   A path to a CSV file containing the timeseries.
+    fold:    (optional) A FoldRange from gym_forex.fold_manager used instead of csv_f.
     symbol_num: The number of symbos in the timeseries.
     """
     metadata = {'render.modes': ['human']}
@@ -47,8 +48,10 @@ class ForexEnv5(gym.Env):
         self.obs_ticks = kwargs['obsticks'] # best 48@ 700k
         num_symbols = 1
         self.debug = 0  # Show debug msgs
-        csv_f = kwargs['dataset']
-        self.dataset = kwargs['dataset']
+        csv_f = kwargs.get('dataset')
+        self.dataset = csv_f
+        # optional FoldRange handle (gym_forex.fold_manager) used instead of the csv file
+        self.fold = kwargs.get('fold')
         self.initial_capital = self.capital
         self.equity = self.capital
         self.balance = self.capital
@@ -80,7 +83,11 @@ class ForexEnv5(gym.Env):
         # flag para representacion de observaciones 0=valores raw, 1=return
         self.use_return = 0
         # load csv file, The file must contain 16 cols: the 0 = HighBid, 1 = Low, 2 = Close, 3 = NextOpen, 4 = v, 5 = MoY, 6 = DoM, 7 = DoW, 8 = HoD, 9 = MoH, ..<6 indicators>
-        self.my_data = genfromtxt(csv_f, delimiter=',', skip_header=0)
+        if self.fold is not None:
+            # zero-copy view over the dataset already loaded by the FoldManager
+            self.my_data = self.fold.data
+        else:
+            self.my_data = genfromtxt(csv_f, delimiter=',', skip_header=0)
         # initialize number of ticks from from CSV
         self.num_ticks = len(self.my_data)
         # initialize number of columns from the CSV
@@ -380,6 +387,33 @@ class ForexEnv5(gym.Env):
         info = {"balance":self.balance, "tick_count":self.tick_count, "order_status":self.order_status, "num_closes":self.num_closes, "equity": self.equity}
         return ob, reward, self.episode_over, info
 
+    """
+    observation_matrix: flattened observations (column by column, oldest tick first, as
+    nn_format) used to choose the action of each tick, row k is the observation returned
+    before stepping tick obs_ticks + k. The observations do not depend on the account, so
+    a policy can be evaluated for all the ticks at once. start, stop: range of rows.
+    """
+
+    def observation_matrix(self, start=0, stop=None):
+        ticks = np.arange(self.obs_ticks, self.num_ticks - 1)[start:stop]
+        # previous obs_ticks ticks of each tick, oldest first
+        windows = self.my_data[ticks[:, None] - self.obs_ticks + np.arange(self.obs_ticks)[None, :]]
+        windows = windows.transpose(0, 2, 1)
+        # the last column is not pushed by step(), it keeps the values loaded by reset()
+        windows[:, -1, :] = self.my_data[0:self.obs_ticks, -1]
+        return windows.reshape(len(ticks), -1)
+
+    """
+    set_fold: replaces the dataset with another FoldRange of the same FoldManager,
+    rotating folds does not reload nor copy the dataset.
+    """
+
+    def set_fold(self, fold):
+        self.fold = fold
+        self.my_data = fold.data
+        self.num_ticks = len(self.my_data)
+        return self.reset()
+
     """
     _reset: coloca todas las variables en valores iniciales
     """
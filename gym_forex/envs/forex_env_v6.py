@@ -8,6 +8,7 @@ import numpy as np
 import numpy
 from numpy import genfromtxt
 import copy
+from gym_forex.step_profiler import StepProfiler
 
 class ForexEnv6(gym.Env):
     """
@@ -24,6 +25,8 @@ class ForexEnv6(gym.Env):
     max_order_time: maximum order time.
     num_ticks: number of lastest ticks to be used as obs. (def:2)
     csv_f:   A path to a CSV file containing the timeseries.
+    fold:    (optional) A FoldRange from gym_forex.fold_manager used instead of csv_f.
+    profiling: (optional) Enables the per-phase step timing reported by profile(). (def:False)
     symbol_num: The number of symbos in the timeseries.
     """
     metadata = {'render.modes': ['human']}
@@ -51,8 +54,10 @@ class ForexEnv6(gym.Env):
         self.obs_ticks = kwargs['obsticks'] # best 48@ 700k
         num_symbols = 1
         self.debug = 1  # Show debug msgs
-        csv_f = kwargs['dataset']
-        self.dataset = kwargs['dataset']
+        csv_f = kwargs.get('dataset')
+        self.dataset = csv_f
+        # optional FoldRange handle (gym_forex.fold_manager) used instead of the csv file
+        self.fold = kwargs.get('fold')
         self.initial_capital = self.capital
         self.equity = self.capital
         self.balance = self.capital
@@ -83,7 +88,11 @@ class ForexEnv6(gym.Env):
         # flag para representacion de observaciones 0=valores raw, 1=return
         self.use_return = 0
         # load csv file, The file must contain 16 cols: the 0 = HighBid, 1 = Low, 2 = Close, 3 = NextOpen, 4 = v, 5 = MoY, 6 = DoM, 7 = DoW, 8 = HoD, 9 = MoH, ..<6 indicators>
-        self.my_data = genfromtxt(csv_f, delimiter=',', skip_header=0)
+        if self.fold is not None:
+            # zero-copy view over the dataset already loaded by the FoldManager
+            self.my_data = self.fold.data
+        else:
+            self.my_data = genfromtxt(csv_f, delimiter=',', skip_header=0)
         # initialize number of ticks from from CSV
         self.num_ticks = len(self.my_data)
         # initialize number of columns from the CSV
@@ -117,6 +126,9 @@ class ForexEnv6(gym.Env):
         # TODO; Quitar cuando se controle SL Y TP
         self.sl = self.max_sl
         self.tp = self.max_tp
+        # per-phase step timing, it has no cost until it is enabled
+        self.profiler = StepProfiler(self)
+        self.set_profiling(kwargs.get('profiling', False))
         print ("Finished INIT function")
 
     """
@@ -415,6 +427,364 @@ class ForexEnv6(gym.Env):
         info = {"balance":self.balance, "tick_count":self.tick_count, "order_status":self.order_status, "num_closes":self.num_closes, "equity": self.equity}
         return ob, reward, self.episode_over, info
 
+    """
+    _phased_step: step() split in phase methods with the same behaviour, set_profiling()
+    makes it the step() of the env and times its phases, see profile(). A change of
+    step() must be made in the phases too, tests/test_step_profiler.py compares them.
+    """
+
+    def _phased_step(self, action):
+        Close, spread = self._update_profit()
+        # verify margin call, stop-loss and take-profit
+        self._check_closes()
+        if (self.episode_over == False):
+            self._execute_action(action, Close, spread)
+        # Calculates reward from RewardFunctionTable
+        reward = self._calculate_reward()
+        # Push values from timeseries into state
+        self._push_observation()
+        # matrix for the state(order status, equity variation, reward and statistics (from reward table))
+        ob = self.obs_matrix
+        # increment tick counter
+        self.tick_count = self.tick_count + 1
+        # update equity_Ant
+        self.equity_ant = self.equity
+        self.balance_ant = self.balance
+        self.reward = self.reward + reward
+        # Episode over es TRUE cuando se termina el juego, es decir cuando tick_count=self.num_ticks
+        if self.tick_count >= (self.num_ticks - 1):
+            self.episode_over = bool(1)
+            
+            # print('Done - Balance =', self.equity, ',  Reward =', self.reward, 'Time=', self.tick_count)
+            # self._reset()
+            # self.__init__()
+            # TODO: IMPRIMIR ESTADiSTICAS DE METATRADER
+        # end of step function.
+        info = self._build_info()
+        return ob, reward, self.episode_over, info
+
+    """
+    _update_profit: calculates the profit of the open order and the equity,
+    returns the Close price and the spread of the current tick
+    """
+
+    def _update_profit(self):
+        # read time_variables from CSV. Format: 0 = HighBid, 1 = Low, 2 = Close, 3 = NextOpen, 4 = v, 5 = MoY, 6 = DoM, 7 = DoW, 8 = HoD, 9 = MoH, ..<num_columns>
+        High = self.my_data[self.tick_count, 0]
+        Low = self.my_data[self.tick_count, 1]
+        Close = self.my_data[self.tick_count, 2]
+        DoW = self.my_data[self.tick_count, 11]
+        HoD = self.my_data[self.tick_count, 12]
+        
+        # Elevate spread  at 0 hours and if its weekend (DoW<=2 and Hour < 2)or(DoW>=5 and Hour > 23)
+        if (DoW < 1 or DoW > 5) or (HoD < 2 and HoD > 23):
+            spread = self.pip_cost * 60
+        else:
+            spread = self.pip_cost * 20
+
+        # Calculates profit
+        self.profit_pips = 0
+        self.real_profit = 0
+        # calculate for existing BUY order (status=1)
+        if self.order_status == 1:
+            # Low_Bid - order_open min and real profit pips (1 lot = 100000 units of currency)
+            self.profit_pips = ((Low - self.open_price) / self.pip_cost)
+            self.real_profit = self.profit_pips * self.pip_cost * self.order_volume * 100000
+        # calculate for existing SELL order (status=-1)
+        elif self.order_status == -1:
+            # Order_open - High_Ask (High+spread)
+            self.profit_pips = ((self.open_price - (High + spread)) / self.pip_cost)
+            self.real_profit = self.profit_pips * self.pip_cost * self.order_volume * 100000
+        else:
+            self.profit_pips = 0
+            self.real_profit = 0
+            
+        # Calculates equity
+        self.equity = self.balance + self.real_profit
+        return Close, spread
+
+    """
+    _check_closes: closes the open order by margin call, stop-loss or take-profit
+    """
+
+    def _check_closes(self):
+        # Verify if Margin Call
+       # self.episode_over = bool(0)
+        if self.equity < self.margin:
+            # Close order
+            self.order_status = 0
+            # Calculate new balance
+            self.balance = 0.0
+            # Calculate new balance
+            self.equity = 0.0
+            # reset margin
+            self.margin = 0.0
+            # reset profit in pips
+            self.profit_pips = 0
+            self.real_profit = 0
+            # Set closing cause 1 = Margin call
+            self.ant_c_c = self.c_c
+            self.c_c = 1
+            # End episode
+            self.episode_over = bool(1)
+            # TODO: ADICIONAR CONTROLES PARA SL Y TP ENTRE MAX_SL Y TP
+            # print transaction: Num,DateTime,Type,Size,Price,SL,TP,Profit,Balance
+            if self.debug == 1:
+                print('MARGIN CALL - Balance =', self.equity, ',  Reward =', self.reward-5, 'Time=', self.tick_count)
+        if (self.episode_over == False):
+            # Verify if close by SL
+            if self.profit_pips <= (-1 * self.sl):
+                # Close order
+                self.order_status = 0
+                # Calculate new balance
+                self.balance = self.equity
+                # resets margin
+                self.margin = 0.0
+                # print transaction: Num,DateTime,Type,Size,Price,SL,TP,Profit,Balance
+                if self.debug == 1:
+                    print(self.tick_count, ',stop_loss, pips:', self.profit_pips,' profit:', self.real_profit, ',b:', self.balance)
+                # Set closing cause 2 = sl
+                self.ant_c_c = self.c_c
+                self.c_c = 2
+                # reset profit in pips
+                self.profit_pips = 0
+                self.real_profit = 0
+                # increments number of orders counter
+                self.num_closes += 1
+            # Verify if close by TP
+            if self.profit_pips >= self.tp:
+                # Close order
+                self.order_status = 0
+                # Calculate new balance
+                self.balance = self.equity
+                # reset margin
+                self.margin = 0.0
+                # print transaction: Num,DateTime,Type,Size,Price,SL,TP,Profit,Balance
+                if self.debug == 1:
+                    print(self.tick_count, ',take_profit, pips:', self.profit_pips,' profit:', self.real_profit, ',b:', self.balance)
+                # Set closing cause 3 = tp
+                self.ant_c_c = self.c_c
+                self.c_c = 3
+                # reset profit in pips
+                self.profit_pips = 0
+                self.real_profit = 0
+                # increment the counter for the number of orders closed
+                self.num_closes += 1
+
+    """
+    _execute_action: opens or closes orders from the action
+    """
+
+    def _execute_action(self, action, Close, spread):
+        # TODO: Hacer opcion realista de ordenes que se ABREN Y CIERRAN solo si durante el siguiente minuto
+        #       el precio de la orden(close) no es high o low del siguiente candle.
+        
+        # Executes BUY action, order status  = 1
+        if (self.order_status == 0) and action[3] > 0:
+            self.order_status = 1
+            # open price = Ask (Close_bid+Spread)
+            self.open_price = Close + spread
+            # order_volume = lo que alcanza con rel_volume de equity
+            # Calcula sl y tp desde action space
+            #print("\naction=",action[0]);
+            self.tp = (self.max_tp) * (action[0])
+            self.sl = (self.max_sl) * (action[1])
+            #self.tp = self.min_tp + ((self.max_tp-self.min_tp) * ((action[0] + 1) / 2))
+            #self.sl = self.min_sl + ((self.max_sl-self.min_sl) * ((action[1] + 1) / 2))
+            #self.sl = self.max_sl
+            #self.tp = self.max_tp
+            # TODO: ADICIONAR VOLUME DESDE ACTION SPACE 
+            # a=Tuple((Discrete(3),  Box(low=-1.0, high=1.0, shape=3, dtype=np.float32)) # nop, buy, sell vol,tp,sl
+            #self.order_volume = self.equity * self.max_volume * self.leverage * ((action[2] + 1) / 2) / 100000
+            self.order_volume = self.equity * self.max_volume * self.leverage * action[2] / 100000
+            #self.order_volume = self.equity * self.max_volume * self.leverage / 100000
+            # redondear a volumenes minimos de 0.01
+            self.order_volume = math.trunc(self.order_volume * 100) / 100.0
+            # si volume menos del mínimo, hace volumen= mínimo TODO: QUITAR? CUANDO SE CALCULE VOLUME
+            if self.order_volume <= 0.01:
+                # close existing order
+                self.order_volume = 0.01
+                self.margin = 0
+            # set the new margin
+            self.margin = self.margin + (self.order_volume * 100000 / self.leverage)
+            # TODO: Colocar accion para tamano de lote con rel_volume como maximo al abrir una orden
+            self.order_time = self.tick_count
+            # print transaction: Num,DateTime,Type,Size,Price,SL,TP,margin,equity
+            if self.debug == 1:
+                print(self.tick_count, ',buy, o', self.open_price, ',v', self.order_volume, ' tp:', self.tp, ' sl:', self.sl, ' b:', self.balance)
+        
+        # Executes SELL action, order status  = 1
+        if (self.order_status == 0) and action[3] < 0:
+            self.order_status = -1
+            # open_price = Bid
+            self.open_price = Close
+            # Calcula sl y tp desde action space
+            # print("\naction=", action[0]);
+            # self.sl = self.max_sl 
+            # self.tp = self.max_tp
+            #self.tp = self.min_tp + ((self.max_tp-self.min_tp) * ((action[0] + 1) / 2))
+            #self.sl = self.min_sl + ((self.max_sl-self.min_sl) * ((action[1] + 1) / 2))
+            self.tp = (self.max_tp) * (action[0])
+            self.sl = (self.max_sl) * (action[1])
+            # TODO: ADICIONAR VOLUME DESDE ACTION SPACE 
+            # a=Tuple((Discrete(3),  Box(low=-1.0, high=1.0, shape=3, dtype=np.float32)) # nop, buy, sell vol,tp,sl
+            #self.order_volume = self.equity * self.max_volume * self.leverage/ 100000
+            self.order_volume = self.equity * self.max_volume * self.leverage * (action[2]) / 100000
+            # redondear a volumenes minimos de 0.01
+            self.order_volume = math.trunc(self.order_volume * 100) / 100.0
+            # set the new margin
+            self.margin = self.margin + (self.order_volume * 100000 / self.leverage)
+            self.order_time = self.tick_count
+            # TODO: Hacer version con controles para abrir y cerrar para buy y sell independientes,comparar
+            # print transaction: Num,DateTime,Type,Size,Price,SL,TP,Profit,Balance
+            if self.debug == 1:
+                print(self.tick_count, ',sell, o', self.open_price, ',v', self.order_volume, ' tp:', self.tp, ' sl:', self.sl, ' b:', self.balance)
+        
+        # Verify si ha pasado el min_order_time desde que se abrieron antes de cerrar
+        if ((self.tick_count - self.order_time) > self.min_order_time):
+            # Closes EXISTING SELL (-1) order with action=BUY (1)
+            if (self.order_status == -1) and action[3] > 0:
+                self.order_status = 0
+                # Calculate new balance
+                self.balance = self.equity
+                # reset margin
+                self.margin = 0.0
+                # print transaction: Num,DateTime,Type,Size,Price,SL,TP,Profit,Balance
+                if self.debug == 1:
+                    print(self.tick_count, ',close_sell, pips:', self.profit_pips,' profit:', self.real_profit, ',b:', self.balance)
+                # Set closing cause 0 = normal close
+                self.ant_c_c = self.c_c
+                self.c_c = 0
+                # reset profit in pips
+                self.profit_pips = 0
+                self.real_profit = 0
+                # increment counter for number of orders closed
+                self.num_closes += 1
+            #if action == 0 (nop), print status
+            if (self.order_status == -1) and action[3] == 0:
+                print(self.tick_count, ',o_sell, pips:', self.profit_pips,' profit:', self.real_profit, ',b:', self.balance)
+            # print("action=", action)
+            # Closes EXISTING BUY (1) order with action=SELL (2)
+            if (self.order_status == 1) and action[3] < 0:
+                self.order_status = 0
+                # Calculate new balance
+                self.balance = self.equity
+                # reset margin
+                self.margin = 0.0
+                # print transaction: Num,DateTime,Type,Size,Price,SL,TP,Profit,Balance
+                if self.debug == 1:
+                    print(self.tick_count, ',close_buy, pips:', self.profit_pips,' profit:', self.real_profit, ',b:', self.balance)
+                # Set closing cause 0 = normal close
+                self.ant_c_c = self.c_c
+                self.c_c = 0
+                # reset profit in pips
+                self.profit_pips = 0
+                self.real_profit = 0
+                # incrments counter of closed orders
+                self.num_closes += 1
+            if (self.order_status == 1) and action[3] == 0:
+                print(self.tick_count, ',o_buy, pips:', self.profit_pips,' profit:', self.real_profit, ',b:', self.balance)
+
+    """
+    _calculate_reward: reward of the current tick
+    """
+
+    def _calculate_reward(self):
+        equity_increment = self.equity - self.equity_ant
+        balance_increment = self.balance - self.balance_ant
+        if self.reward_function == 0:
+            # TODO: REWARD FUNCTION:  1=Tabla
+            bonus = ((self.equity - self.initial_capital) / self.num_ticks)
+            # reward = reward + bonus
+            reward = (balance_increment + bonus) / 2
+            # penaliza inactividad hasta alcanzar total de ticks con 5 para que tenga menos que los de balance positivo con mal comportamiento
+            #if equity_increment == 0.0:
+            #    reward = reward - (2*self.initial_capital / self.num_ticks)
+            # premia incrementos
+            #if equity_increment > 0.0:
+            #    reward = reward + (self.initial_capital / self.num_ticks)
+            
+            # penaliza hardly if less than min_orders/2 
+            if (self.num_closes < self.min_orders/2) and reward > 0:
+                reward = reward * (self.num_closes/self.min_orders)
+            if (self.num_closes < self.min_orders/2) and reward <= 0:
+                reward = reward - (self.initial_capital / self.num_ticks) * (1-(self.num_closes/self.min_orders))
+    
+            # penaliza lightly if less than min_orders
+            if (self.num_closes < self.min_orders) and reward <= 0:
+                reward = reward - ((self.initial_capital / (10*self.num_ticks))* (1-(self.num_closes/self.min_orders)))
+            # penaliza margin call
+            if self.c_c == 1:
+                reward = -(5.0 * self.initial_capital)
+            # penaliza red que no hace nada
+            if self.tick_count >= (self.num_ticks - 2):
+                if self.num_closes < self.min_orders:
+                    reward = -(10*self.initial_capital * (1 - (self.num_closes / self.min_orders)))
+                    self.balance = 0
+                    self.equity = 0
+                if self.equity == self.initial_capital:
+                    reward = -(10.0 * self.initial_capital)
+                    self.balance = 0
+                    self.equity = 0
+                    
+            reward = reward / self.initial_capital
+            # if self.order_status==0:
+            # TODO: penalizar reward con el cuadrado del tiempo que lleva sin orden * -0.01
+                # para evitar que sin acciones se obtenga ganancia 0 al final (deseado: -2, entonces variación=-2/num_ticks)
+                # TODO: Auto-calcular reward descontado por inectividad como función del total de ticks?
+                # reward=reward-0.00001 #Best result con 0.0001 (148k)
+        return reward
+
+    """
+    _push_observation: pushes the values of the current tick in the observation matrix
+    """
+
+    def _push_observation(self):
+        # 0 = HighBid, 1 = Low, 2 = Close, 3 = NextOpen, 4 = v, 5 = MoY, 6 = DoM, 7 = DoW, 8 = HoD, 9 = MoH, ..<num_columns>
+        for i in range(0, self.num_columns - 1):
+            self.obs_matrix[i].appendleft(self.my_data[self.tick_count, i])
+
+    """
+    _build_info: info dict returned by step
+    """
+
+    def _build_info(self):
+        return {"balance":self.balance, "tick_count":self.tick_count, "order_status":self.order_status, "num_closes":self.num_closes, "equity": self.equity}
+
+    """
+    set_profiling: enables or disables the per-phase timing of step()
+    """
+
+    def set_profiling(self, enabled):
+        if enabled:
+            self.profiler.install()
+        else:
+            self.profiler.uninstall()
+
+    """
+    profile: returns the accumulated nanoseconds per step phase (profit, sl_tp,
+    orders, reward, observation, info) and the counters of orders opened, closed
+    and margin calls since the profiling was enabled or the last reset.
+    """
+
+    def profile(self, reset=False):
+        report = self.profiler.report()
+        report['enabled'] = self.profiler.installed
+        if reset:
+            self.profiler.reset()
+        return report
+
+    """
+    set_fold: replaces the dataset with another FoldRange of the same FoldManager,
+    rotating folds does not reload nor copy the dataset.
+    """
+
+    def set_fold(self, fold):
+        self.fold = fold
+        self.my_data = fold.data
+        self.num_ticks = len(self.my_data)
+        return self.reset()
+
     """
     _reset: coloca todas las variables en valores iniciales
     """
@@ -0,0 +1,138 @@
+import numpy as np
+from numpy import genfromtxt
+
+
+class FoldRange(object):
+    """
+    Zero-copy handle to a contiguous range of ticks of a FoldManager dataset.
+
+    The handle is what the environments accept as their 'fold' parameter, the
+    data property is a numpy view over the array loaded once by the manager, so
+    creating or rotating handles never copies or reloads the dataset.
+
+    start, end: first and last+1 tick of the range evaluated by the env.
+    warmup:     number of ticks before start also included in the view.
+                ForexEnv5/6 start trading at the tick obs_ticks of the view,
+                so with warmup=obsticks the warmup ticks only fill the
+                observation window. ForexEnv3/4 trade from the first tick of
+                the view and only accept warmup=0 (see require_no_warmup).
+    """
+
+    def __init__(self, manager, start, end, warmup=0):
+        self.manager = manager
+        self.start = start
+        self.end = end
+        # the warmup can not go before the first tick of the dataset
+        self.warmup = min(warmup, start)
+
+    @property
+    def data(self):
+        # basic slicing of a numpy array returns a view, not a copy
+        return self.manager.data[self.start - self.warmup:self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return "FoldRange({0}, {1}, warmup={2})".format(self.start, self.end, self.warmup)
+
+
+# raises ValueError if fold has warmup ticks, for the envs that trade from the first
+# tick of their data (ForexEnv3/4), they would trade and score the warmup ticks
+def require_no_warmup(fold, env_name):
+    if fold is not None and fold.warmup != 0:
+        raise ValueError("{0} trades the warmup ticks of {1}, use a FoldManager with warmup=0".format(
+            env_name, fold))
+
+
+class Fold(object):
+    """
+    Train/validation split of a FoldManager dataset.
+
+    train, validation: lists of FoldRange, k-fold training sets may have two
+                       ranges (before and after the validation block), the
+                       walk-forward splits always have one range per set.
+    """
+
+    def __init__(self, index, train, validation):
+        self.index = index
+        self.train = train
+        self.validation = validation
+
+    def __repr__(self):
+        return "Fold({0}, train={1}, validation={2})".format(self.index, self.train, self.validation)
+
+
+class FoldManager(object):
+    """
+    Produces cross-validation splits as index ranges over one loaded dataset.
+
+    It replaces the hand-cut ts1..ts12 slices of the same timeseries: the CSV
+    is loaded once and every split is a set of FoldRange views over it.
+
+    __init__ parameters:
+
+    dataset: A path to a CSV file containing the timeseries (same format as
+             the environments).
+    data:    An already loaded array, used instead of dataset if given.
+    warmup:  Number of ticks before every range used to fill the observation
+             window of ForexEnv5/6, their obsticks. It must be 0 for ForexEnv3/4.
+    """
+
+    def __init__(self, dataset=None, data=None, warmup=0):
+        if data is None:
+            data = genfromtxt(dataset, delimiter=',', skip_header=0)
+        self.dataset = dataset
+        self.data = data
+        self.num_ticks = len(self.data)
+        self.warmup = warmup
+
+    def range(self, start, end):
+        # returns a handle for the ticks [start, end) of the dataset
+        if start < 0 or end > self.num_ticks or start >= end:
+            raise ValueError("Invalid range [{0}, {1}) for {2} ticks".format(start, end, self.num_ticks))
+        return FoldRange(self, start, end, self.warmup)
+
+    def k_fold(self, k):
+        # splits the dataset in k contiguous blocks, each block is used once
+        # as validation set and the remaining blocks as training set
+        if k < 2 or k > self.num_ticks:
+            raise ValueError("k must be between 2 and the number of ticks")
+        bounds = np.linspace(0, self.num_ticks, k + 1).astype(int)
+        folds = []
+        for i in range(0, k):
+            train = []
+            # blocks before the validation block form one contiguous range
+            if i > 0:
+                train.append(self.range(0, bounds[i]))
+            # blocks after the validation block form another contiguous range
+            if i < k - 1:
+                train.append(self.range(bounds[i + 1], self.num_ticks))
+            validation = [self.range(bounds[i], bounds[i + 1])]
+            folds.append(Fold(i, train, validation))
+        return folds
+
+    def rolling(self, train_size, validation_size, step=None):
+        # walk-forward splits with a fixed size training window that rolls
+        # forward by step ticks (default: validation_size)
+        return self._walk_forward(train_size, validation_size, step, anchored=False)
+
+    def anchored(self, train_size, validation_size, step=None):
+        # walk-forward splits where the training window always starts at the
+        # first tick and grows by step ticks (default: validation_size)
+        return self._walk_forward(train_size, validation_size, step, anchored=True)
+
+    def _walk_forward(self, train_size, validation_size, step, anchored):
+        if step is None:
+            step = validation_size
+        if train_size < 1 or validation_size < 1 or step < 1:
+            raise ValueError("train_size, validation_size and step must be positive")
+        folds = []
+        train_end = train_size
+        while train_end + validation_size <= self.num_ticks:
+            train_start = 0 if anchored else train_end - train_size
+            train = [self.range(train_start, train_end)]
+            validation = [self.range(train_end, train_end + validation_size)]
+            folds.append(Fold(len(folds), train, validation))
+            train_end += step
+        return folds
@@ -0,0 +1,97 @@
+import time
+
+# phases of ForexEnv6.step, in execution order
+PHASES = ['_update_profit', '_check_closes', '_execute_action', '_calculate_reward',
+          '_push_observation', '_build_info']
+# names of the phases in the profile() report
+PHASE_NAMES = {'_update_profit': 'profit', '_check_closes': 'sl_tp', '_execute_action': 'orders',
+               '_calculate_reward': 'reward', '_push_observation': 'observation', '_build_info': 'info'}
+
+
+class StepProfiler(object):
+    """
+    Opt-in per-phase timing of an env step.
+
+    The env has an inline step() and a phased_step with the same behaviour that
+    calls the phases as methods. install() makes phased_step the step() of the
+    env and shadows the phases with instance attributes that accumulate
+    perf_counter_ns around the original method and count orders opened, closed
+    and margin calls. uninstall() removes the instance attributes, so a disabled
+    profiler leaves the inline step() without extra calls.
+
+    env:         An env with the phase methods and the order_status and
+                 episode_over attributes (ForexEnv6).
+    phases:      Names of the phase methods to time.
+    phased_step: Name of the step method that calls the phases.
+    """
+
+    def __init__(self, env, phases=PHASES, phased_step='_phased_step'):
+        self.env = env
+        self.phases = phases
+        self.phased_step = phased_step
+        self.installed = False
+        # accumulated nanoseconds and calls per phase
+        self.time_ns = {}
+        self.calls = {}
+        self.reset()
+
+    def reset(self):
+        # the dicts are updated in place because the wrappers keep references to them
+        for phase in self.phases:
+            self.time_ns[phase] = 0
+            self.calls[phase] = 0
+        self.orders_opened = 0
+        self.orders_closed = 0
+        self.margin_calls = 0
+
+    def install(self):
+        if not self.installed:
+            for phase in self.phases:
+                setattr(self.env, phase, self._timed(phase, getattr(self.env, phase)))
+            self.env.step = getattr(self.env, self.phased_step)
+            self.installed = True
+
+    def uninstall(self):
+        if self.installed:
+            # removes the instance attributes, the class methods are used again
+            for phase in self.phases:
+                del self.env.__dict__[phase]
+            del self.env.__dict__['step']
+            self.installed = False
+
+    def _timed(self, phase, method):
+        env = self.env
+        time_ns = self.time_ns
+        calls = self.calls
+        perf_counter_ns = time.perf_counter_ns
+
+        def timed(*args):
+            order_status = env.order_status
+            episode_over = env.episode_over
+            t0 = perf_counter_ns()
+            result = method(*args)
+            time_ns[phase] += perf_counter_ns() - t0
+            calls[phase] += 1
+            # order events, counted outside of the timed section
+            if order_status == 0 and env.order_status != 0:
+                self.orders_opened += 1
+            # only the margin call ends the episode inside a phase
+            if env.episode_over and not episode_over:
+                self.margin_calls += 1
+            elif order_status != 0 and env.order_status == 0:
+                self.orders_closed += 1
+            return result
+        return timed
+
+    def report(self):
+        # returns a dict with total and mean nanoseconds per phase and the counters
+        phases = {}
+        for phase in self.phases:
+            calls = self.calls[phase]
+            phases[PHASE_NAMES.get(phase, phase)] = {
+                'total_ns': self.time_ns[phase],
+                'calls': calls,
+                'mean_ns': self.time_ns[phase] / calls if calls > 0 else 0.0}
+        return {'phases': phases, 'total_ns': sum(self.time_ns.values()),
+                'orders_opened': self.orders_opened, 'orders_closed': self.orders_closed,
+                'margin_calls': self.margin_calls}
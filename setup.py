@@ -8,6 +8,11 @@ setup (
        # Declare your packages' dependencies here, for eg:
        install_requires=['foo>=3'],
 
+       # env step-throughput benchmark (gym_forex/benchmark.py)
+       entry_points={
+           'console_scripts': ['gym-forex-benchmark=gym_forex.benchmark:main'],
+       },
+
        # Fill in these to make your Egg ready for upload to
        # PyPI
        author='HarveyD',
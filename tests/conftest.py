@@ -0,0 +1,64 @@
+# the agents import each other by module name, as when they are run from agents/
+import os
+import random
+import re
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'agents'))
+sys.path.insert(0, ROOT)
+
+import neat
+import pytest
+from agent_genome import AgentGenome
+
+CONFIG = os.path.join(ROOT, 'agents', 'config')
+
+# returns the neat.Config of agents/config with the values of some keys replaced,
+# e.g. num_inputs=32
+def load_config(**values):
+    if not values:
+        return neat.Config(AgentGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet,
+                           neat.DefaultStagnation, CONFIG)
+    with open(CONFIG) as f:
+        text = f.read()
+    for key, value in values.items():
+        text, count = re.subn(r'(?m)^{0}\s*=.*$'.format(key), '{0} = {1}'.format(key, value), text)
+        assert count == 1, key
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        return neat.Config(AgentGenome, neat.DefaultReproduction, neat.DefaultSpeciesSet,
+                           neat.DefaultStagnation, path)
+    finally:
+        os.remove(path)
+
+# returns num_genomes new genomes with keys 0..num_genomes-1, each mutated mutations times
+def new_genomes(config, num_genomes, mutations, seed):
+    random.seed(seed)
+    genomes = []
+    for key in range(num_genomes):
+        genome = AgentGenome(key)
+        genome.configure_new(config.genome_config)
+        for i in range(mutations):
+            genome.mutate(config.genome_config)
+        genomes.append(genome)
+    return genomes
+
+
+# a new config for every test, the genomes advance its node indexer
+@pytest.fixture
+def config():
+    return load_config()
+
+
+@pytest.fixture
+def make_config():
+    return load_config
+
+
+@pytest.fixture
+def make_genomes():
+    return new_genomes
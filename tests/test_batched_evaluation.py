@@ -0,0 +1,36 @@
+# the batched evaluation modes give the fitnesses of the serial evaluation
+import os
+from genome_evaluator import GenomeEvaluator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAINING_SET = os.path.join(ROOT, 'datasets', 'ts10_15min_3m.CSV')
+VALIDATION_SET = os.path.join(ROOT, 'datasets', 'ts11_15min_3m.CSV')
+
+
+def fitnesses(genomes, config, **kwargs):
+    evaluator = GenomeEvaluator(TRAINING_SET, VALIDATION_SET, num_workers=1, **kwargs)
+    try:
+        evaluator.evaluate_genomes([(g.key, g) for g in genomes], config)
+    finally:
+        evaluator.close()
+    return [g.fitness for g in genomes]
+
+
+def test_lockstep_matches_serial(config, make_genomes):
+    genomes = make_genomes(config, 20, 30, seed=11)
+    serial = fitnesses(genomes, config)
+    # the test is only meaningful if the genomes trade differently
+    assert len(set(serial)) > 1
+    assert fitnesses(genomes, config, lockstep=True) == serial
+
+
+# the observations of ForexEnv5 do not depend on the account, its networks have 32 inputs
+def test_time_axis_matches_serial(make_config, make_genomes):
+    config = make_config(num_inputs=32)
+    genomes = make_genomes(config, 20, 30, seed=12)
+    serial = fitnesses(genomes, config, env_class='ForexEnv5')
+    assert len(set(serial)) > 1
+    assert fitnesses(genomes, config, env_class='ForexEnv5', time_axis=True) == serial
+    # the early stopping bounds are the ones of the serial evaluation too
+    pruning = dict(env_class='ForexEnv5', prune_k=3, max_tick_reward=0.01, prune_round=8)
+    assert fitnesses(genomes, config, time_axis=True, **pruning) == fitnesses(genomes, config, **pruning)
@@ -0,0 +1,50 @@
+# the fitnesses with early stopping must not depend on the pool and its chunks
+import os
+from genome_evaluator import GenomeEvaluator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAINING_SET = os.path.join(ROOT, 'datasets', 'ts10_15min_3m.CSV')
+VALIDATION_SET = os.path.join(ROOT, 'datasets', 'ts11_15min_3m.CSV')
+
+
+def fitnesses(genomes, config, **kwargs):
+    evaluator = GenomeEvaluator(TRAINING_SET, VALIDATION_SET, prune_k=3, max_tick_reward=0.01,
+                                prune_round=8, **kwargs)
+    try:
+        evaluator.evaluate_genomes(genomes, config)
+    finally:
+        evaluator.close()
+    return [g.fitness for gid, g in genomes], evaluator
+
+
+def test_pool_matches_serial(config, make_genomes):
+    genomes = [(g.key, g) for g in make_genomes(config, 24, 30, seed=3)]
+    serial, evaluator = fitnesses(genomes, config, num_workers=1)
+    stopped = evaluator.stopped
+    # the test is only meaningful if some episodes were stopped
+    assert 0 < sum(stopped) < len(genomes)
+    for chunksize in (1, 6):
+        pooled, evaluator = fitnesses(genomes, config, num_workers=2, chunksize=chunksize)
+        assert pooled == serial
+        assert evaluator.stopped == stopped
+
+
+def test_bounds_are_not_cached(tmp_path, config, make_genomes):
+    genomes = [(g.key, g) for g in make_genomes(config, 24, 30, seed=3)]
+    cache = str(tmp_path / 'fitness.db')
+    evaluator = GenomeEvaluator(TRAINING_SET, VALIDATION_SET, num_workers=1, prune_k=3, max_tick_reward=0.01,
+                                prune_round=8, cache=cache)
+    try:
+        evaluator.evaluate_genomes(genomes, config)
+        stopped = sum(evaluator.stopped)
+        assert stopped > 0
+        assert len(evaluator.cache) == len(genomes) - stopped
+    finally:
+        evaluator.close()
+    # an evaluator without early stopping simulates the stopped genomes again
+    evaluator = GenomeEvaluator(TRAINING_SET, VALIDATION_SET, num_workers=1, cache=cache)
+    try:
+        evaluator.evaluate_genomes(genomes, config)
+        assert evaluator.cache.misses == stopped
+    finally:
+        evaluator.close()
@@ -0,0 +1,33 @@
+# folds of one dataset used by the envs
+import os
+import pytest
+from gym_forex.envs import ForexEnv4, ForexEnv5
+from gym_forex.fold_manager import FoldManager
+from genome_evaluator import ENV_KWARGS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET = os.path.join(ROOT, 'datasets', 'ts10_15min_3m.CSV')
+
+
+# returns the number of steps of an episode that does nothing
+def episode_steps(env):
+    env.reset()
+    steps = 1
+    while not env.step(0)[2]:
+        steps += 1
+    return steps
+
+
+def test_envs_trade_only_the_fold():
+    obsticks = ENV_KWARGS['obsticks']
+    # ForexEnv5 starts after obs_ticks ticks, the warmup ticks fill its window
+    fold = FoldManager(DATASET, warmup=obsticks).range(100, 200)
+    assert episode_steps(ForexEnv5(fold=fold, **ENV_KWARGS)) == len(fold) - 1
+    # ForexEnv4 starts at the first tick, the warmup ticks would be traded
+    with pytest.raises(ValueError):
+        ForexEnv4(fold=fold, **ENV_KWARGS)
+    env = ForexEnv4(fold=FoldManager(DATASET).range(0, 100), **ENV_KWARGS)
+    with pytest.raises(ValueError):
+        env.set_fold(fold)
+    env.set_fold(FoldManager(DATASET).range(100, 200))
+    assert episode_steps(env) == len(fold) - 1
@@ -0,0 +1,72 @@
+# round trip and invalid input of the binary genome format
+import json
+import struct
+import zlib
+import pytest
+from genome_codec import HEADER, MAGIC, VERSION, decode_genomes, encode_genomes
+
+
+@pytest.fixture
+def genomes(config, make_genomes):
+    genomes = make_genomes(config, 4, 20, seed=2)
+    for genome in genomes:
+        genome.fitness = float(genome.key)
+    return genomes
+
+
+# returns (header values, uncompressed body) of encoded data
+def unpack(data):
+    return list(HEADER.unpack_from(data)), zlib.decompress(data[HEADER.size:])
+
+
+def pack(header, body):
+    return HEADER.pack(*header) + zlib.compress(body)
+
+
+def test_round_trip(config, genomes):
+    decoded = decode_genomes(encode_genomes(genomes, dtype='float64'), config)
+    for genome, copy in zip(genomes, decoded):
+        assert copy.key == genome.key and copy.fitness == genome.fitness and copy.discount == genome.discount
+        assert sorted(copy.connections) == sorted(genome.connections)
+        for key, ng in genome.nodes.items():
+            assert (copy.nodes[key].bias, copy.nodes[key].activation) == (ng.bias, ng.activation)
+
+
+def test_invalid_header(config, genomes):
+    data = encode_genomes(genomes)
+    header, body = unpack(data)
+    with pytest.raises(ValueError):
+        decode_genomes(data[:HEADER.size - 1], config)
+    with pytest.raises(ValueError):
+        decode_genomes(b'XXXX' + data[4:], config)
+    with pytest.raises(ValueError):
+        decode_genomes(pack([MAGIC, VERSION + 1] + header[2:], body), config)
+    with pytest.raises(ValueError, match="float size"):
+        decode_genomes(pack([MAGIC, VERSION, 3, header[3]], body), config)
+    with pytest.raises(ValueError):
+        decode_genomes(data[:HEADER.size] + b'not zlib', config)
+
+
+def test_invalid_body(config, genomes):
+    header, body = unpack(encode_genomes(genomes))
+    meta_size = header[3]
+    for bad in (body[:meta_size + 2], body[:-1], body + b'\0', b'[]' + body[meta_size:]):
+        size = 2 if bad.startswith(b'[]') else meta_size
+        with pytest.raises(ValueError):
+            decode_genomes(pack(header[:3] + [size], bad), config)
+    # an activation index beyond the activations of the metadata
+    meta = json.loads(body[:meta_size].decode('utf-8'))
+    meta['activations'] = []
+    small = json.dumps(meta).encode('utf-8')
+    with pytest.raises(ValueError, match="activation"):
+        decode_genomes(pack(header[:3] + [len(small)], small + body[meta_size:]), config)
+    # names of functions that config does not know, or that are not names
+    for activations, aggregations in ((['clamped', 'unknown'], ['sum']), ([1], ['sum']), (['clamped'], [['sum']])):
+        meta = {'activations': activations, 'aggregations': aggregations}
+        other = json.dumps(meta).encode('utf-8')
+        with pytest.raises(ValueError, match="Unknown"):
+            decode_genomes(pack(header[:3] + [len(other)], other + body[meta_size:]), config)
+    # more genomes than the data has
+    more = body[:meta_size] + struct.pack('<I', 1000) + body[meta_size + 4:]
+    with pytest.raises(ValueError):
+        decode_genomes(pack(header, more), config)
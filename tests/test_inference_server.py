@@ -0,0 +1,49 @@
+# models loaded by the clients of the inference server
+import json
+import os
+import pickle
+import socket
+import threading
+import pytest
+from genome_codec import encode_genomes
+from inference_server import InferenceServer, ThreadedInferenceServer, make_env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET = os.path.join(ROOT, 'datasets', 'ts10_15min_3m.CSV')
+
+
+def test_clients_load_only_genome_files(tmp_path, config, make_genomes):
+    genomes = make_genomes(config, 3, 10, seed=29)
+    models = tmp_path / 'models'
+    models.mkdir()
+    (models / 'winners.gfx').write_bytes(encode_genomes(genomes))
+    (models / 'winner.pickle').write_bytes(pickle.dumps(genomes[0]))
+    (tmp_path / 'other.gfx').write_bytes(encode_genomes(genomes))
+    inference = InferenceServer(config, make_env(DATASET), genomes[:1], models_dir=str(models))
+    server = ThreadedInferenceServer(('127.0.0.1', 0), inference)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    connection = socket.create_connection(server.server_address)
+    stream = connection.makefile('rwb')
+
+    def ask(message):
+        stream.write((json.dumps(message) + '\n').encode('utf-8'))
+        stream.flush()
+        return json.loads(stream.readline().decode('utf-8'))
+
+    try:
+        assert ask({'load': ['winners.gfx']}) == {'models': 3}
+        # pickles are never unpickled for a client, nor files out of the models directory
+        for names in (['winner.pickle'], ['../other.gfx'], [str(tmp_path / 'other.gfx')], ['missing.gfx']):
+            assert 'error' in ask({'load': names})
+        assert len(inference.policy.genomes) == 3
+    finally:
+        stream.close()
+        connection.close()
+        server.shutdown()
+        server.server_close()
+    # without a models directory the clients can not load models
+    inference.models_dir = None
+    with pytest.raises(ValueError):
+        inference.load_files(['winners.gfx'])
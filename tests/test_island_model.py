@@ -0,0 +1,33 @@
+# migrants of other islands
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import neat
+from genome_codec import encode_genomes
+from island_model import MigrationReporter
+
+
+# the migrants and their offspring can grow nodes in the receiving island, whose node
+# indexer is behind the one of the island of the migrants
+def test_received_migrants_mutate(make_config, make_genomes):
+    source = make_config(node_add_prob=0.5)
+    migrants = make_genomes(source, 4, 60, seed=13)
+    config = make_config(node_add_prob=0.5)
+    pop = neat.Population(config)
+    inboxes = [queue.Queue()]
+    reporter = MigrationReporter(pop, 0, inboxes, [], 1, len(migrants))
+    for genome in pop.population.values():
+        genome.mutate_add_node(config.genome_config)
+    inboxes[0].put((1, encode_genomes(migrants)))
+    reporter.end_generation(config, pop.population, pop.species)
+    assert reporter.received == len(migrants)
+    # the migrants take the keys after the ones of the initial population
+    received = [g for key, g in pop.population.items() if key > config.pop_size]
+    assert len(received) == len(migrants)
+    for genome in received:
+        for i in range(20):
+            genome.mutate_add_node(config.genome_config)
+            genome.mutate(config.genome_config)
+    for genome in pop.population.values():
+        genome.mutate_add_node(config.genome_config)
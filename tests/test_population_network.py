@@ -0,0 +1,50 @@
+# batched networks of genomes and the cache of pruned genomes
+import gc
+import numpy as np
+from neat.nn import FeedForwardNetwork
+import population_network
+from population_network import CompiledNetwork, PopulationNetwork, create_network, prune_genome
+
+
+# pruned genomes must not outlive their genomes
+def test_prune_cache_drops_genomes(config, make_genomes):
+    gc.collect()
+    before = len(population_network._pruned), len(population_network._pruned_genomes)
+    genomes = make_genomes(config, 100, 10, seed=5)
+    nets = [create_network(g, config) for g in genomes]
+    pruned = prune_genome(genomes[0], config)
+    # the pruned genome is memoized and a pruned genome is not pruned again
+    assert prune_genome(genomes[0], config) is pruned
+    assert prune_genome(pruned, config) is pruned
+    assert len(population_network._pruned) == before[0] + 100
+    del genomes, nets, pruned
+    gc.collect()
+    assert (len(population_network._pruned), len(population_network._pruned_genomes)) == before
+
+
+# the batched networks are exact replacements of neat.nn.FeedForwardNetwork
+def test_population_network_matches_neat(make_config, make_genomes):
+    config = make_config(activation_options='clamped sigmoid tanh relu identity', activation_mutate_rate=0.3)
+    genomes = make_genomes(config, 30, 40, seed=7)
+    inputs = np.random.RandomState(7).uniform(-1.0, 1.0, (len(genomes), 25, len(config.genome_config.input_keys)))
+    expected = np.array([[FeedForwardNetwork.create(g, config).activate(x) for x in xs]
+                         for g, xs in zip(genomes, inputs)])
+    net = PopulationNetwork(genomes, config)
+    assert np.allclose(net.activate(inputs), expected, rtol=0.0, atol=1e-12)
+    assert np.allclose(net.activate(inputs[:, 0, :]), expected[:, 0, :], rtol=0.0, atol=1e-12)
+
+
+def test_compiled_network_matches_neat(make_config, make_genomes):
+    config = make_config(activation_options='clamped sigmoid tanh relu identity', activation_mutate_rate=0.3)
+    genomes = make_genomes(config, 30, 40, seed=8)
+    inputs = np.random.RandomState(8).uniform(-1.0, 1.0, (25, len(config.genome_config.input_keys)))
+    for genome in genomes:
+        expected = np.array([FeedForwardNetwork.create(genome, config).activate(x) for x in inputs])
+        # the dense and the sparse layers
+        for density in (0.0, 1.1):
+            net = CompiledNetwork(genome, config, sparse_density=density)
+            assert np.allclose(net.activate(inputs), expected, rtol=0.0, atol=1e-12)
+            for x, y in zip(inputs, expected):
+                assert np.allclose(net.activate(x), y, rtol=0.0, atol=1e-12)
+        net = CompiledNetwork(genome, config, dtype=np.float32)
+        assert np.allclose(net.activate(inputs), expected, rtol=0.0, atol=1e-5)
@@ -0,0 +1,58 @@
+# synchronization of populations through the stand-in singularity server
+import random
+import neat
+from population_syn import CREDENTIAL_VARIABLES, PopulationSyn
+from singularity_server import SingularityServer
+
+
+def fitness(value):
+    def evaluate(genomes, config):
+        for gid, genome in genomes:
+            genome.fitness = value + random.random()
+    return evaluate
+
+
+# runs generations and a synchronization that is waited for, returns the statistics
+def evolve(pop, url, value, generations):
+    stats = neat.StatisticsReporter()
+    pop.add_reporter(stats)
+    pop.run(fitness(value), generations)
+    pop.syn_singularity(4, url, stats, 0.0, generations, pop.config, None)
+    pop.pending_syn.exception()
+    return stats
+
+
+def test_migrants_replace_offspring(tmp_path, monkeypatch, make_config):
+    for name in CREDENTIAL_VARIABLES:
+        monkeypatch.setenv(name, 'test')
+    # the clients write the uploaded genomes in the working directory
+    monkeypatch.chdir(tmp_path)
+    server = SingularityServer(0, str(tmp_path)).start()
+    random.seed(17)
+    try:
+        # the better population uploads its best genomes
+        better = PopulationSyn(make_config())
+        stats = evolve(better, server.url, 10.0, 4)
+        uploaded = stats.best_unique_genomes(4)
+        assert server.httpd.store.last_optimum_id == 1
+        better.close()
+        # the worse population downloads them and applies them in its next synchronization
+        config = make_config()
+        worse = PopulationSyn(config)
+        stats = evolve(worse, server.url, -10.0, 1)
+        elites = dict((key, g) for key, g in worse.population.items() if g.fitness is not None)
+        keys = set(worse.population)
+        worse.syn_singularity(4, server.url, stats, 0.0, 1, config, None)
+        worse.close()
+    finally:
+        server.stop()
+    received = [worse.population[key] for key in set(worse.population) - keys]
+    assert len(received) == len(uploaded)
+    assert len(worse.population) == len(keys)
+    assert sorted(sorted(g.connections) for g in received) == sorted(sorted(g.connections) for g in uploaded)
+    assert all(g.fitness is None for g in received)
+    # the elites are never replaced
+    assert all(worse.population.get(key) is g for key, g in elites.items())
+    # the population goes on with the migrants
+    worse.species.speciate(config, worse.population, worse.generation)
+    worse.run(fitness(-10.0), 2)
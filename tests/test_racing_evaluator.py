@@ -0,0 +1,34 @@
+# the fitness order of the racing evaluator is the order of the race
+import os
+import racing_evaluator
+from racing_evaluator import RacingEvaluator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOLDS = [os.path.join(ROOT, 'datasets', 'ts{0}_15min_3m.CSV'.format(i)) for i in range(1, 5)]
+
+
+# the score of a genome is its key plus 10 in the easy fold and minus 10 in the others
+class FoldRacingEvaluator(RacingEvaluator):
+    def __init__(self, easy_fold, *args, **kwargs):
+        super(FoldRacingEvaluator, self).__init__(*args, **kwargs)
+        self.easy_fold = easy_fold
+
+    def score(self, genome, env):
+        easy = self.fold_envs.index(env) == self.easy_fold
+        return genome.key + (10.0 if easy else -10.0)
+
+
+def test_eliminated_genomes_rank_below_promoted(monkeypatch, config, make_genomes):
+    # the networks are the genomes, so score knows the genome
+    monkeypatch.setattr(racing_evaluator, 'create_network', lambda genome, config: genome)
+    genomes = make_genomes(config, 8, 0, seed=19)
+    # the first fold of the first generation is the easy one
+    evaluator = FoldRacingEvaluator(1, FOLDS[0], FOLDS[1], FOLDS, fraction=0.5, min_racers=2)
+    evaluator.evaluate_genomes([(g.key, g) for g in genomes], config)
+    ranking = [g.key for g in sorted(genomes, key=lambda g: g.fitness, reverse=True)]
+    assert ranking == [7, 6, 5, 4, 3, 2, 1, 0]
+    # the genomes that ran all the folds keep their mean score
+    assert (genomes[7].fitness, genomes[6].fitness) == (2.0, 1.0)
+    assert evaluator.confidence[7][:2] == (4, 2.0)
+    # the confidence has the mean score of the eliminated genomes
+    assert evaluator.confidence[3][:2] == (1, 13.0)
@@ -0,0 +1,44 @@
+# the profiled step of ForexEnv6 is a copy of its inline step, they must not diverge
+import os
+import numpy as np
+from gym_forex.envs import ForexEnv6
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET = os.path.join(ROOT, 'datasets', 'ts10_15min_3m.CSV')
+
+
+def make_env(max_volume, leverage, profiling):
+    return ForexEnv6(dataset=DATASET, num_features=16, capital=10000, min_sl=100, min_tp=100, max_sl=1000,
+                     max_tp=1000, max_volume=max_volume, leverage=leverage, obsticks=4, profiling=profiling)
+
+
+# returns the (observation, reward, done, info) of the steps of episodes with random actions
+def trajectory(env, episodes=3):
+    random = np.random.RandomState(23)
+    steps = []
+    for episode in range(episodes):
+        env.reset()
+        done = False
+        while not done:
+            action = random.uniform(-1.0, 1.0, 4)
+            action[3] = random.choice([-1, 0, 1])
+            observation, reward, done, info = env.step(action)
+            steps.append((np.array(observation).tolist(), reward, done, info))
+    return steps
+
+
+def test_profiled_step_matches_inline_step():
+    # orders closed by sl, tp and the agent, and margin calls with a large volume
+    for max_volume, leverage in ((0.2, 100), (5.0, 1000)):
+        env = make_env(max_volume, leverage, False)
+        expected = trajectory(env)
+        # reset() keeps some statistics of the previous episodes
+        expected_after = trajectory(env)
+        profiled = make_env(max_volume, leverage, True)
+        assert trajectory(profiled) == expected
+        report = profiled.profile()
+        assert report['enabled'] and report['orders_opened'] > 0
+        assert report['margin_calls' if max_volume > 1.0 else 'orders_closed'] > 0
+        # the inline step again after the profiling is disabled
+        profiled.set_profiling(False)
+        assert trajectory(profiled) == expected_after